@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Compares the two ways the browser can update a drawing when the thickness slider moves: parsing and evaluating the
+# laser:template of every path, or a multiply-add per expression with the tables the parameter control precomputes
+# (laser:template-coefficients, see addCoefficients in laserSVG_api.py).
+#
+#   python benchmarks/coefficients.py [--repeat 20] [--parts 500] [drawing.svg]
+#
+# Both are done the way lasersvg.js would do them, in Python, such that the ratio between them can be measured here.
+# It also reports how much the tables add to the size of the file.
+
+import argparse
+import os
+import re
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lxml import etree
+
+from laserSVG_core import LASER, LASER_NAMESPACE, ParameterModel, expandTemplate, registerNamespace
+from laserSVG_api import applySettings
+
+EXPRESSION = re.compile(r"\{(.*?)\}")
+
+# A slotted box side, the kind of part most templates describe
+PART = ('<path d="" laser:template="m {x} {y} h 10 v {{thickness}} h {{10+kerf}} v {{-thickness}} h 10 v {{thickness}} h {{10+kerf}} '
+        'v {{-thickness}} h 10 v 40 h {{-(50+2*kerf)}} z"/>')
+
+def generateDrawing(parts):
+    body = "\n".join(PART.format(x=(index % 40) * 70, y=(index // 40) * 60) for index in range(parts))
+    return ('<svg xmlns="http://www.w3.org/2000/svg" xmlns:laser="{}" laser:material-thickness="3" laser:kerf="0.1" '
+            'width="3000mm" height="3000mm" viewBox="0 0 3000 3000">\n{}\n</svg>\n').format(LASER_NAMESPACE, body)
+
+def templates(root):
+    for node in root.xpath("//*[@laser:template or @laser:template-segments]", namespaces={"laser": LASER_NAMESPACE}):
+        yield node, node.get(LASER + "template") or expandTemplate(node.get("d", ""), node.get(LASER + "template-segments"))
+
+# Every update parses the templates and evaluates their expressions
+def parseAndEvaluate(items, values):
+    for node, template in items:
+        pieces = EXPRESSION.split(template)
+        pieces[1::2] = [str(eval(expression, {}, values)) for expression in pieces[1::2]]
+        node.set("d", "".join(pieces))
+
+# The templates are split once when the document is loaded, an update only multiplies and adds
+def prepareTables(items):
+    prepared = []
+    for node, template in items:
+        pieces = EXPRESSION.split(template)
+        table = [float(number) for number in (node.get(LASER + "template-coefficients") or "").split()]
+        lines = {int(table[start]): (table[start + 1], table[start + 2]) for start in range(0, len(table), 3)}
+        # The expressions without a line are evaluated as before
+        rest = [(index, compile(pieces[2 * index + 1], "<expression>", "eval")) for index in range(len(pieces) // 2) if index not in lines]
+        prepared.append((node, pieces, [(2 * index + 1, offset, coefficient) for index, (offset, coefficient) in lines.items()], rest))
+    return prepared
+
+def evaluateTables(prepared, values):
+    thickness = values["thickness"]
+    for node, pieces, lines, rest in prepared:
+        for position, offset, coefficient in lines:
+            pieces[position] = str(offset + coefficient * thickness)
+        for index, code in rest:
+            pieces[2 * index + 1] = str(eval(code, {}, values))
+        node.set("d", "".join(pieces))
+
+def main():
+    pars = argparse.ArgumentParser(description="Compare evaluating the templates with the precomputed tables")
+    pars.add_argument("--repeat", type=int, default=20, help="Number of runs per measurement, the median is reported")
+    pars.add_argument("--parts", type=int, default=500, help="Number of parts of the generated drawing")
+    pars.add_argument("drawing", nargs="?", help="An SVG file instead of the generated drawing")
+    options = pars.parse_args()
+
+    registerNamespace()
+    parser = etree.XMLParser(huge_tree=True)
+    if options.drawing:
+        root = etree.parse(options.drawing, parser=parser).getroot()
+    else:
+        root = etree.fromstring(generateDrawing(options.parts).encode("utf-8"), parser=parser)
+    applySettings(root, root.get(LASER + "material-thickness") or 3, root.get(LASER + "kerf") or 0, interactive="true")
+    data = etree.tostring(root)
+    plain = len(data)
+    # As saved and loaded again, the script is only found once it is in the SVG namespace
+    root = etree.fromstring(data, parser=parser)
+    applySettings(root, root.get(LASER + "material-thickness") or 3, root.get(LASER + "kerf") or 0, interactive="true", coefficients="true")
+    withTables = len(etree.tostring(root))
+
+    items = list(templates(root))
+    prepared = prepareTables(items)
+    tabled = sum(len(lines) for _, _, lines, _ in prepared)
+    total = sum(len(lines) + len(rest) for _, _, lines, rest in prepared)
+    # A slider moving over the usual range of materials, with the custom parameters of the document at each step.
+    # Groups and layers with parameters of their own are not taken into account.
+    model = ParameterModel(root, targets=False)
+    derived = model.affected({"thickness"})
+    derived = [name for name in model.order if name in derived]
+    steps = [model.valuesAt(0, 1 + step * 0.25, derived) for step in range(37)]
+
+    def run(function, argument):
+        samples = []
+        for _ in range(options.repeat):
+            start = time.perf_counter()
+            for values in steps:
+                function(argument, values)
+            samples.append((time.perf_counter() - start) / len(steps))
+        return statistics.median(samples) * 1000
+
+    parsing = run(parseAndEvaluate, items)
+    tables = run(evaluateTables, prepared)
+    print("{} templates, {} of {} expressions in tables".format(len(items), tabled, total))
+    print("parse and evaluate the templates  {:>8.2f} ms per update".format(parsing))
+    print("multiply-add with the tables      {:>8.2f} ms per update ({:.1f}x)".format(tables, parsing / tables if tables else 0))
+    print("file size {} bytes, {} with the tables (+{:.1f}%)".format(plain, withTables, (withTables - plain) * 100 / plain))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Measures how long the extensions take to start. Inkscape runs a new Python process for every Apply and every
+# update of the live preview, so this is time the user waits for every time.
+#
+#   python benchmarks/startup.py [--repeat 10] [--top 8] [drawing.svg]
+#
+# For every extension module it reports the import time as measured by python -X importtime (the median of several
+# runs, in ms) and the heaviest imports. Then it runs the parameter control on a drawing, once with and once without
+# the headless code path, and once more with its result coming from the result cache.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["laserSVG_core", "laserSVG_control", "laserSVG_path_segments", "laserSVG_primitives", "laserSVG_joints",
+           "laserSVG_nesting", "laserSVG_gcode", "laserSVG_estimate", "laserSVG_validate", "laserSVG_cache",
+           "laserSVG_clean", "laserSVG_external_edit", "laserSVG_editor", "path_reverse", "path_to_relative"]
+
+DRAWING = """<svg xmlns="http://www.w3.org/2000/svg" xmlns:laser="http://www.heller-web.net/lasersvg/" laser:material-thickness="3" width="200mm" height="200mm" viewBox="0 0 200 200">
+<rect x="10" y="10" width="3" height="40" laser:thickness-adjust="width" laser:origin="center"/>
+<path d="m 20 10 h 10 v 3 h 10 v -3 h 10 v 40 h -30 z" laser:template="m 20 10 h 10 v {thickness} h 10 v {-thickness} h 10 v 40 h -30 z"/>
+</svg>
+"""
+
+# Returns a list of (depth, name, cumulative) in microseconds, from the output of -X importtime
+def importTimes(module):
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], cwd=ROOT,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Every level of nesting is indented by two more spaces
+        name = name[1:]
+        times.append(((len(name) - len(name.lstrip())) // 2, name.strip(), int(cumulative)))
+    return times
+
+# The imports done by _module_ itself, not the modules they import in turn. -X importtime lists a module after
+# everything it imported, so these are the entries one level deeper right before it.
+def directImports(times, module):
+    end = next(index for index, (depth, name, _) in enumerate(times) if depth == 0 and name == module)
+    start = end
+    while start > 0 and times[start - 1][0] > 0:
+        start -= 1
+    return [(cumulative, name) for depth, name, cumulative in times[start:end] if depth == 1]
+
+def wallTime(arguments, repeat, cache=False):
+    # The same run again would come from the result cache, unless it is turned off
+    environment = dict(os.environ, LASERSVG_CACHE_SIZE=os.environ.get("LASERSVG_CACHE_SIZE", "64") if cache else "0")
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, cwd=ROOT, stdout=subprocess.DEVNULL, check=True, env=environment)
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples) * 1000
+
+def main():
+    pars = argparse.ArgumentParser(description="Measure the startup time of the LaserSVG extensions")
+    pars.add_argument("--repeat", type=int, default=10, help="Number of runs per measurement, the median is reported")
+    pars.add_argument("--top", type=int, default=5, help="Number of heaviest imports to list per module")
+    pars.add_argument("drawing", nargs="?", help="The SVG file for the parameter control runs")
+    options = pars.parse_args()
+
+    print("{:<26} {:>10}   {}".format("module", "import ms", "heaviest imports (cumulative ms)"))
+    for module in MODULES:
+        runs = [importTimes(module) for _ in range(options.repeat)]
+        total = statistics.median(cumulative for run in runs for depth, name, cumulative in run if depth == 0 and name == module) / 1000
+        heaviest = sorted(directImports(runs[-1], module))[::-1]
+        print("{:<26} {:>10.1f}   {}".format(module, total, ", ".join("{} {:.1f}".format(name, cumulative / 1000) for cumulative, name in heaviest[:options.top])))
+
+    drawing = options.drawing
+    if drawing is None:
+        handle, drawing = tempfile.mkstemp(suffix=".svg")
+        with os.fdopen(handle, "w") as output:
+            output.write(DRAWING)
+    try:
+        print()
+        for headless in ("true", "false"):
+            milliseconds = wallTime(["laserSVG_control.py", "--material_thickness=4", "--headless=" + headless, drawing], options.repeat)
+            print("laserSVG_control.py --headless={:<6} {:>8.1f} ms".format(headless, milliseconds))
+        milliseconds = wallTime(["laserSVG_control.py", "--material_thickness=4", drawing], options.repeat, cache=True)
+        print("laserSVG_control.py from the cache   {:>8.1f} ms".format(milliseconds))
+    finally:
+        if options.drawing is None:
+            os.unlink(drawing)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,390 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The steps of the extensions as plain functions, for scripts and services that run them in their own process.
+# They take an lxml element or path data and their parameters, and keep no state between calls, such that they can be
+# called from several threads at once (as long as each thread works on its own document).
+# Only the slit mapping still needs inkex, all other functions only need lxml.
+#
+#   from lxml import etree
+#   from laserSVG_api import applySettings, tagElement
+#   root = etree.parse("box.svg").getroot()
+#   tagElement(root.find(".//*[@id='side']"), 3)
+#   applySettings(root, 4, kerf=0.1)
+
+import re
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+from lxml import etree
+
+from laserSVG_core import LASER, LASER_NAMESPACE, SVG, BUILTIN_PARAMETERS, END_POINT_ARGUMENTS, PathData, ParameterModel, PrimitiveColumns, adjustElementThickness, \
+    encodeTemplate, formatNumber, materialThickness, parseParameters, segmentLength, thicknessTerm, truncate
+
+SCRIPT_URL = "https://florianheller.github.io/lasersvg/lasersvg.js"
+XLINK = "{http://www.w3.org/1999/xlink}"
+# The root attribute of each built-in parameter
+BUILTIN_ATTRIBUTES = {name: attribute for name, attribute, _ in BUILTIN_PARAMETERS}
+
+# The parameter control
+# Without _groups_, the settings are the ones of the whole document. Selected groups and layers get a material of
+# their own instead, which everything inside them uses (see ParameterModel).
+def applySettings(root, thickness, kerf=0, action="cut", interactive="false", scale=100, parameters="", groups=(), coefficients="false"):
+    scopes = list(groups) or [root]
+    #Save the old thickness
+    oldThicknesses = [materialThickness(scope) for scope in scopes]
+
+    # Set/Update the thickness, kerf, and laser action in the SVG root node or the groups
+    for scope in scopes:
+        scope.set(LASER + "material-thickness", str(thickness))
+        scope.set(LASER + "kerf", str(kerf))
+        scope.set(LASER + "action", str(action))
+    scale = float(scale) / 100
+    if not groups and (scale != 1 or root.get(LASER + "scale") is not None):
+        root.set(LASER + "scale", str(scale))
+
+    model = ParameterModel(root)
+    # adjust the thickness on all elements that use it
+    for scope, oldThickness in zip(scopes, oldThicknesses):
+        adjustElementThickness(root, thickness, oldThickness, model.primitivesOf(model.scopeOf(scope)))
+    # and re-evaluate the templates and attribute expressions. The document might have been edited since the last
+    # run, so all of them, not only the ones that use a parameter that changed.
+    model.update(parseParameters(parameters), everything=True)
+    model.store()
+
+    if interactive == 'true':
+        addScript(root)
+    # The tables of an earlier run might not match the templates and parameters anymore
+    removeCoefficients(root)
+    if interactive == 'true' and coefficients == 'true':
+        addCoefficients(model)
+    return oldThicknesses[0]
+
+# Check if there is a reference to the JS and CSS already, otherwise add it
+# While workin on the file, Inkscape requires the SVG namespace in front of SVG element, even though the prefix will be removed while saving.
+def addScript(root):
+    if not root.findall(".//{}script[@{}href='{}']".format(SVG, XLINK, SCRIPT_URL)):
+        scriptElement = etree.SubElement(root, "script")
+        scriptElement.set("type", "text/javascript")
+        scriptElement.set(XLINK + "href", SCRIPT_URL)
+
+# Precomputed tables for lasersvg.js, such that the browser can update the paths with a multiply-add per expression
+# instead of parsing and evaluating the templates whenever the thickness changes. laser:template-coefficients holds
+# the triples (expression index, offset, coefficient) as a flat list of numbers, the expressions that are missing
+# aren't linear in the thickness and have to be evaluated from the template. Files without tables work as before.
+def addCoefficients(model):
+    for index, table in model.coefficients().items():
+        model.targets[index][0].set(LASER + "template-coefficients", " ".join(formatNumber(number) for entry in table for number in entry))
+
+def removeCoefficients(root):
+    for node in root.xpath("//*[@laser:template-coefficients]", namespaces={"laser": LASER_NAMESPACE}):
+        del node.attrib[LASER + "template-coefficients"]
+
+# The selected elements, for the scope "selection". Without a selection the settings would silently go to the whole
+# document, so that is an error.
+def selectedGroups(root, scope, ids):
+    if scope != "selection":
+        return []
+    groups = [node for elementID in ids or () for node in root.xpath("//*[@id=$id]", id=elementID)]
+    if not groups:
+        raise ValueError("Please select a group or layer")
+    return groups
+
+
+# The path editor
+
+# The multiples of the thickness to look for, e.g., "0.5, 1, 2" for rabbets, slits, and double slots
+def parseMultiples(text):
+    multiples = tuple(float(multiple) for multiple in re.split(r"[\s,;]+", str(text).strip()) if multiple)
+    if not multiples or min(multiples) <= 0:
+        raise ValueError("The multiples of the thickness have to be positive numbers: {}".format(text))
+    return multiples
+
+# The one of _multiples_ of _thickness_ that _length_ is closest to, or None if it isn't within _tolerance_ of any
+def closestMultiple(length, thickness, multiples=(1,), tolerance=0.15):
+    distance, multiple = min((abs(length - multiple * thickness), multiple) for multiple in multiples)
+    return multiple if distance < tolerance else None
+
+# The arguments of a relative command with its end point tagged, or None if its chord is not as long as one of the
+# _multiples_ of _thickness_. Control points, radii, and flags stay as they are, moves don't cut anything and are left alone.
+def tagArguments(letter, args, thickness, tolerance=0.15, roundThickness=True, multiples=(1,)):
+    length = segmentLength(letter, args)
+    multiple = None if length is None else closestMultiple(length, thickness, multiples, tolerance)
+    if multiple is None:
+        return None
+    args = list(args)
+    for index in END_POINT_ARGUMENTS[letter]:
+        if index is not None:
+            args[index] = thicknessTerm(args[index] / thickness, roundThickness, multiple)
+    return args
+
+# The segment lengths of many paths, sorted, such that the segments close to a length are found with a binary search
+# instead of by checking every segment. The address of a segment is the key of its path and the index of its command.
+class LengthIndex(object):
+
+    def __init__(self):
+        self.entries = []
+        self.keys = set()
+        self.lengths = None
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    # Adds a path, as its relative commands
+    def add(self, key, commands):
+        self.keys.add(key)
+        for index, (letter, args) in enumerate(commands):
+            length = segmentLength(letter, args)
+            if length is not None:
+                self.entries.append((length, index, key))
+        self.lengths = None
+
+    # The segments within _tolerance_ of any of the _multiples_ of _thickness_, as {key: {segment index: multiple}}.
+    # A segment that is close to more than one of them gets the closest.
+    def match(self, thickness, multiples=(1,), tolerance=0.15):
+        if self.lengths is None:
+            self.entries.sort(key=lambda entry: entry[0])
+            self.lengths = [entry[0] for entry in self.entries]
+        closest = {}
+        for multiple in multiples:
+            target = multiple * thickness
+            start = bisect_right(self.lengths, target - tolerance)
+            for position in range(start, bisect_left(self.lengths, target + tolerance, start)):
+                distance = abs(self.lengths[position] - target)
+                if position not in closest or distance < closest[position][0]:
+                    closest[position] = (distance, multiple)
+        matches = {}
+        for position, (_, multiple) in closest.items():
+            _, index, key = self.entries[position]
+            matches.setdefault(key, {})[index] = multiple
+        return matches
+
+# The template of path data _d_, with all segments as long as one of the _multiples_ of _thickness_ tagged, or only
+# the ones with the given indices. _segments_ can also map the indices to the multiple they were matched to.
+def tagPath(d, thickness, tolerance=0.15, roundThickness=True, segments=None, multiples=(1,)):
+    commands = []
+    for index, (letter, args) in enumerate(PathData.parse(d).relative()):
+        if segments is None:
+            tagged = tagArguments(letter, args, thickness, tolerance, roundThickness, multiples)
+        elif index in segments:
+            tagged = tagArguments(letter, args, thickness, tolerance, roundThickness, (segments[index],) if isinstance(segments, dict) else multiples)
+        else:
+            tagged = None
+        commands.append(" ".join([letter] + [formatNumber(arg) if tagged is None else arg if isinstance(arg, str) else formatNumber(arg) for arg in (tagged or args)]))
+    return " ".join(commands)
+
+# Stores the template either in full or, for the compact encoding, only its tagged segments
+def storeTemplate(node, template, encoding="full"):
+    # The table belongs to the old template, the parameter control writes a new one
+    node.attrib.pop(LASER + "template-coefficients", None)
+    if encoding == "compact":
+        node.set(LASER + "template-segments", encodeTemplate(str(template)))
+        node.attrib.pop(LASER + "template", None)
+    else:
+        node.set(LASER + "template", str(template))
+        node.attrib.pop(LASER + "template-segments", None)
+
+# Tags a path element, at the thickness of its material unless one is given, and returns the template
+def tagElement(node, thickness=None, tolerance=0.15, roundThickness=True, segments=None, encoding="full", multiples=(1,)):
+    if thickness is None:
+        thickness = materialThickness(node)
+    template = tagPath(node.get("d", ""), float(thickness), tolerance, roundThickness, segments, multiples)
+    storeTemplate(node, template, encoding)
+    return template
+
+# Tags the slits with the given segment indices in the path with id _pathID_, and returns its template.
+# The geometry of the slits is calculated by the path editor, which needs inkex. Every call works on its own copy of
+# the document and its own instance of the extension.
+def tagSlits(root, pathID, segments, assumeParallel=False, tolerance=0.15, roundThickness=True, encoding="full"):
+    import inkex
+    from laserSVG_path_segments import LaserSVG
+    extension = LaserSVG()
+    extension.options = extension.arg_parser.parse_args(["--tolerance={}".format(tolerance), "--encoding={}".format(encoding),
+                                                          "--assume_parallel={}".format(str(assumeParallel).lower()),
+                                                          "--round_thickness={}".format(str(roundThickness).lower())])
+    extension.threshold = float(tolerance)
+    extension.document = inkex.load_svg(etree.tostring(root))
+    extension.svg = extension.document.getroot()
+    extension.tagSlitsInPath(extension.svg.getElementById(pathID), segments)
+    tagged = extension.svg.getElementById(pathID)
+    node = root.xpath("//*[@id=$id]", id=pathID)[0]
+    for attribute in ("template", "template-segments"):
+        value = tagged.get(LASER + attribute)
+        if value is None:
+            node.attrib.pop(LASER + attribute, None)
+        else:
+            node.set(LASER + attribute, value)
+    return tagged.get(LASER + "template") or tagged.get(LASER + "template-segments")
+
+
+# Clean: the path data without segments shorter than _threshold_. Moves and closing commands have no length, but they
+# are still needed.
+def cleanPath(d, threshold=0.0001):
+    cleanedPath = PathData()
+    for letter, args in PathData.parse(d).relative():
+        length = segmentLength(letter, args)
+        if length is None or length > threshold:
+            cleanedPath.append(letter, args)
+    return str(cleanedPath)
+
+# Reverse: the path data traversed in the opposite direction, the last subpath becomes the first.
+# Smooth curves are written out as full curves, as their control points depend on the segment before them.
+def reversePath(d):
+    subpaths = []
+    x, y, startX, startY = 0.0, 0.0, 0.0, 0.0
+    control = None
+    for letter, args in PathData.parse(d).absolute():
+        previous = (x, y)
+        if letter == "M":
+            x, y = startX, startY = args
+            subpaths.append([(x, y), [], False])
+            control = None
+            continue
+        if not subpaths:
+            subpaths.append([(x, y), [], False])
+        segments = subpaths[-1][1]
+        if letter == "Z":
+            subpaths[-1][2] = True
+            x, y = startX, startY
+            # A new subpath starts at the same point unless there is a move
+            subpaths.append([(x, y), [], False])
+            control = None
+            continue
+        if letter == "H":
+            letter, args = "L", (args[0], y)
+        elif letter == "V":
+            letter, args = "L", (x, args[0])
+        elif letter == "S":
+            first = (2 * x - control[0], 2 * y - control[1]) if control and control[2] == "C" else (x, y)
+            letter, args = "C", first + tuple(args)
+        elif letter == "T":
+            first = (2 * x - control[0], 2 * y - control[1]) if control and control[2] == "Q" else (x, y)
+            letter, args = "Q", first + tuple(args)
+        segments.append((letter, tuple(args), previous))
+        x, y = args[-2], args[-1]
+        control = (args[-4], args[-3], letter) if letter in "CQ" else None
+
+    result = PathData()
+    for start, segments, closed in reversed(subpaths):
+        if not segments and not closed:
+            continue
+        end = (segments[-1][1][-2], segments[-1][1][-1]) if segments else start
+        if closed:
+            # The closing line runs back to the start, reversed the path starts there and runs along it first
+            result.append("M", start)
+            if end != start:
+                result.append("L", end)
+        else:
+            result.append("M", end)
+        for index, (letter, args, previous) in enumerate(reversed(segments)):
+            if closed and letter == "L" and index == len(segments) - 1:
+                # Closing the subpath draws this line anyway
+                break
+            if letter == "C":
+                result.append("C", args[2:4] + args[0:2] + previous)
+            elif letter == "Q":
+                result.append("Q", args[0:2] + previous)
+            elif letter == "A":
+                result.append("A", args[0:4] + (1 - args[4],) + previous)
+            else:
+                result.append("L", previous)
+        if closed:
+            result.append("Z", ())
+    return str(result)
+
+
+# Variants: writes the same document with many different parameters, e.g., one file per material thickness.
+# The document is serialized once, into the bytes that never change and slots for the attributes that depend on the
+# parameters: the evaluated templates and attributes, the geometry of the thickness-adjusted primitives, and the
+# settings on the root. A variant only evaluates what changed and writes the fragments and slots one after the other.
+#
+#   writer = VariantWriter(root, {"thickness": 3})
+#   for thickness in (3, 4, 5):
+#       with open("box-{}.svg".format(thickness), "wb") as output:
+#           writer.write({"thickness": thickness}, output)
+class VariantWriter(object):
+
+    SLOT = "{{lasersvg-slot:{}}}"
+    GEOMETRY = ("x", "y", "width", "height", "r", "rx", "ry")
+
+    def __init__(self, root, parameters=None):
+        self.root = root
+        self.model = ParameterModel(root)
+        # The primitives remember their position at the thickness of the document, every variant starts from there
+        self.baseThickness = self.thickness = self.model.values["thickness"]
+        self.primitives = PrimitiveColumns(self.model.primitivesOf(0), self.baseThickness)
+        # Every attribute that can change gets set once, such that all slots exist before the document is serialized
+        self.apply(parameters or {}, everything=True)
+
+        slots = [(root, LASER + attribute) for _, attribute, _ in BUILTIN_PARAMETERS if root.get(LASER + attribute) is not None]
+        slots.extend((node, attribute) for node, attribute, _, _, _ in self.model.targets)
+        slots.extend((node, attribute) for node in self.model.primitivesOf(0) for attribute in self.GEOMETRY if node.get(attribute) is not None)
+        # An attribute can be the target of a template and of laser:attributes, it only gets one slot
+        self.slots = list(OrderedDict(((id(node), attribute), (node, attribute)) for node, attribute in slots).values())
+
+        values = [node.get(attribute) for node, attribute in self.slots]
+        for index, (node, attribute) in enumerate(self.slots):
+            node.set(attribute, self.SLOT.format(index))
+        try:
+            pieces = re.split(r"\{lasersvg-slot:(\d+)\}", etree.tostring(root.getroottree()).decode("utf-8"))
+        finally:
+            for (node, attribute), value in zip(self.slots, values):
+                node.set(attribute, value)
+        self.fragments = [piece.encode("utf-8") for piece in pieces[0::2]]
+        # The slots in the order in which they appear in the document
+        self.order = [int(index) for index in pieces[1::2]]
+
+    # Sets the parameters on the document, only the expressions that use a parameter that changed are evaluated
+    def apply(self, parameters, everything=False):
+        changes = {}
+        for name, value in parameters.items():
+            attribute = BUILTIN_ATTRIBUTES.get(name)
+            if attribute is not None:
+                self.root.set(LASER + attribute, str(value))
+                value = float(value)
+            changes[name] = value
+        self.model.update(changes, everything=everything)
+        thickness = self.model.values["thickness"]
+        if everything or thickness != self.thickness:
+            # As given, like the parameter control does, such that the primitives are written the same way
+            self.primitives.apply(parameters.get("thickness", thickness))
+            self.thickness = thickness
+
+    # The document with the given parameters, as a list of byte strings
+    def render(self, parameters):
+        self.apply(parameters)
+        slots = self.slots
+        chunks = [self.fragments[0]]
+        for index, fragment in zip(self.order, self.fragments[1:]):
+            node, attribute = slots[index]
+            chunks.append(escapeAttribute(node.get(attribute)).encode("utf-8"))
+            chunks.append(fragment)
+        return chunks
+
+    def write(self, parameters, stream):
+        stream.writelines(self.render(parameters))
+
+    def tostring(self, parameters):
+        return b"".join(self.render(parameters))
+
+# Attribute values as lxml writes them
+def escapeAttribute(value):
+    return value.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;") \
+        .replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#9;")
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# An on-disk cache for the results of extension runs. Inkscape starts every extension in a new process, so without it
+# nothing survives from one live preview update or Apply to the next.
+# Entries are addressed by a hash of what they depend on: the extension, its source code, its options, and the input
+# document. Every file is written under a temporary name and then renamed, such that processes that run at the same
+# time never see half an entry. When the cache grows beyond its size, the entries that were used longest ago are removed.
+# An entry holds the output of the run and what it wrote to stderr, e.g. warnings, which are shown again on a replay.
+#
+# The cache lives in the user's cache directory, LASERSVG_CACHE_DIR moves it elsewhere, and LASERSVG_CACHE_SIZE sets
+# its size in MB (0 turns it off). The extensions that use it turn it off with --cache=false.
+
+import hashlib
+import io
+import os
+import sys
+import zlib
+
+DEFAULT_SIZE = 64
+# The running total of the entry sizes counts in blocks of this size
+BLOCK = 1024
+
+def cacheDirectory():
+    if os.environ.get("LASERSVG_CACHE_DIR"):
+        return os.environ["LASERSVG_CACHE_DIR"]
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.environ.get("TEMP", ".")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "lasersvg")
+
+# Changes whenever one of the extensions changes, such that old results are not used with new code
+def sourceStamp():
+    directory = os.path.dirname(os.path.abspath(__file__))
+    stamp = [sys.version]
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            status = os.stat(os.path.join(directory, name))
+            stamp.append("{}:{}:{}".format(name, status.st_size, status.st_mtime_ns))
+    return "\n".join(stamp)
+
+
+class ResultCache(object):
+
+    def __init__(self, directory=None, maxSize=None):
+        self.directory = directory or cacheDirectory()
+        if maxSize is None:
+            maxSize = float(os.environ.get("LASERSVG_CACHE_SIZE", DEFAULT_SIZE)) * 1024 * 1024
+        self.maxSize = maxSize
+
+    @property
+    def enabled(self):
+        return self.maxSize > 0
+
+    @staticmethod
+    def key(*parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            part = part if isinstance(part, bytes) else str(part).encode("utf-8")
+            # The length keeps ("ab", "c") and ("a", "bc") apart
+            digest.update(len(part).to_bytes(8, "little"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    # Every put appends one byte per started block of the entry to this file, such that its size is the running total
+    # of the cache. Appends of processes that run at the same time don't overwrite each other, and the total is known
+    # without reading anything.
+    def usagePath(self):
+        return os.path.join(self.directory, "usage")
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, "rb") as entry:
+                data = zlib.decompress(entry.read())
+            # The modification time is when the entry was used last, the eviction removes the oldest ones
+            os.utime(path)
+            return data
+        except (OSError, zlib.error):
+            return None
+
+    def put(self, key, data):
+        if not self.enabled or len(data) > self.maxSize:
+            return
+        # tempfile takes longer to import than a cache hit takes, so only misses load it
+        import tempfile
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handle, temporary = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp")
+            compressed = zlib.compress(data, 1)
+            with os.fdopen(handle, "wb") as entry:
+                entry.write(compressed)
+            os.replace(temporary, path)
+            with open(self.usagePath(), "ab") as usage:
+                usage.write(bytes(len(compressed) // BLOCK + 1))
+                total = usage.tell() * BLOCK
+        except OSError:
+            return
+        # Only a full cache is walked
+        if total > self.maxSize:
+            self.evict()
+
+    # Removes the entries used longest ago until the cache is below its size again, with some room to spare, and
+    # starts the running total again from what is left
+    def evict(self):
+        usage = self.usagePath()
+        entries, total = [], 0
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(directory, name)
+                if path == usage:
+                    continue
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((status.st_mtime, status.st_size, path))
+                total += status.st_size
+        blocks = sum(size // BLOCK + 1 for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.maxSize * 0.8:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                # Another process was faster
+                pass
+            total -= size
+            blocks -= size // BLOCK + 1
+        try:
+            with open(usage, "wb") as stream:
+                stream.write(bytes(blocks))
+        except OSError:
+            pass
+
+
+# One run of an extension through the cache. The result is looked up before the extension (and inkex) is loaded:
+#
+#   run = CachedRun("laserSVG_control", sys.argv[1:])
+#   if run.replay():
+#       sys.exit(0)
+#   ... run the extension with run.args, writing its result to run.output ...
+#   run.finish()
+#
+# The input is read once and identified by its content, as Inkscape hands every run a new temporary file.
+# Between replay and finish, what the extension writes to stderr is also recorded.
+class CachedRun(object):
+
+    def __init__(self, name, args, cache=None):
+        self.cache = cache or ResultCache()
+        self.destination = None
+        options, inputFile = [], None
+        for arg in args:
+            if arg.startswith("--output="):
+                self.destination = arg[len("--output="):]
+            elif arg.startswith("-"):
+                options.append(arg)
+            else:
+                inputFile = arg
+        # Other forms of arguments are left to the extension, uncached
+        self.enabled = self.cache.enabled and "--output" not in options and "--cache=false" not in options
+        self.errors = None
+        self.output = io.BytesIO()
+        self.args = list(args)
+        if not self.enabled:
+            # The extension writes to --output itself
+            self.destination = None
+            return
+        if inputFile is None:
+            # Stdin can only be read once, the extension gets a copy in a file
+            import tempfile
+            self.data = sys.stdin.buffer.read()
+            handle, self.temporary = tempfile.mkstemp(suffix=".svg")
+            with os.fdopen(handle, "wb") as copy:
+                copy.write(self.data)
+            inputFile = self.temporary
+        else:
+            self.temporary = None
+            with open(inputFile, "rb") as document:
+                self.data = document.read()
+        self.args = options + [inputFile]
+        self.key = self.cache.key(name, sourceStamp(), "\0".join(options), self.data)
+
+    def write(self, data):
+        if self.destination:
+            with open(self.destination, "wb") as stream:
+                stream.write(data)
+        else:
+            sys.stdout.buffer.write(data)
+            sys.stdout.buffer.flush()
+
+    def replay(self):
+        if not self.enabled:
+            return False
+        data = self.cache.get(self.key)
+        if data is None:
+            self.errors = RecordedStream(sys.stderr)
+            sys.stderr = self.errors
+            return False
+        self.cleanUp()
+        # The length of the recorded stderr comes first
+        length = int.from_bytes(data[:8], "little")
+        if length:
+            sys.stderr.write(data[8:8 + length].decode("utf-8"))
+            sys.stderr.flush()
+        self.write(data[8 + length:])
+        return True
+
+    def finish(self):
+        self.cleanUp()
+        result = self.output.getvalue()
+        if self.enabled:
+            errors = b""
+            if self.errors is not None:
+                sys.stderr = self.errors.stream
+                errors = self.errors.getvalue().encode("utf-8")
+            self.cache.put(self.key, len(errors).to_bytes(8, "little") + errors + result)
+        self.write(result)
+
+    def cleanUp(self):
+        if self.enabled and self.temporary:
+            try:
+                os.unlink(self.temporary)
+            except OSError:
+                pass
+            self.temporary = None
+
+
+# Writes through to _stream_ and keeps a copy of everything
+class RecordedStream(io.StringIO):
+
+    def __init__(self, stream):
+        io.StringIO.__init__(self)
+        self.stream = stream
+
+    def write(self, text):
+        self.stream.write(text)
+        return io.StringIO.write(self, text)
+
+    def flush(self):
+        self.stream.flush()
+
+    # Everything else, e.g. the binary buffer, is the one of _stream_
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
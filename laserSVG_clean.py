@@ -22,11 +22,10 @@
 # Removes all 0-length segments from a path
 
 import inkex
-from math import sqrt
 
-class LaserSVG_cleaner(inkex.EffectExtension):
+from laserSVG_api import cleanPath
 
-    threshold = 0.00001
+class LaserSVG_cleaner(inkex.EffectExtension):
 
     def add_arguments(self, pars):
         pars.add_argument("--threshold", default=0.0001, help="The threshold under which segments are removed")
@@ -40,39 +39,11 @@ class LaserSVG_cleaner(inkex.EffectExtension):
 
         for pathID in self.options.ids:
             path = self.svg.getElementById(pathID)
-            cleanedPath = inkex.paths.Path()
+            cleanedPath = cleanPath(path.get("d"), self.threshold)
 
-            for segment in path.original_path.to_relative():
-                if self.getCommandLength(segment) > self.threshold:
-                    cleanedPath.append(segment)
-            
             inkex.utils.debug(cleanedPath)
             path.set("d",cleanedPath)
 
 
-
-    # Get the length of a relative command segment
-    # such that we don't have to handle all the different parameter locations
-    def getCommandLength(self, command) -> float:
-        dx,dy = self.getCommandDelta(command)
-        return sqrt(dx**2 + dy**2)
-        
-    def getCommandDelta(self, command):
-        if command.letter == 'l' or command.letter == 'm':
-            return (command.args[0], command.args[1])
-        elif command.letter == 'h':
-            return (command.args[0], 0)
-        elif command.letter == 'v':
-            return (0, command.args[0])
-        elif command.letter == 'c':
-            return (command.args[4], command.args[5])
-        elif command.letter in ['s', 'q']:
-            return (command.args[2], command.args[3])
-        elif command.letter == 'a':
-            return (command.args[5], command.args[6])
-        else:
-            return (0, 0)
-
-
 if __name__ == '__main__':
     LaserSVG_cleaner().run()
@@ -19,29 +19,99 @@
 #
 
 
-import math
+import sys
+
+# Going back to a thickness that was already previewed reuses the result of that run (see laserSVG_cache.py)
+if __name__ == '__main__':
+    from laserSVG_cache import CachedRun
+    cachedRun = CachedRun("laserSVG_control", sys.argv[1:])
+    if cachedRun.replay():
+        sys.exit(0)
 
-import inkex
-import inkex.elements 
 from lxml import etree
-import re
 
-class LaserSVG(inkex.EffectExtension):
+from laserSVG_core import LaserSVGMixin, registerNamespace
+# The steps of the extension only need lxml, such that they can also run without inkex (see runHeadless)
+from laserSVG_api import SCRIPT_URL, applySettings, selectedGroups
+
+# Inkscape starts a new Python process for every update of the live preview, and most of its startup time is spent
+# importing inkex. Unless a part that has to be re-nested can only be measured by inkex, e.g. text, we do the work with
+# lxml only and return before inkex is loaded.
+def runHeadless(args, output=None):
+    import argparse
+    pars = argparse.ArgumentParser(add_help=False)
+    pars.add_argument("--kerf_width", default=0)
+    pars.add_argument("--action", default="cut")
+    pars.add_argument("--interactive", default=True)
+    pars.add_argument("--coefficients", default="false")
+    pars.add_argument("--material_thickness", default=3)
+    pars.add_argument("--scale", default="100")
+    pars.add_argument("--parameters", default="")
+    pars.add_argument("--scope", default="document")
+    pars.add_argument("--id", action="append", dest="ids")
+    pars.add_argument("--nest", default="false")
+    pars.add_argument("--headless", default="true")
+    pars.add_argument("--output")
+    pars.add_argument("input_file", nargs="?")
+    options, _ = pars.parse_known_args(args)
+    if options.headless != "true":
+        return False
+
+    # The same parser settings as inkex, such that the output is the same
+    parser = etree.XMLParser(huge_tree=True, strip_cdata=False, recover=True)
+    document = etree.parse(options.input_file or sys.stdin.buffer, parser=parser)
+    registerNamespace()
+    root = document.getroot()
+    if options.nest == "true":
+        from laserSVG_packing import nestingSettings, collectParts, hasShapes
+        settings = nestingSettings(root)
+        if settings is None:
+            sys.stderr.write("Please set up the sheet size in the LaserSVG nesting extension first.\n")
+            sys.exit(1)
+        if not all(hasShapes(part) for part in collectParts(root)):
+            return False
+    try:
+        groups = selectedGroups(root, options.scope, options.ids)
+    except ValueError as error:
+        sys.stderr.write("{}\n".format(error))
+        sys.exit(1)
+    applySettings(root, options.material_thickness, options.kerf_width, options.action, options.interactive,
+                  options.scale, options.parameters, groups, options.coefficients)
+    # Parts grow or shrink with the thickness, so the layout of the last nesting run might not fit anymore
+    if options.nest == "true":
+        from laserSVG_packing import nestDocument
+        nestDocument(root, **settings)
+
+    if options.output:
+        with open(options.output, "wb") as stream:
+            stream.write(etree.tostring(document))
+    else:
+        (output or sys.stdout.buffer).write(etree.tostring(document))
+    return True
+
+if __name__ == '__main__' and runHeadless(cachedRun.args, cachedRun.output):
+    cachedRun.finish()
+    sys.exit(0)
+
+import inkex
+
+class LaserSVG(LaserSVGMixin, inkex.EffectExtension):
 
-    selected_nodes = {}
-    LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
-    LASER_PREFIX = "laser"
-    LASER = "{%s}" % LASER_NAMESPACE
-    laserSVGScriptURL = "https://florianheller.github.io/lasersvg/lasersvg.js"
+    laserSVGScriptURL = SCRIPT_URL
 
-    oldThickness = 0
     def add_arguments(self, pars):
         pars.add_argument("--kerf_width", default=0, help="The kerf width")
         pars.add_argument("--action", default="cut", help="The default laser operation")
         pars.add_argument("--scale", default="100", help="The scaling factor ")
 
         pars.add_argument("--interactive", default=True, help="whether or not to add the stylesheet and the JS references to the file")
+        pars.add_argument("--coefficients", default="false", help="Precompute the templates as tables for the browser")
         pars.add_argument("--material_thickness", default=3, help="The material thickness")
+        pars.add_argument("--parameters", default="", help="Custom parameters of the document, as name: expression; ...")
+        pars.add_argument("--scope", default="document", help="Whether the settings are for the document or the selected groups and layers")
+        pars.add_argument("--nest", default="false", help="Re-nest the parts on the sheets after adjusting the thickness")
+        pars.add_argument("--headless", default="true", help="Skip loading inkex if it is not needed")
+        pars.add_argument("--cache", default="true", help="Replay the results of earlier runs with the same settings (see laserSVG_cache.py)")
         pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
 
     def effect(self):
@@ -49,108 +119,26 @@ class LaserSVG(inkex.EffectExtension):
         # The trailing slash is important, otherwise inkscape doesn't load the file correctly
 
         # Register the namespace prefix both with etree and inkscape
-        etree.register_namespace("laser", self.LASER_NAMESPACE)
-        inkex.elements._utils.NSS["laser"] = self.LASER_NAMESPACE
-
-        #Save the old thickness 
-        oldValue = self.document.getroot().get(inkex.elements._utils.addNS("material-thickness", self.LASER_PREFIX))
-        if oldValue is not None:
-            self.oldThickness  = float(oldValue)
-
-        # Set/Update the global thickness in the SVG root node
-        self.document.getroot().set(inkex.elements._utils.addNS("material-thickness", self.LASER_PREFIX), self.options.material_thickness)
-
-        # Set/Update the global kerf value in the SVG root node
-        self.document.getroot().set(inkex.elements._utils.addNS("kerf", self.LASER_PREFIX), self.options.kerf_width)
-
-        #Set/Update the gobal laser action in the SVG root node
-        self.document.getroot().set(inkex.elements._utils.addNS("action", self.LASER_PREFIX), self.options.action)
-        
-        # adjust the thickness on all elements 
-        self.adjust_element_thickness(self.options.material_thickness)
-
-        #inkex.utils.debug(self.document.getroot().nsmap)
-
-        if self.options.interactive == 'true':
-            # Check if there is a reference to the JS and CSS already, otherwise add it
-            # While workin on the file, Inkscape requires the SVG namespace in front of SVG element, even though the prefix will be removed while saving. 
-            if not self.document.getroot().findall(".//{http://www.w3.org/2000/svg}script[@xlink:href='https://florianheller.github.io/lasersvg/lasersvg.js']"):
-                scriptElement = etree.SubElement(self.document.getroot(), "script")
-                # inkex.utils.debug(scriptElement.localName)
-                scriptElement.set("type", "text/javascript")
-                scriptElement.set("xlink:href",  self.laserSVGScriptURL)
-
-        # inkex.utils.debug(etree.tostring(self.document.getroot(),pretty_print=True))
-
-        # #rect.set(XHTML + "thickness-adjust","width")
-        # inkex.utils.debug(etree.tostring(rect))
-
-    def adjust_element_thickness(self, newThickness):
-        for node in self.document.getroot().iterfind(".//*[@%sthickness-adjust]" % self.LASER):
-            adjust_setting = node.get("%s:thickness-adjust" % self.LASER_PREFIX)
-            if adjust_setting == "width":
-                node.attrib["width"] = newThickness
-            elif adjust_setting == "height":
-                node.attrib["height"] = newThickness
-            elif adjust_setting == "both":
-                node.attrib["height"] = newThickness
-                node.attrib["width"] = newThickness
-
-            # Adjust position of origin is specified
-            newThicknessF = float(newThickness)
-            originX, originY, centerX, centerY = 0, 0, 0, 0
-            origin = node.get(inkex.elements._utils.addNS("origin", self.LASER_PREFIX))
-
-            if origin is not None:
-                if node.get(inkex.elements._utils.addNS("x", self.LASER_PREFIX)) is None:
-                    centerX = float(node.get("x")) + (self.oldThickness/2)
-                    node.set(inkex.elements._utils.addNS("centerX", self.LASER_PREFIX), centerX)
-                    node.set(inkex.elements._utils.addNS("x", self.LASER_PREFIX), node.get("x"))
- 
-                centerX = float(node.get(inkex.elements._utils.addNS("centerX", self.LASER_PREFIX)))
-                originX = float(node.get(inkex.elements._utils.addNS("x", self.LASER_PREFIX)))
-
-                if node.get(inkex.elements._utils.addNS("y", self.LASER_PREFIX)) is None:
-                    centerY = float(node.get("y")) + (self.oldThickness/2)
-                    node.set(inkex.elements._utils.addNS("centerY", self.LASER_PREFIX), centerY)
-                    node.set(inkex.elements._utils.addNS("y", self.LASER_PREFIX), node.get("y"))
-                
-                centerY = float(node.get(inkex.elements._utils.addNS("centerY", self.LASER_PREFIX)))
-                originY = float(node.get(inkex.elements._utils.addNS("y", self.LASER_PREFIX)))
-
-                if origin == "bottom":
-                    if adjust_setting == "height" or adjust_setting == "both":
-                        node.set("y", originY + self.oldThickness - newThicknessF)
-                elif origin == "right":
-                    if adjust_setting == "width" or adjust_setting == "both":
-                        node.set("x", originX + self.oldThickness - newThicknessF)
-                elif origin == "bottom-right":
-                    if adjust_setting == "height" or adjust_setting == "both":
-                        node.set("y", originY + self.oldThickness - newThicknessF)
-                    if adjust_setting == "width" or adjust_setting == "both":
-                        node.set("x", originX + self.oldThickness - newThicknessF)
-                elif origin == "center":
-                    if adjust_setting == "height" or adjust_setting == "both":
-                        node.set("y", centerY - (newThicknessF/2))
-                    if adjust_setting == "width" or adjust_setting == "both":
-                        node.set("x", centerX - (newThicknessF/2))
-            # inkex.utils.debug(node.get("laser:thickness-adjust"))    
-            # inkex.utils.debug(node.attrib)    
-            # nodes = self.document.getroot().findall(".//*[@%s:thickness-adjust]" % self.LASER_PREFIX)
-        # And now the paths     
-        self.adjust_path_thickness(newThickness)
-
-
-    def adjust_path_thickness(self, newThickness):
-        for node in self.document.getroot().iterfind(".//*[@{}template]".format(self.LASER)):
-            template = node.get(inkex.elements._utils.addNS("template", self.LASER_PREFIX))
-            pattern = re.compile(r'[{](.*?)[}]')
-            evaluate = lambda x: str(eval(x.group(1),{},{"thickness":float(self.options.material_thickness)}))
-            result = re.sub(pattern, evaluate, template)
-            node.set("d",result)
-
-
+        self.registerNamespace()
+
+        root = self.document.getroot()
+        try:
+            groups = selectedGroups(root, self.options.scope, self.options.ids)
+        except ValueError as error:
+            raise inkex.AbortExtension(str(error))
+        applySettings(root, self.options.material_thickness, self.options.kerf_width, self.options.action, self.options.interactive,
+                      self.options.scale, self.options.parameters, groups, self.options.coefficients)
+
+        # Parts grow or shrink with the thickness, so the layout of the last nesting run might not fit anymore
+        if self.options.nest == 'true':
+            from laserSVG_packing import nestDocument, nestingSettings
+            from laserSVG_nesting import boundingBox
+            settings = nestingSettings(root)
+            if settings is None:
+                raise inkex.AbortExtension("Please set up the sheet size in the LaserSVG nesting extension first.")
+            nestDocument(root, measure=boundingBox, **settings)
 
 
 if __name__ == '__main__':
-    LaserSVG().run()
+    LaserSVG().run(cachedRun.args, output=cachedRun.output)
+    cachedRun.finish()
@@ -0,0 +1,1195 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Shared code of the LaserSVG extensions: the namespace, a path data parser, the evaluation of the templates, and the
+# geometry that the exporters need. None of it depends on inkex.
+# Paths are stored compactly, all command letters in one bytes buffer and all coordinates in one array of doubles,
+# instead of one object per segment.
+
+import re
+import sys
+from functools import partial
+from itertools import chain
+from array import array
+from math import sqrt, sin, cos, tan, acos, ceil, pi, radians, isclose, copysign, trunc
+
+LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
+LASER_PREFIX = "laser"
+LASER = "{%s}" % LASER_NAMESPACE
+SVG = "{http://www.w3.org/2000/svg}"
+INKSCAPE = "{http://www.inkscape.org/namespaces/inkscape}"
+
+# Layers created by the LaserSVG extensions that are not part of the design
+HELPER_LAYERS = ("highlightLayer", "slitLayer", "sheetLayer")
+
+# The number of arguments of each path command
+ARGUMENT_COUNTS = {"m": 2, "l": 2, "h": 1, "v": 1, "c": 6, "s": 4, "q": 4, "t": 2, "a": 7, "z": 0}
+ARGUMENT_COUNTS.update({letter.upper(): count for letter, count in list(ARGUMENT_COUNTS.items())})
+
+COMMAND_PATTERN = re.compile(r"([MmLlHhVvCcSsQqTtAaZz])([^MmLlHhVvCcSsQqTtAaZz]*)")
+NUMBER_PATTERN = re.compile(r"[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+# The expressions in a laser:template, e.g. {thickness*2}
+TEMPLATE_PATTERN = re.compile(r'[{](.*?)[}]')
+# The arguments of a template after its expressions have been replaced by #<index>
+TEMPLATE_ARGUMENT_PATTERN = re.compile(r"#(\d+)|" + NUMBER_PATTERN.pattern)
+
+# The elements that are cut or engraved, and the ones that can contain them
+SHAPES = {SVG + tag for tag in ("path", "rect", "circle", "ellipse", "line", "polyline", "polygon")}
+CONTAINERS = {SVG + "g", SVG + "a", SVG + "svg"}
+
+# Millimeters per unit, user units without a unit are px
+UNITS = {"mm": 1.0, "cm": 10.0, "q": 0.25, "in": 25.4, "pt": 25.4 / 72, "pc": 25.4 / 6, "px": 25.4 / 96, "": 25.4 / 96}
+
+# Transforms are (a, b, c, d, e, f) tuples, as in the SVG matrix() notation
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+TRANSFORM_PATTERN = re.compile(r"(matrix|translate|scale|rotate|skewX|skewY)\s*\(([^)]*)\)")
+
+# Register the namespace prefix both with etree and inkscape.
+# inkex is only told about it if it is already loaded, the headless code paths never import it.
+def registerNamespace():
+    from lxml import etree
+    etree.register_namespace(LASER_PREFIX, LASER_NAMESPACE)
+    # Otherwise references added to files without an xlink declaration get an ns0 prefix
+    etree.register_namespace("xlink", "http://www.w3.org/1999/xlink")
+    if "inkex" in sys.modules:
+        import inkex.elements
+        inkex.elements._utils.NSS[LASER_PREFIX] = LASER_NAMESPACE
+
+# The namespace constants every LaserSVG extension uses
+class LaserSVGMixin(object):
+    LASER_NAMESPACE = LASER_NAMESPACE
+    LASER_PREFIX = LASER_PREFIX
+    LASER = LASER
+
+    def registerNamespace(self):
+        registerNamespace()
+
+
+class PathData(object):
+    __slots__ = ("commands", "coordinates", "offsets")
+
+    def __init__(self, commands=None, coordinates=None, offsets=None):
+        self.commands = commands if commands is not None else bytearray()
+        self.coordinates = coordinates if coordinates is not None else array("d")
+        # The index of the first coordinate of each segment
+        self.offsets = offsets if offsets is not None else array("l")
+
+    @classmethod
+    def parse(cls, d):
+        path = cls()
+        commands, coordinates, offsets = path.commands, path.coordinates, path.offsets
+        for letter, numbers in COMMAND_PATTERN.findall(d):
+            count = ARGUMENT_COUNTS[letter]
+            if count == 0:
+                commands.append(ord(letter))
+                offsets.append(len(coordinates))
+                continue
+            numbers = NUMBER_PATTERN.findall(numbers)
+            if letter in "aA":
+                numbers = splitArcFlags(numbers)
+            repeats, rest = divmod(len(numbers), count)
+            if rest or not repeats:
+                raise ValueError("Wrong number of arguments for {} in path data".format(letter))
+            # Numbers without a command repeat the previous one, except after a move, which continues as a line
+            start = len(coordinates)
+            commands.append(ord(letter))
+            if repeats > 1:
+                commands.extend((ord("l") if letter == "m" else ord("L") if letter == "M" else ord(letter)).to_bytes(1, "little") * (repeats - 1))
+            offsets.extend(range(start, start + repeats * count, count))
+            coordinates.extend(map(float, numbers))
+        return path
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __getitem__(self, index):
+        offset = self.offsets[index]
+        letter = chr(self.commands[index])
+        return letter, tuple(self.coordinates[offset:offset + ARGUMENT_COUNTS[letter]])
+
+    def __iter__(self):
+        coordinates = self.coordinates
+        for code, offset in zip(self.commands, self.offsets):
+            letter = chr(code)
+            yield letter, tuple(coordinates[offset:offset + ARGUMENT_COUNTS[letter]])
+
+    def __str__(self):
+        return self.toString()
+
+    def append(self, letter, args):
+        self.commands.append(ord(letter))
+        self.offsets.append(len(self.coordinates))
+        self.coordinates.extend(args)
+
+    # Converts all segments to relative commands
+    def relative(self):
+        return self.convert(True)
+
+    # Converts all segments to absolute commands
+    def absolute(self):
+        return self.convert(False)
+
+    def convert(self, relative):
+        commands = self.commands
+        result = PathData(bytearray(commands.lower() if relative else commands.upper()), array("d", self.coordinates), array("l", self.offsets))
+        # Nothing to do if all commands are already of the right kind
+        if commands.islower() if relative else commands.isupper():
+            return result
+        source, coordinates = self.coordinates, result.coordinates
+        x, y, startX, startY = 0.0, 0.0, 0.0, 0.0
+        for code, offset in zip(commands, self.offsets):
+            letter = chr(code)
+            lower = letter.lower()
+            if lower == "z":
+                x, y = startX, startY
+                continue
+            isRelative = letter == lower
+            axes = COORDINATE_AXES[lower]
+            # Relative coordinates become absolute by adding the current point, and vice versa
+            if isRelative != relative:
+                sign = 1.0 if isRelative else -1.0
+                for index, axis in axes:
+                    coordinates[offset + index] += sign * (y if axis else x)
+            # The new current point is the end point of the segment
+            index, axis = axes[-1]
+            if lower == "h" or lower == "v":
+                value = source[offset] + ((y if axis else x) if isRelative else 0.0)
+                if axis:
+                    y = value
+                else:
+                    x = value
+            else:
+                end = offset + index
+                x, y = (source[end - 1] + x, source[end] + y) if isRelative else (source[end - 1], source[end])
+            if lower == "m":
+                startX, startY = x, y
+        return result
+
+    # The absolute end point of every segment
+    def endpoints(self):
+        points = []
+        x, y, startX, startY = 0.0, 0.0, 0.0, 0.0
+        coordinates = self.coordinates
+        for code, offset in zip(self.commands, self.offsets):
+            letter = chr(code)
+            lower = letter.lower()
+            isRelative = letter == lower
+            if lower == "z":
+                x, y = startX, startY
+            elif lower == "h":
+                x = coordinates[offset] + (x if isRelative else 0.0)
+            elif lower == "v":
+                y = coordinates[offset] + (y if isRelative else 0.0)
+            else:
+                end = offset + ARGUMENT_COUNTS[letter] - 2
+                x, y = coordinates[end] + (x if isRelative else 0.0), coordinates[end + 1] + (y if isRelative else 0.0)
+            if lower == "m":
+                startX, startY = x, y
+            points.append((x, y))
+        return points
+
+    # Writes the path, with _precision_ decimals and in the shortest form if compact is set:
+    # repeated command letters are left out (including the implicit lineto after a moveto), and separators
+    # are only written where a number would otherwise merge with the previous one.
+    def toString(self, precision=None, compact=False):
+        if not compact:
+            return " ".join(" ".join([letter] + [formatNumber(arg, precision) for arg in args]) for letter, args in self)
+        result = []
+        previous = None
+        lastNumber = ""
+        for letter, args in self:
+            # Axis-aligned relative lines are shorter as h/v
+            if letter == "l" and args[1] == 0:
+                letter, args = "h", args[:1]
+            elif letter == "l" and args[0] == 0:
+                letter, args = "v", args[1:]
+            implicit = {"m": "l", "M": "L"}.get(previous, previous)
+            if letter != implicit or letter in "zZ":
+                result.append(letter)
+                lastNumber = ""
+            for arg in args:
+                number = formatNumber(arg, precision, compact)
+                if lastNumber and not (number[0] == "-" or (number[0] == "." and "." in lastNumber)):
+                    result.append(" ")
+                result.append(number)
+                lastNumber = number
+            previous = letter
+        return "".join(result)
+
+
+# The arc flags are single digits and may be written without separators, e.g. a1 1 0 0110 10
+def splitArcFlags(numbers):
+    result = []
+    for number in numbers:
+        while len(result) % 7 in (3, 4) and len(number) > 1 and number[0] in "01":
+            result.append(number[0])
+            number = number[1:]
+        result.append(number)
+    return result
+
+# The arguments of each command that are coordinates, and whether they are on the x (0) or y (1) axis
+COORDINATE_AXES = {"m": ((0, 0), (1, 1)), "l": ((0, 0), (1, 1)), "t": ((0, 0), (1, 1)), "h": ((0, 0),), "v": ((0, 1),),
+                   "c": ((0, 0), (1, 1), (2, 0), (3, 1), (4, 0), (5, 1)), "s": ((0, 0), (1, 1), (2, 0), (3, 1)),
+                   "q": ((0, 0), (1, 1), (2, 0), (3, 1)), "a": ((5, 0), (6, 1))}
+
+# Moves the coordinates of a command by (dx, dy), leaving the radii and flags of arcs alone
+def shift(letter, args, dx, dy):
+    if letter == "z":
+        return ()
+    if letter == "h":
+        return (args[0] + dx,)
+    if letter == "v":
+        return (args[0] + dy,)
+    if letter == "a":
+        return args[:5] + (args[5] + dx, args[6] + dy)
+    return tuple(value + (dx if index % 2 == 0 else dy) for index, value in enumerate(args))
+
+# Formats a number with at most _precision_ decimals. Compact numbers leave out redundant zeros, e.g., 0.500 -> .5
+def formatNumber(number, precision=None, compact=False):
+    if precision is None:
+        text = repr(float(number))
+        text = text[:-2] if text.endswith(".0") else text
+    elif precision > 0:
+        text = "{:.{}f}".format(number, precision).rstrip("0").rstrip(".")
+    else:
+        text = str(int(round(number)))
+    if text in ("-0", "", "-"):
+        return "0"
+    if compact:
+        if text.startswith("0."):
+            return text[1:]
+        if text.startswith("-0."):
+            return "-" + text[2:]
+    return text
+
+
+# Cuts the numbers to _digits_ decimals, without rounding
+def truncate(number, digits) -> float:
+    stepper = 10.0 ** digits
+    return trunc(stepper * number) / stepper
+
+# The term for a coordinate that is _ratio_ times the thickness, with rounding it snaps to the _multiple_ of the
+# thickness the segment was matched to
+def thicknessTerm(ratio, roundThickness=True, multiple=1):
+    round_tolerance = 0.05 * multiple
+    zero_tolerance = 0.01
+    ratio = truncate(ratio, 5)
+    if roundThickness:
+        if isclose(ratio, 0, abs_tol=zero_tolerance): #remember this is a tolerance of 0.01 mm!
+            ratio = 0
+        if abs(ratio) > (multiple-round_tolerance) and abs(ratio) < (multiple+round_tolerance):
+            ratio = copysign(multiple, ratio)
+    return "0" if ratio == 0 else "{thickness}" if ratio == 1 else "{-thickness}" if ratio == -1 else "{{{}*thickness}}".format(ratio)
+
+# The arguments of each relative command that hold its end point, as (x, y), None if it only moves along one axis
+END_POINT_ARGUMENTS = {"m": (0, 1), "l": (0, 1), "t": (0, 1), "h": (0, None), "v": (None, 0),
+                       "c": (4, 5), "s": (2, 3), "q": (2, 3), "a": (5, 6)}
+
+# The offset of the end point of a relative command to its start point
+def commandDelta(letter, args):
+    indices = END_POINT_ARGUMENTS.get(letter)
+    if indices is None:
+        return (None, None)
+    return tuple(0 if index is None else args[index] for index in indices)
+
+# The length of the chord of a relative command. Moves don't cut anything and have no length.
+def segmentLength(letter, args):
+    if letter == "m":
+        return None
+    dx, dy = commandDelta(letter, args)
+    if dx is None or dy is None:
+        return None
+    return sqrt(dx * dx + dy * dy)
+
+
+# Identifies a shape independent of where it is placed: its relative commands without the position of the first
+# move. The numbers are rounded, such that copies that differ in the last digits are still the same shape.
+def shapeFingerprint(commands, precision=6):
+    fingerprint = []
+    for index, (letter, args) in enumerate(commands):
+        fingerprint.append(letter)
+        if index:
+            fingerprint.extend(round(arg, precision) for arg in args)
+    return tuple(fingerprint)
+
+# Normalizes path data for the path to relative extension, in worker processes for large documents.
+# Below this number of paths, starting worker processes costs more than it saves
+PARALLEL_PATHS = 200
+
+# Runs the normalization on all (key, d) pairs, in parallel if there are enough of them
+def normalizeAll(jobs, precision, mode, processes=0, chunk_size=64):
+    worker = partial(normalizeChunk, precision=precision, mode=mode)
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), max(1, chunk_size))]
+
+    if len(jobs) < PARALLEL_PATHS or processes == 1:
+        results = map(worker, chunks)
+    else:
+        # Starting the pool is only worth it for large documents, so multiprocessing isn't imported otherwise
+        from multiprocessing import Pool, cpu_count
+        with Pool(processes or cpu_count()) as pool:
+            results = pool.map(worker, chunks)
+
+    for chunk in results:
+        yield from chunk
+
+# Top-level so that it can be pickled for the worker processes
+def normalizeChunk(chunk, precision, mode):
+    return [(key, normalizePathData(d, precision, mode)) for key, d in chunk]
+
+# A negative _precision_ keeps all digits
+def normalizePathData(d, precision=-1, mode="relative"):
+    absolute = PathData.parse(d).absolute()
+    if precision < 0:
+        precision = None
+    else:
+        # Round the absolute coordinates first, so that relative offsets computed from them don't accumulate rounding drift
+        absolute.coordinates = array("d", [round(value, precision) for value in absolute.coordinates])
+
+    if mode == "absolute":
+        return absolute.toString(precision, compact=True)
+    relative = absolute.relative()
+    if precision is None:
+        # Only removes the float noise of the subtractions, e.g. 20.209877300000002
+        relative.coordinates = array("d", [round(value, 10) for value in relative.coordinates])
+    relative = relative.toString(precision, compact=True)
+    if mode == "shortest":
+        return min(relative, absolute.toString(precision, compact=True), key=len)
+    return relative
+
+
+# The geometry below is shared by the extensions that turn the drawing into machine output. It only needs lxml,
+# such that it can also be used without inkex.
+
+ADJUST = LASER + "thickness-adjust"
+ORIGIN = LASER + "origin"
+ORIGIN_X, ORIGIN_Y, CENTER_X, CENTER_Y = LASER + "x", LASER + "y", LASER + "centerX", LASER + "centerY"
+CIRCLE, ELLIPSE = SVG + "circle", SVG + "ellipse"
+
+# Adjusts the thickness-adjusted primitives, all of them or the given _nodes_
+def adjustElementThickness(root, newThickness, oldThickness, nodes=None):
+    if nodes is None:
+        nodes = root.iterfind(".//*[@%sthickness-adjust]" % LASER)
+    PrimitiveColumns(nodes, oldThickness).apply(newThickness)
+
+# The thickness-adjusted primitives as columns: the attributes that are set to the thickness, the ones set to half of it
+# (radii), and the positions, which are a base minus a factor times the thickness. The elements are read once, after
+# that a new thickness is one pass of arithmetic over the columns and the writes, without reading or parsing any
+# attribute again, e.g., for grids of thousands of holes.
+# Gathering stores the original position of primitives with a laser:origin (laser:x, laser:y, laser:centerX and
+# laser:centerY), their positions are calculated from it and the thickness they were drawn for, _oldThickness_.
+class PrimitiveColumns(object):
+
+    def __init__(self, nodes, oldThickness):
+        self.sizes = []
+        self.radii = []
+        self.positions = []
+        self.bases = array("d")
+        self.factors = array("d")
+        sizes, radii, positions, bases, factors = self.sizes, self.radii, self.positions, self.bases, self.factors
+        for node in nodes:
+            adjust_setting = node.get(ADJUST)
+            adjustWidth = adjust_setting == "width" or adjust_setting == "both"
+            adjustHeight = adjust_setting == "height" or adjust_setting == "both"
+            # Circles and ellipses are adjusted around their center, so they don't have an origin
+            tag = node.tag
+            if tag == CIRCLE:
+                if adjust_setting == "both":
+                    radii.append((node, "r"))
+                continue
+            elif tag == ELLIPSE:
+                if adjustWidth:
+                    radii.append((node, "rx"))
+                if adjustHeight:
+                    radii.append((node, "ry"))
+                continue
+
+            if adjustWidth:
+                sizes.append((node, "width"))
+            if adjustHeight:
+                sizes.append((node, "height"))
+
+            # Adjust position of origin is specified
+            origin = node.get(ORIGIN)
+            if origin is None:
+                continue
+            originX, centerX = storeOrigin(node, "x", ORIGIN_X, CENTER_X, oldThickness)
+            originY, centerY = storeOrigin(node, "y", ORIGIN_Y, CENTER_Y, oldThickness)
+            if origin == "center":
+                if adjustHeight:
+                    positions.append((node, "y"))
+                    bases.append(centerY)
+                    factors.append(0.5)
+                if adjustWidth:
+                    positions.append((node, "x"))
+                    bases.append(centerX)
+                    factors.append(0.5)
+                continue
+            if adjustHeight and (origin == "bottom" or origin == "bottom-right"):
+                positions.append((node, "y"))
+                bases.append(originY + oldThickness)
+                factors.append(1.0)
+            if adjustWidth and (origin == "right" or origin == "bottom-right"):
+                positions.append((node, "x"))
+                bases.append(originX + oldThickness)
+                factors.append(1.0)
+
+    def apply(self, newThickness):
+        newThickness = str(newThickness)
+        newThicknessF = float(newThickness)
+        half = str(newThicknessF/2)
+        for node, attribute in self.sizes:
+            node.set(attribute, newThickness)
+        for node, attribute in self.radii:
+            node.set(attribute, half)
+        positions = [base - factor * newThicknessF for base, factor in zip(self.bases, self.factors)]
+        for (node, attribute), position in zip(self.positions, positions):
+            node.set(attribute, str(position))
+
+# The original position and center of a primitive along one axis, stored on the element the first time it is adjusted
+def storeOrigin(node, position, origin, center, oldThickness):
+    value = node.get(origin)
+    if value is None:
+        value = node.get(position)
+        node.set(center, str(float(value) + (oldThickness/2)))
+        node.set(origin, value)
+        return float(value), float(value) + (oldThickness/2)
+    return float(value), float(node.get(center))
+
+def adjustPathThickness(root, newThickness):
+    ParameterModel(root).update({"thickness": float(newThickness)}, everything=True)
+
+# The parameters every document has, with the root attribute they are stored in and their default
+BUILTIN_PARAMETERS = (("thickness", "material-thickness", 0.0), ("kerf", "kerf", 0.0), ("scale", "scale", 1.0))
+
+# The globals of every expression. Documents come from anywhere, e.g. the render service, so expressions only get
+# the parameters and arithmetic, not the builtins of Python.
+EXPRESSION_GLOBALS = {"__builtins__": {}}
+
+# The names a compiled expression uses, including those of the functions nested in it
+def codeNames(code):
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if hasattr(constant, "co_names"):
+            names.update(codeNames(constant))
+    return names
+
+# Parses "name: expression; name: expression", the format of laser:parameters and laser:attributes
+def parseParameters(text):
+    parameters = {}
+    for declaration in (text or "").split(";"):
+        name, colon, expression = declaration.partition(":")
+        if colon and name.strip() and expression.strip():
+            parameters[name.strip()] = expression.strip()
+    return parameters
+
+def formatParameters(parameters):
+    return "; ".join("{}: {}".format(name, expression) for name, expression in parameters.items())
+
+# The parameters of a document and everything that is calculated from them.
+# Besides the built-in ones, a document can define its own parameters in laser:parameters on the root, e.g.,
+# laser:parameters="tab: 2 * thickness; hole: 4; slot: hole + kerf". They can be used in laser:template like the
+# thickness, and in laser:attributes on any element, e.g., laser:attributes="r: hole / 2".
+# Every template and attribute expression is compiled once. The dependency graph maps each parameter to the parameters
+# derived from it and to the expressions that use it, such that a change only re-evaluates what it affects.
+#
+# Sheets can combine parts of different materials. A group or layer with its own laser:material-thickness, laser:kerf
+# or laser:scale is a scope: everything inside it uses these values instead of the ones of the document, and the
+# custom parameters are calculated for every scope. The scope of every element is found in the same pass over the
+# document that collects the expressions, and a change to one scope leaves the results of the others alone.
+class ParameterModel(object):
+
+    def __init__(self, root, targets=True, strict=False):
+        self.root = root
+        self.strict = strict
+        # Scope 0 is the document. The others are (element, parent scope), a parent always comes before its children.
+        self.scopes = [(root, None)]
+        self.overrides = [{}]
+        self.values = {}
+        for name, attribute, default in BUILTIN_PARAMETERS:
+            value = root.get(LASER + attribute)
+            self.values[name] = float(value) if value else default
+        self.scopeValues = [self.values]
+        # The custom parameters, as their source text and compiled. They may also derive a built-in one, e.g., the kerf.
+        self.expressions = {}
+        self.codes = {}
+        for name, expression in parseParameters(root.get(LASER + "parameters")).items():
+            self.define(name, expression)
+        self.checkNames(self.codes.values())
+
+        self.order = self.sortParameters()
+        self.calculate(self.order)
+        # The targets are (element, attribute, static text, compiled expressions, scope), the static text and the
+        # results of the expressions alternate in the value of the attribute. The users map (scope, parameter) to
+        # the targets that use it, and the primitives are the thickness-adjusted elements of each scope.
+        self.targets = []
+        self.users = {}
+        self.primitives = [[]]
+        self.compiled = {}
+        if targets:
+            self.collectTargets()
+
+    # One pass over the document, every element gets the scope of its closest ancestor that is one
+    def collectTargets(self):
+        stack = [(self.root, 0)]
+        while stack:
+            node, scope = stack.pop()
+            for child in node:
+                if not isinstance(child.tag, str):
+                    continue
+                overrides = readOverrides(child)
+                childScope = self.addScope(child, scope, overrides) if overrides else scope
+                self.collectElement(child, childScope)
+                if len(child):
+                    stack.append((child, childScope))
+
+    def collectElement(self, node, scope):
+        template = node.get(LASER + "template")
+        if template is None and node.get(LASER + "template-segments") is not None:
+            template = expandTemplate(node.get("d", ""), node.get(LASER + "template-segments"))
+        if template is not None:
+            pieces = TEMPLATE_PATTERN.split(template)
+            self.addTarget(node, "d", pieces[0::2], [self.compile(expression) for expression in pieces[1::2]], scope)
+        for attribute, expression in parseParameters(node.get(LASER + "attributes")).items():
+            self.addTarget(node, attribute, ["", ""], [self.compile(expression)], scope)
+        if node.get(LASER + "thickness-adjust") is not None:
+            self.primitives[scope].append(node)
+
+    # Copies of a part share their expressions, they are compiled once and evaluated once per scope in every update
+    def compile(self, expression):
+        code = self.compiled.get(expression)
+        if code is None:
+            code = compile(expression, "<expression>", "eval")
+            self.checkNames([code])
+            self.compiled[expression] = code
+        return code
+
+    def addTarget(self, node, attribute, static, codes, scope):
+        index = len(self.targets)
+        self.targets.append((node, attribute, static, codes, scope))
+        for code in codes:
+            for name in code.co_names:
+                self.users.setdefault((scope, name), set()).add(index)
+
+    def addScope(self, element, parent, overrides):
+        self.scopes.append((element, parent))
+        self.overrides.append(overrides)
+        self.primitives.append([])
+        values = dict(self.scopeValues[parent])
+        values.update(overrides)
+        self.scopeValues.append(values)
+        scope = len(self.scopes) - 1
+        self.calculate(self.order, scope)
+        return scope
+
+    # The scope that _element_ opens, or None if it doesn't set any values of its own
+    def scopeOf(self, element):
+        for index, (node, _) in enumerate(self.scopes):
+            if node == element:
+                return index
+        return None
+
+    # The scope and the scopes inside it that take _name_ from it
+    def inheriting(self, scope, name):
+        scopes = {scope}
+        for index, (_, parent) in enumerate(self.scopes):
+            if parent in scopes and name not in self.overrides[index]:
+                scopes.add(index)
+        return scopes
+
+    # The thickness-adjusted elements that use the thickness of _scope_
+    def primitivesOf(self, scope=0):
+        return [node for index in sorted(self.inheriting(scope, "thickness")) for node in self.primitives[index]]
+
+    # With _strict_ set, expressions may only use parameters. Documents from untrusted sources could reach Python through
+    # attributes like __class__ otherwise, so they are checked before anything is evaluated.
+    def checkNames(self, codes):
+        if not self.strict:
+            return
+        unknown = set().union(*map(codeNames, codes)).difference(self.values, self.codes)
+        if unknown:
+            raise ValueError("The expressions use names that are no parameters: {}".format(", ".join(sorted(unknown))))
+
+    def define(self, name, expression):
+        self.expressions[name] = str(expression)
+        self.codes[name] = compile(str(expression), "<parameter {}>".format(name), "eval")
+
+    # The custom parameters in an order in which each one comes after the ones it uses
+    def sortParameters(self):
+        order, state = [], {}
+        def visit(name):
+            if state.get(name) == "done":
+                return
+            if state.get(name) == "visiting":
+                raise ValueError("The parameter {} depends on itself".format(name))
+            state[name] = "visiting"
+            for other in self.codes[name].co_names:
+                if other in self.codes:
+                    visit(other)
+            state[name] = "done"
+            order.append(name)
+        for name in self.codes:
+            visit(name)
+        return order
+
+    # A value set on a scope itself wins over a custom parameter of the same name
+    def calculate(self, names, scope=0):
+        values = self.scopeValues[scope]
+        for name in names:
+            if name not in self.overrides[scope]:
+                values[name] = eval(self.codes[name], EXPRESSION_GLOBALS, values)
+
+    # The given parameters and all parameters derived from them
+    def affected(self, names):
+        affected = set(names)
+        # The order is topological, so one pass finds everything that depends on them, directly or not
+        for name in self.order:
+            if name not in affected and affected.intersection(self.codes[name].co_names):
+                affected.add(name)
+        return affected
+
+    # Sets parameters to new values, given as numbers or expressions, and updates the elements that use them.
+    # Numbers are set in _scope_ and reach the scopes inside it that don't set them themselves, expressions define
+    # custom parameters for the whole document. Only the expressions affected by a change are evaluated, unless
+    # _everything_ is set. With _evaluate_ False only the values are set, the caller evaluates the targets it needs.
+    # Returns the names of the parameters that changed in _scope_.
+    def update(self, changes, everything=False, scope=0, evaluate=True):
+        defined, changed = set(), set()
+        values = self.scopeValues[scope]
+        for name, value in changes.items():
+            if name in self.codes or isinstance(value, str) or name not in values:
+                if self.expressions.get(name) != str(value):
+                    self.define(name, value)
+                    defined.add(name)
+            elif values[name] != value:
+                values[name] = value
+                if scope:
+                    self.overrides[scope][name] = value
+                changed.add(name)
+        if defined:
+            self.checkNames([self.codes[name] for name in defined])
+            self.order = self.sortParameters()
+
+        # The scopes come after their parents, so one pass carries the changes inwards
+        changedIn = {}
+        for index, (_, parent) in enumerate(self.scopes):
+            names = set(defined)
+            if index == scope:
+                names.update(changed)
+            elif parent in changedIn:
+                inherited = changedIn[parent].difference(self.overrides[index])
+                for name in inherited.difference(self.codes):
+                    self.scopeValues[index][name] = self.scopeValues[parent][name]
+                names.update(inherited)
+            if names:
+                names = self.affected(names)
+                self.calculate([name for name in self.order if name in names], index)
+                changedIn[index] = names
+
+        if evaluate and everything:
+            self.evaluate(range(len(self.targets)))
+        elif evaluate:
+            self.evaluate(sorted(set().union(*(self.users.get((index, name), ()) for index, names in changedIn.items() for name in names))))
+        return changedIn.get(scope, set())
+
+    # Sets the attributes of the given targets (indices into self.targets) to the values of their expressions
+    def evaluate(self, targets):
+        results = {}
+        for index in targets:
+            node, attribute, static, codes, targetScope = self.targets[index]
+            result = [static[0]]
+            for code, text in zip(codes, static[1:]):
+                key = (targetScope, code)
+                if key not in results:
+                    results[key] = str(eval(code, EXPRESSION_GLOBALS, self.scopeValues[targetScope]))
+                result.append(results[key])
+                result.append(text)
+            node.set(attribute, "".join(result))
+
+    # Writes the custom parameters back to the document
+    def store(self):
+        if self.expressions:
+            self.root.set(LASER + "parameters", formatParameters(self.expressions))
+
+    # The expressions of the templates that are linear in the thickness of the document, as {target index: [(expression
+    # index, offset, coefficient), ...]}, such that the value of an expression is offset + coefficient * thickness at
+    # the current values of the other parameters. In a scope with a thickness of its own, the coefficient is 0.
+    def coefficients(self):
+        following = self.inheriting(0, "thickness")
+        derived = self.affected({"thickness"})
+        derived = [name for name in self.order if name in derived]
+        samples = {}
+        tables = {}
+        for index, (_, attribute, _, codes, scope) in enumerate(self.targets):
+            if attribute != "d":
+                continue
+            if scope not in samples:
+                thickness = self.scopeValues[scope]["thickness"]
+                points = (1.0, 2.0, thickness + 1.5, 2 * thickness + 7.25) if scope in following else (thickness,)
+                try:
+                    samples[scope] = [self.valuesAt(scope, point, derived) for point in points]
+                except Exception:
+                    samples[scope] = None
+            if samples[scope] is None:
+                continue
+            table = []
+            for number, code in enumerate(codes):
+                line = linearFit(code, samples[scope])
+                if line is not None:
+                    table.append((number,) + line)
+            if table:
+                tables[index] = table
+        return tables
+
+    # The values of _scope_ at another thickness, with the custom parameters that derive from it
+    def valuesAt(self, scope, thickness, derived):
+        values = dict(self.scopeValues[scope], thickness=thickness)
+        for name in derived:
+            if name not in self.overrides[scope]:
+                values[name] = eval(self.codes[name], EXPRESSION_GLOBALS, values)
+        return values
+
+# The line offset + coefficient * thickness through the values of _code_ for the given parameters, or None if they
+# don't lie on one, or aren't numbers. A single set of parameters gives a constant.
+def linearFit(code, samples):
+    points = []
+    for values in samples:
+        try:
+            value = eval(code, EXPRESSION_GLOBALS, values)
+        except Exception:
+            return None
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        points.append((values["thickness"], float(value)))
+    if len(points) == 1:
+        return points[0][1], 0.0
+    (x0, y0), (x1, y1) = points[:2]
+    coefficient = (y1 - y0) / (x1 - x0)
+    offset = y0 - coefficient * x0
+    for x, y in points[2:]:
+        if abs(offset + coefficient * x - y) > 1e-9 * max(1.0, abs(y)):
+            return None
+    return offset, coefficient
+
+# The values a group or layer sets for the elements inside it
+def readOverrides(element):
+    overrides = {}
+    for name, attribute, _ in BUILTIN_PARAMETERS:
+        value = element.get(LASER + attribute)
+        if value:
+            overrides[name] = float(value)
+    return overrides
+
+# The material thickness at _element_, from the closest group or layer that sets one, or the document
+def materialThickness(element):
+    for node in chain((element,), element.iterancestors()):
+        value = node.get(LASER + "material-thickness")
+        if value:
+            return float(value)
+    return 0
+
+# Splits a template into a list of (letter, arguments), the arguments are numbers or the source of an expression.
+# Numbers without a command repeat the previous one, as in path data, such that the indices match PathData.
+def parseTemplate(template):
+    pieces = TEMPLATE_PATTERN.split(template)
+    # The expressions are replaced by #<index> first, they may contain command letters
+    skeleton = "".join(piece if index % 2 == 0 else " #{} ".format(index // 2) for index, piece in enumerate(pieces))
+    commands = []
+    for letter, arguments in COMMAND_PATTERN.findall(skeleton):
+        count = ARGUMENT_COUNTS[letter]
+        arguments = [pieces[2 * int(match.group(1)) + 1] if match.group(1) else float(match.group(0)) for match in TEMPLATE_ARGUMENT_PATTERN.finditer(arguments)]
+        if count == 0:
+            commands.append((letter, []))
+            continue
+        repeats, rest = divmod(len(arguments), count)
+        if rest or not repeats:
+            raise ValueError("Wrong number of arguments for {} in template".format(letter))
+        for index in range(repeats):
+            repeated = letter if index == 0 or letter not in "mM" else "l" if letter == "m" else "L"
+            commands.append((repeated, arguments[index * count:(index + 1) * count]))
+    return commands
+
+# laser:template-segments is a compact alternative to laser:template. It only lists the segments that contain an
+# expression, by their index in the relative form of d, e.g., "3 v {thickness}; 5 l {-thickness} 0".
+# All other segments are taken from d, which is written in relative form when the template is evaluated.
+def encodeTemplate(template):
+    segments = []
+    for index, (letter, args) in enumerate(parseTemplate(template)):
+        if any(isinstance(arg, str) for arg in args):
+            terms = ["{" + arg + "}" if isinstance(arg, str) else formatNumber(arg) for arg in args]
+            segments.append(" ".join([str(index), letter] + terms))
+    return "; ".join(segments)
+
+# Rebuilds the full template from d and laser:template-segments
+def expandTemplate(d, segments):
+    commands = [" ".join([letter] + [formatNumber(arg) for arg in args]) for letter, args in PathData.parse(d).relative()]
+    for declaration in segments.split(";"):
+        index, _, command = declaration.strip().partition(" ")
+        if index:
+            commands[int(index)] = command.strip()
+    return " ".join(commands)
+
+# Evaluates all templates and thickness-adjusted primitives at _thickness_, or at the thickness of the document if 0
+def evaluateTemplates(root, thickness=0):
+    oldValue = root.get(LASER + "material-thickness")
+    oldThickness = float(oldValue) if oldValue is not None else 0
+    thickness = thickness or oldThickness
+    if thickness:
+        # Groups and layers with their own material keep their thickness
+        model = ParameterModel(root)
+        adjustElementThickness(root, thickness, oldThickness, model.primitivesOf(0))
+        model.update({"thickness": float(thickness)}, everything=True)
+    return thickness
+
+# Groups the visible shapes by their laser:action, which is inherited from the parents.
+# Returns {action: [(element, transform to the document, layer)]} in document order, shapes with action "none" are left out.
+def collectActions(root, defaultAction="cut"):
+    groups = {}
+    def visit(node, transform, action, layer):
+        for child in node:
+            if not isinstance(child.tag, str) or child.get("id") in HELPER_LAYERS:
+                continue
+            if child.tag not in SHAPES and child.tag not in CONTAINERS:
+                # defs, clip paths, text, and everything else that is not cut directly
+                continue
+            if child.get("display") == "none" or "display:none" in (child.get("style") or "").replace(" ", ""):
+                continue
+            childTransform = multiplyTransform(transform, parseTransform(child.get("transform")))
+            childAction = child.get(LASER + "action", action)
+            if child.tag in SHAPES:
+                if childAction != "none":
+                    groups.setdefault(childAction, []).append((child, childTransform, layer))
+            else:
+                if child.get(INKSCAPE + "groupmode") == "layer":
+                    layer = child.get(INKSCAPE + "label") or child.get("id") or layer
+                visit(child, childTransform, childAction, layer)
+    visit(root, IDENTITY, defaultAction, "")
+    return groups
+
+def parseTransform(transform):
+    matrix = IDENTITY
+    for kind, values in TRANSFORM_PATTERN.findall(transform or ""):
+        values = [float(value) for value in NUMBER_PATTERN.findall(values)]
+        if kind == "matrix":
+            step = tuple(values[:6])
+        elif kind == "translate":
+            step = (1.0, 0.0, 0.0, 1.0, values[0], values[1] if len(values) > 1 else 0.0)
+        elif kind == "scale":
+            step = (values[0], 0.0, 0.0, values[1] if len(values) > 1 else values[0], 0.0, 0.0)
+        elif kind == "rotate":
+            angle = radians(values[0])
+            step = (cos(angle), sin(angle), -sin(angle), cos(angle), 0.0, 0.0)
+            if len(values) == 3:
+                step = multiplyTransform(multiplyTransform((1.0, 0.0, 0.0, 1.0, values[1], values[2]), step), (1.0, 0.0, 0.0, 1.0, -values[1], -values[2]))
+        elif kind == "skewX":
+            step = (1.0, 0.0, tan(radians(values[0])), 1.0, 0.0, 0.0)
+        else:
+            step = (1.0, tan(radians(values[0])), 0.0, 1.0, 0.0, 0.0)
+        matrix = multiplyTransform(matrix, step)
+    return matrix
+
+def multiplyTransform(m, n):
+    return (m[0] * n[0] + m[2] * n[1], m[1] * n[0] + m[3] * n[1],
+            m[0] * n[2] + m[2] * n[3], m[1] * n[2] + m[3] * n[3],
+            m[0] * n[4] + m[2] * n[5] + m[4], m[1] * n[4] + m[3] * n[5] + m[5])
+
+def invertTransform(m):
+    a, b, c, d, e, f = m
+    determinant = a * d - b * c
+    return (d / determinant, -b / determinant, -c / determinant, a / determinant,
+            (c * f - d * e) / determinant, (b * e - a * f) / determinant)
+
+# As the value of a transform attribute. The rounding drops the remainders of rotations by multiples of 90°.
+def formatTransform(m):
+    m = [round(value, 9) for value in m]
+    if m[:4] == [1.0, 0.0, 0.0, 1.0]:
+        return "translate({}, {})".format(formatNumber(m[4]), formatNumber(m[5]))
+    return "matrix({})".format(", ".join(formatNumber(value) for value in m))
+
+# A length like "100mm" in millimeters
+def toMillimeters(length):
+    match = re.match(r"\s*([-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?)\s*([a-zA-Z]*)", length or "")
+    if match is None:
+        return None
+    return float(match.group(1)) * UNITS.get(match.group(2).lower(), UNITS["px"])
+
+# From user units to millimeters, with the y axis pointing up if the origin is at the bottom
+def documentMatrix(root, bottomLeft=True):
+    viewBox = [float(value) for value in NUMBER_PATTERN.findall(root.get("viewBox", ""))]
+    width, height = toMillimeters(root.get("width")), toMillimeters(root.get("height"))
+    if len(viewBox) == 4 and viewBox[2] > 0:
+        scale = width / viewBox[2] if width else UNITS["px"]
+        left, top, pageHeight = viewBox[0], viewBox[1], viewBox[3]
+    else:
+        # Without a viewBox user units are px
+        scale = UNITS["px"]
+        left, top, pageHeight = 0.0, 0.0, (height or 0.0) / scale
+    if not bottomLeft:
+        return (scale, 0.0, 0.0, scale, -scale * left, -scale * top)
+    return (scale, 0.0, 0.0, -scale, -scale * left, scale * (pageHeight + top))
+
+# The outline of a shape element as path data
+def shapePath(element):
+    tag = element.tag
+    number = lambda attribute: float((NUMBER_PATTERN.findall(element.get(attribute) or "") or [0])[0])
+    if tag == SVG + "path":
+        return element.get("d", "")
+    if tag == SVG + "rect":
+        x, y, width, height = number("x"), number("y"), number("width"), number("height")
+        rx, ry = element.get("rx"), element.get("ry")
+        rx, ry = number("rx") if rx is not None else None, number("ry") if ry is not None else None
+        rx, ry = (rx if rx is not None else ry) or 0.0, (ry if ry is not None else rx) or 0.0
+        rx, ry = min(rx, width / 2), min(ry, height / 2)
+        if rx <= 0 or ry <= 0:
+            return "M {} {} h {} v {} h {} z".format(x, y, width, height, -width)
+        return ("M {x1} {y} H {x2} A {rx} {ry} 0 0 1 {r} {y1} V {y2} A {rx} {ry} 0 0 1 {x2} {b} H {x1} A {rx} {ry} 0 0 1 {x} {y2} V {y1} A {rx} {ry} 0 0 1 {x1} {y} z"
+                .format(x=x, y=y, r=x + width, b=y + height, x1=x + rx, x2=x + width - rx, y1=y + ry, y2=y + height - ry, rx=rx, ry=ry))
+    if tag == SVG + "circle" or tag == SVG + "ellipse":
+        cx, cy = number("cx"), number("cy")
+        rx, ry = (number("r"), number("r")) if tag == SVG + "circle" else (number("rx"), number("ry"))
+        if rx <= 0 or ry <= 0:
+            return ""
+        return "M {} {} A {rx} {ry} 0 1 0 {} {} A {rx} {ry} 0 1 0 {} {} z".format(cx - rx, cy, cx + rx, cy, cx - rx, cy, rx=rx, ry=ry)
+    if tag == SVG + "line":
+        return "M {} {} L {} {}".format(number("x1"), number("y1"), number("x2"), number("y2"))
+    if tag == SVG + "polyline" or tag == SVG + "polygon":
+        points = element.get("points", "").strip()
+        if not points:
+            return ""
+        return "M " + points + (" z" if tag == SVG + "polygon" else "")
+    return ""
+
+# Subdivides the curve until the control points are within _tolerance_ of the chord, which bounds the distance
+# of the curve to the chord as well. Flat parts need few points, tight bends get many.
+def flattenCubic(x0, y0, x1, y1, x2, y2, x3, y3, tolerance, maxDepth=16):
+    points = [(x0, y0)]
+    stack = [(x0, y0, x1, y1, x2, y2, x3, y3, 0)]
+    squaredTolerance = tolerance * tolerance
+    while stack:
+        x0, y0, x1, y1, x2, y2, x3, y3, depth = stack.pop()
+        dx, dy = x3 - x0, y3 - y0
+        chord = dx * dx + dy * dy
+        if chord > 1e-18:
+            d1 = (x1 - x0) * dy - (y1 - y0) * dx
+            d2 = (x2 - x0) * dy - (y2 - y0) * dx
+            flat = max(d1 * d1, d2 * d2) <= squaredTolerance * chord
+        else:
+            flat = max((x1 - x0) ** 2 + (y1 - y0) ** 2, (x2 - x0) ** 2 + (y2 - y0) ** 2) <= squaredTolerance
+        if flat or depth >= maxDepth:
+            points.append((x3, y3))
+            continue
+        # de Casteljau split at t = 0.5
+        ax, ay = (x0 + x1) / 2, (y0 + y1) / 2
+        bx, by = (x1 + x2) / 2, (y1 + y2) / 2
+        cx, cy = (x2 + x3) / 2, (y2 + y3) / 2
+        abx, aby = (ax + bx) / 2, (ay + by) / 2
+        bcx, bcy = (bx + cx) / 2, (by + cy) / 2
+        mx, my = (abx + bcx) / 2, (aby + bcy) / 2
+        stack.append((mx, my, bcx, bcy, cx, cy, x3, y3, depth + 1))
+        stack.append((x0, y0, ax, ay, abx, aby, mx, my, depth + 1))
+    return points
+
+# The center parameterization of an SVG arc (see the implementation notes of the SVG specification).
+# Returns (cx, cy, rx, ry, rotation in radians, start angle, sweep angle) or None if the arc is a straight line.
+def arcCenter(x1, y1, rx, ry, rotation, large, sweep, x2, y2):
+    rx, ry = abs(rx), abs(ry)
+    if rx == 0 or ry == 0 or (x1 == x2 and y1 == y2):
+        return None
+    phi = rotation * pi / 180
+    cosPhi, sinPhi = cos(phi), sin(phi)
+    dx, dy = (x1 - x2) / 2, (y1 - y2) / 2
+    x1p, y1p = cosPhi * dx + sinPhi * dy, -sinPhi * dx + cosPhi * dy
+    # Radii that are too small are scaled up until the arc fits
+    scale = (x1p * x1p) / (rx * rx) + (y1p * y1p) / (ry * ry)
+    if scale > 1:
+        rx, ry = rx * sqrt(scale), ry * sqrt(scale)
+    numerator = rx * rx * ry * ry - rx * rx * y1p * y1p - ry * ry * x1p * x1p
+    factor = sqrt(max(0, numerator / (rx * rx * y1p * y1p + ry * ry * x1p * x1p)))
+    if bool(large) == bool(sweep):
+        factor = -factor
+    cxp, cyp = factor * rx * y1p / ry, -factor * ry * x1p / rx
+    cx = cosPhi * cxp - sinPhi * cyp + (x1 + x2) / 2
+    cy = sinPhi * cxp + cosPhi * cyp + (y1 + y2) / 2
+    angle = lambda ux, uy, vx, vy: (1 if ux * vy - uy * vx >= 0 else -1) * acos(max(-1, min(1, (ux * vx + uy * vy) / (sqrt(ux * ux + uy * uy) * sqrt(vx * vx + vy * vy)))))
+    startAngle = angle(1, 0, (x1p - cxp) / rx, (y1p - cyp) / ry)
+    sweepAngle = angle((x1p - cxp) / rx, (y1p - cyp) / ry, (-x1p - cxp) / rx, (-y1p - cyp) / ry) % (2 * pi)
+    if not sweep:
+        sweepAngle -= 2 * pi
+    return cx, cy, rx, ry, phi, startAngle, sweepAngle
+
+# Approximates an arc with cubic curves of at most 90 degrees each, returns their control and end points
+def arcCurves(cx, cy, rx, ry, phi, startAngle, sweepAngle):
+    count = max(1, int(ceil(abs(sweepAngle) / (pi / 2) - 1e-9)))
+    step = sweepAngle / count
+    k = 4 / 3 * tan(step / 4)
+    cosPhi, sinPhi = cos(phi), sin(phi)
+    point = lambda px, py: (cx + cosPhi * px - sinPhi * py, cy + sinPhi * px + cosPhi * py)
+    curves = []
+    angle = startAngle
+    for _ in range(count):
+        cos1, sin1, cos2, sin2 = cos(angle), sin(angle), cos(angle + step), sin(angle + step)
+        curves.append(point(rx * (cos1 - k * sin1), ry * (sin1 + k * cos1)) + point(rx * (cos2 + k * sin2), ry * (sin2 - k * cos2)) + point(rx * cos2, ry * sin2))
+        angle += step
+    return curves
+
+# Whether the inside of a shape is decided by the even-odd rule, instead of the nonzero winding number
+def evenOddFill(element):
+    return element.get("fill-rule") == "evenodd" or "fill-rule:evenodd" in (element.get("style") or "").replace(" ", "")
+
+# The spans of the scanlines y = k * spacing that lie inside the polygons, which are lists of (x, y).
+# Returns [(k, [(x1, x2), ...])] for every scanline that crosses the polygons, from the lowest y to the highest.
+def scanlineSpans(polygons, spacing, evenOdd=False):
+    ys = [point[1] for points in polygons for point in points]
+    if not ys:
+        return []
+    lowest = int(ceil(min(ys) / spacing))
+    # The edge table has a bucket for every scanline. Each edge adds its crossings with all the scanlines it spans at once,
+    # so there is no list of active edges to maintain while sweeping.
+    table = [[] for _ in range(int(ceil(max(ys) / spacing)) - lowest + 1)]
+    for points in polygons:
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            if y0 == y1:
+                continue
+            winding = 1
+            if y0 > y1:
+                x0, y0, x1, y1, winding = x1, y1, x0, y0, -1
+            # Each edge includes its lower end but not its upper one, such that a scanline through a vertex crosses once
+            first, end = int(ceil(y0 / spacing)), int(ceil(y1 / spacing))
+            slope = (x1 - x0) / (y1 - y0)
+            x = x0 + (first * spacing - y0) * slope
+            step = slope * spacing
+            for index in range(end - first):
+                table[first - lowest + index].append((x + index * step, winding))
+
+    lines = []
+    for index, crossings in enumerate(table):
+        if not crossings:
+            continue
+        crossings.sort()
+        spans = crossingSpans(crossings, evenOdd)
+        if spans:
+            lines.append((lowest + index, spans))
+    return lines
+
+# The parts of a scanline that are inside, from its crossings with the edges as (x, winding direction) sorted by x
+def crossingSpans(crossings, evenOdd=False):
+    spans = []
+    if evenOdd:
+        spans = [(crossings[i][0], crossings[i + 1][0]) for i in range(0, len(crossings) - 1, 2)]
+    else:
+        # Inside is everywhere the winding number is not zero
+        winding = 0
+        for x, direction in crossings:
+            if winding == 0:
+                start = x
+            winding += direction
+            if winding == 0:
+                spans.append((start, x))
+    return [span for span in spans if span[1] - span[0] > 1e-9]
+
+# The area that the polygons cover under the fill rule, such that holes are subtracted whatever their direction.
+# Between two consecutive vertices in y the width of the inside changes linearly, as long as no edges cross there,
+# so the width in the middle of each slab gives its exact area.
+def fillArea(polygons, evenOdd=False):
+    edges = []
+    for points in polygons:
+        for (x0, y0), (x1, y1) in zip(points, points[1:] + points[:1]):
+            if y0 == y1:
+                continue
+            winding = 1
+            if y0 > y1:
+                x0, y0, x1, y1, winding = x1, y1, x0, y0, -1
+            edges.append((y0, y1, x0, (x1 - x0) / (y1 - y0), winding))
+    edges.sort()
+    heights = sorted({y for edge in edges for y in edge[:2]})
+    area = 0.0
+    active = []
+    following = 0
+    for low, high in zip(heights, heights[1:]):
+        middle = (low + high) / 2
+        while following < len(edges) and edges[following][0] <= low:
+            active.append(edges[following])
+            following += 1
+        active = [edge for edge in active if edge[1] > middle]
+        crossings = sorted((x0 + (middle - y0) * slope, winding) for y0, _, x0, slope, winding in active)
+        area += sum(x2 - x1 for x1, x2 in crossingSpans(crossings, evenOdd)) * (high - low)
+    return area
+
+# Flattens a path into polylines in the coordinates of _matrix_. Returns a list of (points, closed) for every subpath.
+def flattenPath(path, matrix, tolerance):
+    a, b, c, d, e, f = matrix
+    subpaths = []
+    points = None
+    x, y, startX, startY = 0.0, 0.0, 0.0, 0.0
+    # The last control points, for the reflection in smooth curves
+    cubicX, cubicY, quadX, quadY = None, None, None, None
+    for letter, args in path.absolute():
+        lastCubic, lastQuad = (cubicX, cubicY), (quadX, quadY)
+        cubicX = cubicY = quadX = quadY = None
+        if letter == "M":
+            x, y = startX, startY = args
+            points = [(a * x + c * y + e, b * x + d * y + f)]
+            subpaths.append([points, False])
+            continue
+        if points is None:
+            points = [(e, f)]
+            subpaths.append([points, False])
+        if letter in "LHVZ":
+            if letter == "L":
+                x, y = args
+            elif letter == "H":
+                x = args[0]
+            elif letter == "V":
+                y = args[0]
+            else:
+                x, y = startX, startY
+                subpaths[-1][1] = True
+            points.append((a * x + c * y + e, b * x + d * y + f))
+            if letter == "Z":
+                # Drawing on after a closepath starts a new subpath at the start point
+                points = [points[-1]]
+                subpaths.append([points, False])
+            continue
+        if letter in "CS":
+            if letter == "C":
+                x1, y1, x2, y2, x3, y3 = args
+            else:
+                x2, y2, x3, y3 = args
+                x1, y1 = (2 * x - lastCubic[0], 2 * y - lastCubic[1]) if lastCubic[0] is not None else (x, y)
+            curves = [(x1, y1, x2, y2, x3, y3)]
+            cubicX, cubicY = x2, y2
+        elif letter in "QT":
+            if letter == "Q":
+                qx, qy, x3, y3 = args
+            else:
+                x3, y3 = args
+                qx, qy = (2 * x - lastQuad[0], 2 * y - lastQuad[1]) if lastQuad[0] is not None else (x, y)
+            # Quadratic curves are cubic curves with both control points at 2/3 towards the quadratic one
+            curves = [(x + 2 / 3 * (qx - x), y + 2 / 3 * (qy - y), x3 + 2 / 3 * (qx - x3), y3 + 2 / 3 * (qy - y3), x3, y3)]
+            quadX, quadY = qx, qy
+        else:
+            rx, ry, rotation, large, sweep, x3, y3 = args
+            arc = arcCenter(x, y, rx, ry, rotation, large, sweep, x3, y3)
+            curves = arcCurves(*arc) if arc is not None else [(x, y, x3, y3, x3, y3)]
+        for x1, y1, x2, y2, x3, y3 in curves:
+            points.extend(flattenCubic(a * x + c * y + e, b * x + d * y + f, a * x1 + c * y1 + e, b * x1 + d * y1 + f,
+                                       a * x2 + c * y2 + e, b * x2 + d * y2 + f, a * x3 + c * y3 + e, b * x3 + d * y3 + f, tolerance)[1:])
+            x, y = x3, y3
+    # Leftovers of a closepath at the end
+    return [(subpath, closed) for subpath, closed in subpaths if len(subpath) > 1]
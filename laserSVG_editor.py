@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# The live preview window of the external editor. It runs as a separate process next to Inkscape,
+# laserSVG_external_edit.py sends it the document over a local socket (a named pipe on Windows).
+
+import getpass
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+from lxml import etree
+
+from laserSVG_core import LASER, BUILTIN_PARAMETERS, ParameterModel, PrimitiveColumns, formatNumber
+
+# The socket and the key to connect to it live in a directory only the current user can access
+def runtimeDirectory():
+    directory = os.path.join(tempfile.gettempdir(), "lasersvg-{}".format(getpass.getuser()))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return directory
+
+def editorAddress():
+    if sys.platform == "win32":
+        return r"\\.\pipe\lasersvg-editor-{}".format(getpass.getuser())
+    return os.path.join(runtimeDirectory(), "editor.sock")
+
+def editorKey(create=False):
+    path = os.path.join(runtimeDirectory(), "editor.key")
+    if create:
+        key = os.urandom(32)
+        with open(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as keyFile:
+            keyFile.write(key)
+        return key
+    with open(path, "rb") as keyFile:
+        return keyFile.read()
+
+# Connects to the running editor, and starts a new one if there is none
+def connectEditor(start=True, timeout=10):
+    try:
+        return Client(editorAddress(), authkey=editorKey())
+    except AuthenticationError:
+        # An editor answers, but the key was read before it wrote its new one. Reading it again is enough.
+        if not start:
+            raise
+    except (OSError, EOFError):
+        if not start:
+            raise
+        # The editor has to outlive the extension, so it gets its own session and no handles to Inkscape's pipes
+        options = {"start_new_session": True} if sys.platform != "win32" else {"creationflags": subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP}
+        subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=True, **options)
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return Client(editorAddress(), authkey=editorKey())
+        except (OSError, EOFError, AuthenticationError):
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+# Sends a document to the editor. Only raw bytes are exchanged, nothing is unpickled on either side.
+def sendDocument(document, name, parameters):
+    connection = connectEditor()
+    try:
+        connection.send_bytes(json.dumps({"command": "load", "name": name, "parameters": parameters}).encode("utf-8"))
+        connection.send_bytes(document)
+        return json.loads(connection.recv_bytes().decode("utf-8"))
+    finally:
+        connection.close()
+
+# Accepts documents on the editor socket in a background thread and hands them to _handler_
+class EditorServer(object):
+    def __init__(self, handler):
+        self.handler = handler
+        address = editorAddress()
+        if sys.platform != "win32" and os.path.exists(address):
+            # Left over from an editor that crashed, we only get here if nobody answered on it
+            os.unlink(address)
+        self.listener = Listener(address, authkey=editorKey(create=True))
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except AuthenticationError:
+                # A client with the key of an earlier editor, it tries again with the new one
+                continue
+            except OSError:
+                return
+            try:
+                header = json.loads(connection.recv_bytes().decode("utf-8"))
+                if header.get("command") == "load":
+                    document = connection.recv_bytes()
+                    self.handler(header.get("name", ""), document, header.get("parameters", {}))
+                    connection.send_bytes(b'{"status": "ok"}')
+                else:
+                    connection.send_bytes(b'{"status": "unknown command"}')
+            except (EOFError, OSError, ValueError):
+                pass
+            finally:
+                connection.close()
+
+    def close(self):
+        self.listener.close()
+
+
+# Holds a document with all templates compiled once, such that changing a parameter only evaluates the expressions
+# that use it (see ParameterModel). Evaluated documents are cached per set of parameters, switching back to a previous
+# value costs nothing. Documents from untrusted sources are loaded _strict_ (see ParameterModel.checkNames).
+class Preview(object):
+
+    def __init__(self, document, cacheSize=256, strict=False):
+        self.tree = etree.fromstring(document)
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+        self.model = ParameterModel(self.tree, strict=strict)
+        self.model.update({}, everything=True)
+        # The parameters as the document sets them, parameters that are not given to render keep these
+        self.defaults = {name: self.model.values[name] for name, _, _ in BUILTIN_PARAMETERS if name not in self.model.codes}
+        self.defaults.update(self.model.expressions)
+
+        # The primitives are read once, the preview always calculates from their original geometry. Primitives in groups
+        # and layers with their own material keep their thickness.
+        self.primitives = PrimitiveColumns(self.model.primitivesOf(0), self.model.values["thickness"])
+
+    def evaluate(self, thickness, kerf=0):
+        return self.render({"thickness": thickness, "kerf": kerf})
+
+    # The document with the given parameters, {name: number}, as SVG
+    def render(self, parameters):
+        key = tuple(sorted(parameters.items()))
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        changes = dict(self.defaults)
+        changes.update(parameters)
+        self.model.update(changes)
+        thickness = self.model.values["thickness"]
+        self.primitives.apply(formatNumber(thickness))
+        # The settings go with the geometry, such that lasersvg.js and later steps adjust from the rendered values
+        for name, attribute, default in BUILTIN_PARAMETERS:
+            if name != "scale" or self.model.values[name] != default or self.tree.get(LASER + attribute) is not None:
+                self.tree.set(LASER + attribute, formatNumber(self.model.values[name]))
+        result = self.cache[key] = etree.tostring(self.tree)
+        if len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+        return result
+
+
+def main():
+    import gi
+    gi.require_version('Gtk', '3.0')
+    from gi.repository import Gtk, GLib, GdkPixbuf
+
+    class EditorWindow(Gtk.Window):
+        def __init__(self):
+            Gtk.Window.__init__(self, title="LaserSVG Editor")
+            self.set_border_width(10)
+            self.preview = None
+            self.pending = False
+
+            vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=6)
+            self.add(vbox)
+
+            self.image = Gtk.Image()
+            vbox.pack_start(self.image, True, True, 0)
+
+            self.thickness = self.addSlider(vbox, "Material thickness", 0, 30, 0.1, 3)
+            self.kerf = self.addSlider(vbox, "Kerf", 0, 2, 0.01, 0)
+
+            button = Gtk.Button.new_with_mnemonic("_Save as")
+            button.connect("clicked", self.on_save_clicked)
+            vbox.pack_start(button, False, False, 0)
+
+        def addSlider(self, box, label, lower, upper, step, value):
+            hbox = Gtk.Box(spacing=6)
+            hbox.pack_start(Gtk.Label(label=label), False, False, 0)
+            scale = Gtk.Scale.new_with_range(Gtk.Orientation.HORIZONTAL, lower, upper, step)
+            scale.set_value(value)
+            scale.connect("value-changed", self.on_value_changed)
+            hbox.pack_start(scale, True, True, 0)
+            box.pack_start(hbox, False, False, 0)
+            return scale
+
+        # Called from the server thread through GLib.idle_add
+        def load(self, name, document, parameters):
+            self.preview = Preview(document)
+            self.set_title("LaserSVG Editor - {}".format(os.path.basename(name)))
+            self.thickness.set_value(float(parameters.get("thickness", self.thickness.get_value())))
+            self.kerf.set_value(float(parameters.get("kerf", self.kerf.get_value())))
+            self.render()
+            self.present()
+            return False
+
+        # Sliders fire many events while they are dragged, so we render at most once per frame
+        def on_value_changed(self, scale):
+            if not self.pending:
+                self.pending = True
+                GLib.timeout_add(30, self.render)
+
+        def render(self):
+            self.pending = False
+            if self.preview is None:
+                return False
+            loader = GdkPixbuf.PixbufLoader()
+            loader.set_size(800, 600)
+            loader.write(self.preview.evaluate(round(self.thickness.get_value(), 2), round(self.kerf.get_value(), 3)))
+            loader.close()
+            self.image.set_from_pixbuf(loader.get_pixbuf())
+            return False
+
+        def on_save_clicked(self, button):
+            if self.preview is None:
+                return
+            dialog = Gtk.FileChooserDialog(title="Save as", parent=self, action=Gtk.FileChooserAction.SAVE)
+            dialog.add_buttons(Gtk.STOCK_CANCEL, Gtk.ResponseType.CANCEL, Gtk.STOCK_SAVE, Gtk.ResponseType.OK)
+            dialog.set_do_overwrite_confirmation(True)
+            if dialog.run() == Gtk.ResponseType.OK:
+                with open(dialog.get_filename(), "wb") as output:
+                    output.write(self.preview.evaluate(round(self.thickness.get_value(), 2), round(self.kerf.get_value(), 3)))
+            dialog.destroy()
+
+    win = EditorWindow()
+    server = EditorServer(lambda name, document, parameters: GLib.idle_add(win.load, name, document, parameters))
+    server.start()
+    win.connect("destroy", Gtk.main_quit)
+    win.show_all()
+    try:
+        Gtk.main()
+    finally:
+        server.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Estimates the cut length, the engraved length and area, the travel distance, and the machine time of a job,
+# per laser:action and per layer, at a given material thickness. The drawing itself is not changed.
+# From the command line it runs without inkex and writes JSON, e.g., for every variant in a batch:
+#
+#   python laserSVG_estimate.py --material_thickness=4 --profiles=machine.json design.svg > design.json
+
+import json
+import sys
+from array import array
+from itertools import accumulate
+from math import hypot, sqrt
+from operator import sub
+
+from laserSVG_core import LaserSVGMixin, LASER, PathData, evaluateTemplates, collectActions, documentMatrix, multiplyTransform, \
+    shapePath, flattenPath, evenOddFill, fillArea
+
+# Speeds are in mm/min, the acceleration in mm/s². Actions without a profile use the one for cutting.
+DEFAULT_PROFILES = {"cut": {"speed": 600, "power": 100, "passes": 1},
+                    "engrave": {"speed": 3000, "power": 30, "passes": 1},
+                    "travel": {"speed": 6000},
+                    "acceleration": 1000}
+
+# Builds the profiles from the command line options, a JSON file given with --profiles overrides them
+def loadProfiles(options):
+    profiles = {"cut": {"speed": float(options.cut_speed), "power": float(options.cut_power), "passes": int(options.cut_passes)},
+                "engrave": {"speed": float(options.engrave_speed), "power": float(options.engrave_power), "passes": int(options.engrave_passes)},
+                "travel": {"speed": float(options.travel_speed)},
+                "acceleration": float(options.acceleration)}
+    if options.profiles:
+        with open(options.profiles) as profileFile:
+            for key, value in json.load(profileFile).items():
+                if isinstance(value, dict):
+                    profiles.setdefault(key, {}).update(value)
+                else:
+                    profiles[key] = value
+    return profiles
+
+# The time for a move of _length_ that starts and ends at rest, with a trapezoidal speed profile
+def moveTime(length, speed, acceleration):
+    if length <= 0:
+        return 0.0
+    if acceleration <= 0 or length >= speed * speed / acceleration:
+        return length / speed + (speed / acceleration if acceleration > 0 else 0.0)
+    # Too short to reach full speed
+    return 2 * sqrt(length / acceleration)
+
+def emptyStatistics():
+    return {"length": 0.0, "area": 0.0, "travel": 0.0, "time": 0.0, "paths": 0}
+
+# Analyses the document (which is evaluated in place) and returns the report as a dictionary
+def estimateDocument(root, thickness=0, profiles=DEFAULT_PROFILES, order=("engrave", "cut"), tolerance=0.05):
+    thickness = evaluateTemplates(root, thickness)
+    groups = collectActions(root, root.get(LASER + "action", "cut"))
+    matrix = documentMatrix(root)
+
+    # All points of all subpaths go into one array per axis, in the order the machine visits them, starting at the origin.
+    # The segments between the end of one subpath and the start of the next one are the travel moves.
+    xs, ys = array("d", [0.0]), array("d", [0.0])
+    starts, ends, closed, elements = array("l"), array("l"), array("b"), array("l")
+    keys = []
+    fills = []
+    actions = [action for action in order if action in groups] + [action for action in groups if action not in order]
+    for action in actions:
+        for element, transform, layer in groups[action]:
+            try:
+                path = PathData.parse(shapePath(element))
+            except ValueError:
+                continue
+            for points, isClosed in flattenPath(path, multiplyTransform(matrix, transform), tolerance):
+                starts.append(len(xs))
+                xs.extend(point[0] for point in points)
+                ys.extend(point[1] for point in points)
+                ends.append(len(xs))
+                closed.append(isClosed)
+                elements.append(len(keys))
+            keys.append((action, layer))
+            fills.append(evenOddFill(element))
+
+    # One pass over all segments for the lengths, the length of each subpath is then a difference of the running totals
+    lengths = array("d", map(hypot, map(sub, xs[1:], xs[:-1]), map(sub, ys[1:], ys[:-1])))
+    totalLength = array("d", accumulate(lengths, initial=0.0))
+
+    acceleration = profiles.get("acceleration", 0)
+    travelSpeed = profiles["travel"]["speed"] / 60
+    result = {"thickness": thickness, "units": {"length": "mm", "area": "mm²", "time": "s"},
+              "total": emptyStatistics(), "actions": {}, "layers": {}}
+    # The closed subpaths of each element
+    regions = {}
+    for start, end, isClosed, element in zip(starts, ends, closed, elements):
+        action, layer = keys[element]
+        profile = profiles.get(action, profiles["cut"])
+        passes = profile.get("passes", 1)
+        length = totalLength[end - 1] - totalLength[start]
+        travel = lengths[start - 1]
+        time = passes * (moveTime(length, profile["speed"] / 60, acceleration) + moveTime(travel, travelSpeed, acceleration))
+        for statistics in (result["total"], result["actions"].setdefault(action, emptyStatistics()),
+                           result["layers"].setdefault(layer, {}).setdefault(action, emptyStatistics())):
+            statistics["length"] += length
+            statistics["travel"] += travel * passes
+            statistics["time"] += time
+            statistics["paths"] += 1
+        # Paths that end where they started enclose an area, even without a closepath
+        if isClosed or (xs[start] == xs[end - 1] and ys[start] == ys[end - 1]):
+            regions.setdefault(element, []).append(list(zip(xs[start:end], ys[start:end])))
+
+    # The area under the fill rule of the element, a hole is subtracted whatever the direction it is drawn in
+    for element, polygons in regions.items():
+        action, layer = keys[element]
+        area = fillArea(polygons, fills[element])
+        for statistics in (result["total"], result["actions"][action], result["layers"][layer][action]):
+            statistics["area"] += area
+
+    for statistics in [result["total"]] + list(result["actions"].values()) + [entry for layer in result["layers"].values() for entry in layer.values()]:
+        for key in ("length", "area", "travel", "time"):
+            statistics[key] = round(statistics[key], 3)
+    for action, statistics in result["actions"].items():
+        statistics["profile"] = profiles.get(action, profiles["cut"])
+    return result
+
+def formatTime(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{}:{:02d}:{:02d}".format(hours, minutes, seconds) if hours else "{}:{:02d}".format(minutes, seconds)
+
+def formatReport(result):
+    lines = ["Material thickness: {} mm".format(result["thickness"])]
+    for action, statistics in result["actions"].items():
+        lines.append("{}: {:.1f} mm in {} paths, {:.1f} mm² enclosed, {} min".format(action, statistics["length"], statistics["paths"], statistics["area"], formatTime(statistics["time"])))
+    for layer, actions in result["layers"].items():
+        lines.append("Layer {}: ".format(layer or "(root)") + ", ".join("{} {:.1f} mm".format(action, statistics["length"]) for action, statistics in actions.items()))
+    lines.append("Travel: {:.1f} mm".format(result["total"]["travel"]))
+    lines.append("Estimated time: {} min".format(formatTime(result["total"]["time"])))
+    return "\n".join(lines)
+
+def writeReport(result, options):
+    if options.json:
+        with open(options.json, "w") as output:
+            json.dump(result, output, indent=2, ensure_ascii=False)
+
+
+def addArguments(pars):
+    pars.add_argument("--material_thickness", type=float, default=0, help="The material thickness, 0 uses the thickness of the document")
+    pars.add_argument("--cut_speed", type=float, default=600, help="Feed rate for cutting in mm/min")
+    pars.add_argument("--cut_power", type=float, default=100, help="Laser power for cutting in percent")
+    pars.add_argument("--cut_passes", type=int, default=1, help="Number of passes for cutting")
+    pars.add_argument("--engrave_speed", type=float, default=3000, help="Feed rate for engraving in mm/min")
+    pars.add_argument("--engrave_power", type=float, default=30, help="Laser power for engraving in percent")
+    pars.add_argument("--engrave_passes", type=int, default=1, help="Number of passes for engraving")
+    pars.add_argument("--travel_speed", type=float, default=6000, help="Speed of travel moves in mm/min")
+    pars.add_argument("--acceleration", type=float, default=1000, help="Acceleration of the machine in mm/s²")
+    pars.add_argument("--order", default="engrave,cut", help="The order in which the laser operations are run")
+    pars.add_argument("--tolerance", type=float, default=0.05, help="Maximum deviation from curves in mm")
+    pars.add_argument("--profiles", default="", help="A JSON file with speed profiles per laser operation")
+    pars.add_argument("--json", default="", help="Write the report as JSON to this file")
+    pars.add_argument("--format", default="json", help="Print the report as json to stdout, or as text to stderr")
+    pars.add_argument("--headless", default="true", help="Run without inkex")
+    pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
+
+def estimate(root, options):
+    order = tuple(action.strip() for action in options.order.split(","))
+    return estimateDocument(root, options.material_thickness, loadProfiles(options), order, options.tolerance)
+
+# Without inkex the report is written as JSON, to stdout or to the file given with --json.
+# Inkscape asks for the text format, which goes to stderr and is shown in a message window, the document stays untouched.
+def runHeadless(args):
+    import argparse
+    from lxml import etree
+    pars = argparse.ArgumentParser(add_help=False)
+    addArguments(pars)
+    pars.add_argument("--output")
+    pars.add_argument("input_file", nargs="?")
+    options, _ = pars.parse_known_args(args)
+    if options.headless != "true":
+        return False
+
+    parser = etree.XMLParser(huge_tree=True, strip_cdata=False, recover=True)
+    document = etree.parse(options.input_file or sys.stdin.buffer, parser=parser)
+    result = estimate(document.getroot(), options)
+    writeReport(result, options)
+    if options.format == "text":
+        sys.stderr.write(formatReport(result) + "\n")
+    elif not options.json:
+        json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+    return True
+
+if __name__ == '__main__' and runHeadless(sys.argv[1:]):
+    sys.exit(0)
+
+import copy
+import inkex
+
+class LaserSVGEstimate(LaserSVGMixin, inkex.EffectExtension):
+
+    def add_arguments(self, pars):
+        addArguments(pars)
+
+    def effect(self):
+        # Templates are evaluated on a copy, the estimate doesn't change the drawing
+        result = estimate(copy.deepcopy(self.document).getroot(), self.options)
+        writeReport(result, self.options)
+        inkex.utils.debug(formatReport(result))
+        return False
+
+if __name__ == '__main__':
+    LaserSVGEstimate().run()
@@ -19,88 +19,31 @@
 #
 
 
-import math
-
 import inkex
 from lxml import etree
 
-import gi
-gi.require_version('Gtk', '3.0') 
-from gi.repository import Gtk
-
-class EditorWindow(Gtk.Window):
-    def __init__(self, extension):
-        Gtk.Window.__init__(self, title=type(extension))
-        self.set_border_width(10)
-
-        hbox = Gtk.Box(spacing=6)
-        self.add(hbox)
-
-        inkex.utils.debug(extension.getImageFile())
-        image = Gtk.Image()
-        image.set_from_file(extension.options.input_file)
-        hbox.pack_start(image, True, True, 0)
-
-        button = Gtk.Button.new_with_label("Click Me")
-        button.connect("clicked", self.on_click_me_clicked)
-        hbox.pack_start(button, True, True, 0)
-
-        button = Gtk.Button.new_with_mnemonic("_Open")
-        button.connect("clicked", self.on_open_clicked)
-        hbox.pack_start(button, True, True, 0)
-
-        button = Gtk.Button.new_with_mnemonic("_Close")
-        button.connect("clicked", self.on_close_clicked)
-        hbox.pack_start(button, True, True, 0)
-
-    def on_click_me_clicked(self, button):
-        print('"Click me" button was clicked')
+from laserSVG_core import LaserSVGMixin
+from laserSVG_editor import AuthenticationError, sendDocument
 
-    def on_open_clicked(self, button):
-        print('"Open" button was clicked')
-
-    def on_close_clicked(self, button):
-        print("Closing application")
-        Gtk.main_quit()
-
-
-class LaserSVG_Editor(inkex.EffectExtension):
-
-    selected_nodes = {}
-    LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
-    LASER_PREFIX = "laser"
-    LASER = "{%s}" % LASER_NAMESPACE
+# The editor window runs in its own process (see laserSVG_editor.py), such that Inkscape stays usable while it is open.
+# The extension only hands the document over and returns right away.
+class LaserSVG_Editor(LaserSVGMixin, inkex.EffectExtension):
 
     def add_arguments(self, pars):
         pars.add_argument("--material_thickness", default=3, help="The material thickness")
         pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
 
     def effect(self):
-
-        inkex.utils.debug(self.options.input_file)
-
-        win = EditorWindow(self)
-        win.connect("destroy", Gtk.main_quit)
-        win.show_all()
-        Gtk.main()
-        # Doesn't seem to exist anymore
-        # stdout = inkex.command.call('echo','test')
-        # inkex.utils.debug(stdout)
-
-        # Create a new Gtk window with the content of the file we're handling. 
-        # TODO: Gtk.main creates a new runloop, blocking interaction with inkscape until our new window is closed. 
-        # win = Gtk.Window()
-        # image = Gtk.Image()
-        # image.set_from_file(self.options.input_file)
-        # win.add(image)
+        root = self.document.getroot()
+        parameters = {"thickness": root.get("{}material-thickness".format(self.LASER), self.options.material_thickness),
+                      "kerf": root.get("{}kerf".format(self.LASER), 0)}
+        try:
+            sendDocument(etree.tostring(self.document), self.getImageFile(), parameters)
+        except (OSError, EOFError, AuthenticationError) as error:
+            raise inkex.AbortExtension("Could not start the LaserSVG editor: {}".format(error))
 
     def getImageFile(self):
         return self.options.input_file
 
 if __name__ == '__main__':
-    lEditor =  LaserSVG_Editor()
-    # win = EditorWindow(lEditor)
-    # win.connect("destroy", Gtk.main_quit)
-    # win.show_all()
-    # Gtk.main()
-    lEditor.run()
+    LaserSVG_Editor().run()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Saves the drawing as G-code for a laser cutter. The templates are evaluated at the chosen material thickness,
+# the output is grouped by laser:action (e.g., all engraving before cutting). Curves are flattened with a tolerance,
+# and runs of points that lie on a circle are written as G2/G3 arcs.
+# The G-code is written to the file while the paths are processed, no intermediate document is built.
+
+from math import sqrt, atan2, acos, pi
+
+import inkex
+
+from laserSVG_core import LaserSVGMixin, LASER, PathData, formatNumber, evaluateTemplates, collectActions, documentMatrix, \
+    multiplyTransform, shapePath, flattenCubic, arcCenter, arcCurves
+
+class LaserSVGGcode(LaserSVGMixin, inkex.OutputExtension):
+
+    def add_arguments(self, pars):
+        pars.add_argument("--material_thickness", type=float, default=0, help="The material thickness, 0 uses the thickness of the document")
+        pars.add_argument("--order", default="engrave,cut", help="The order in which the laser operations are run")
+        pars.add_argument("--cut_speed", type=float, default=600, help="Feed rate for cutting in mm/min")
+        pars.add_argument("--cut_power", type=float, default=100, help="Laser power for cutting in percent")
+        pars.add_argument("--cut_passes", type=int, default=1, help="Number of passes for cutting")
+        pars.add_argument("--engrave_speed", type=float, default=3000, help="Feed rate for engraving in mm/min")
+        pars.add_argument("--engrave_power", type=float, default=30, help="Laser power for engraving in percent")
+        pars.add_argument("--engrave_passes", type=int, default=1, help="Number of passes for engraving")
+        pars.add_argument("--max_power", type=float, default=1000, help="The spindle value (S) for full laser power")
+        pars.add_argument("--tolerance", type=float, default=0.01, help="Maximum deviation from curves in mm")
+        pars.add_argument("--arcs", default="true", help="Write arcs as G2/G3 instead of line segments")
+        pars.add_argument("--laser_off_moves", default="false", help="Switch the laser off for every travel move instead of relying on laser mode")
+        pars.add_argument("--origin", default="bottom-left", help="The corner of the page that is the machine origin")
+        pars.add_argument("--precision", type=int, default=3, help="Number of decimals")
+        pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
+
+    def save(self, stream):
+        root = self.document.getroot()
+        evaluateTemplates(root, self.options.material_thickness)
+
+        groups = collectActions(root, root.get(LASER + "action", "cut"))
+        writer = GcodeWriter(stream, self.options.precision, self.options.tolerance, self.options.arcs == "true", self.options.laser_off_moves == "true")
+        matrix = documentMatrix(root, self.options.origin == "bottom-left")
+
+        writer.header()
+        order = [action.strip() for action in self.options.order.split(",") if action.strip()]
+        # Operations that are not in the order list come last, e.g., a custom laser:action
+        order += [action for action in groups if action not in order]
+        for action in order:
+            if action not in groups:
+                continue
+            speed = getattr(self.options, "{}_speed".format(action), self.options.cut_speed)
+            power = getattr(self.options, "{}_power".format(action), self.options.cut_power)
+            passes = getattr(self.options, "{}_passes".format(action), self.options.cut_passes)
+            for run in range(passes):
+                writer.startGroup("{} pass {}/{}".format(action, run + 1, passes), speed, power / 100 * self.options.max_power)
+                for element, transform, _ in groups[action]:
+                    try:
+                        path = PathData.parse(shapePath(element))
+                    except ValueError:
+                        inkex.utils.debug("Warning: the path data of {} is invalid, it was not exported.".format(element.get("id")))
+                        continue
+                    writer.path(path, multiplyTransform(matrix, transform))
+                writer.endGroup()
+        writer.footer()
+
+
+class GcodeWriter(object):
+    # Lines are collected and written in blocks of this size
+    BUFFER_LINES = 4096
+
+    def __init__(self, stream, precision=3, tolerance=0.01, arcs=True, laserOffMoves=False):
+        self.stream = stream
+        self.precision = precision
+        self.numberFormat = "%.{}f".format(precision)
+        self.tolerance = tolerance
+        self.arcs = arcs
+        self.laserOffMoves = laserOffMoves
+        self.buffer = []
+        self.x, self.y = None, None
+        self.power = 0
+        self.feed = None
+        self.pendingFeed = False
+        self.laserOn = False
+
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.BUFFER_LINES:
+            self.flush()
+
+    def flush(self):
+        self.stream.write(("\n".join(self.buffer) + "\n").encode("ascii"))
+        self.buffer = []
+
+    def header(self):
+        self.write("; Generated by the LaserSVG G-code exporter")
+        self.write("G21")
+        self.write("G90")
+        self.write("M5")
+
+    def footer(self):
+        if self.laserOn:
+            self.write("M5")
+        self.write("G0 X0 Y0")
+        self.write("M2")
+        self.flush()
+
+    # In laser mode (GRBL $32=1) the laser is off during G0 moves, so it only has to be switched on once per group
+    def startGroup(self, name, feed, power):
+        self.write("; " + name)
+        self.feed = formatNumber(feed, 0)
+        self.power = formatNumber(power, 0)
+        self.pendingFeed = True
+        if not self.laserOffMoves:
+            self.write("M4 S" + self.power)
+            self.laserOn = True
+
+    def endGroup(self):
+        self.write("M5")
+        self.laserOn = False
+
+    # Called for every coordinate, so this is a leaner version of formatNumber
+    def number(self, value):
+        text = self.numberFormat % value
+        if "." in text:
+            text = text.rstrip("0").rstrip(".")
+        return "0" if text == "-0" else text
+
+    def moveTo(self, x, y):
+        if self.laserOffMoves and self.laserOn:
+            self.write("M5")
+            self.laserOn = False
+        self.x, self.y = self.number(x), self.number(y)
+        self.write("G0 X{} Y{}".format(self.x, self.y))
+
+    def lineTo(self, x, y):
+        x, y = self.number(x), self.number(y)
+        if x == self.x and y == self.y:
+            return
+        self.cut("G1", x, y, "")
+
+    # (cx, cy) is the absolute center
+    def arcTo(self, x, y, cx, cy, counterclockwise):
+        startX, startY = float(self.x), float(self.y)
+        x, y = self.number(x), self.number(y)
+        center = " I{} J{}".format(self.number(cx - startX), self.number(cy - startY))
+        if x == self.x and y == self.y and center == " I0 J0":
+            return
+        self.cut("G3" if counterclockwise else "G2", x, y, center)
+
+    def cut(self, command, x, y, center):
+        if not self.laserOn:
+            self.write("M4 S" + self.power)
+            self.laserOn = True
+        # Coordinates and the feed rate are modal, only the ones that changed are written
+        line = command
+        if x != self.x or center:
+            line += " X" + x
+        if y != self.y or center:
+            line += " Y" + y
+        line += center
+        if self.pendingFeed:
+            line += " F" + self.feed
+            self.pendingFeed = False
+        self.write(line)
+        self.x, self.y = x, y
+
+    # Writes a path, _matrix_ maps its coordinates to the machine
+    def path(self, path, matrix):
+        a, b, c, d, e, f = matrix
+        # Circular arcs stay circular under transforms that only rotate, mirror, and scale uniformly
+        similar = abs(a - d) < 1e-9 and abs(b + c) < 1e-9 or abs(a + d) < 1e-9 and abs(b - c) < 1e-9
+        orientation = 1 if a * d - b * c > 0 else -1
+        scale = sqrt(abs(a * d - b * c))
+        x, y, startX, startY = 0.0, 0.0, 0.0, 0.0
+        # The last control points, for the reflection in smooth curves
+        cubicX, cubicY, quadX, quadY = None, None, None, None
+        for letter, args in path.absolute():
+            lastCubic, lastQuad = (cubicX, cubicY), (quadX, quadY)
+            cubicX = cubicY = quadX = quadY = None
+            if letter == "M":
+                x, y = startX, startY = args
+                self.moveTo(a * x + c * y + e, b * x + d * y + f)
+            elif letter in "LHVZ":
+                if letter == "L":
+                    x, y = args
+                elif letter == "H":
+                    x = args[0]
+                elif letter == "V":
+                    y = args[0]
+                else:
+                    x, y = startX, startY
+                self.lineTo(a * x + c * y + e, b * x + d * y + f)
+            elif letter in "CS":
+                if letter == "C":
+                    x1, y1, x2, y2, x3, y3 = args
+                else:
+                    x2, y2, x3, y3 = args
+                    x1, y1 = (2 * x - lastCubic[0], 2 * y - lastCubic[1]) if lastCubic[0] is not None else (x, y)
+                self.cubic(matrix, x, y, x1, y1, x2, y2, x3, y3)
+                cubicX, cubicY = x2, y2
+                x, y = x3, y3
+            elif letter in "QT":
+                if letter == "Q":
+                    qx, qy, x3, y3 = args
+                else:
+                    x3, y3 = args
+                    qx, qy = (2 * x - lastQuad[0], 2 * y - lastQuad[1]) if lastQuad[0] is not None else (x, y)
+                # Quadratic curves are cubic curves with both control points at 2/3 towards the quadratic one
+                self.cubic(matrix, x, y, x + 2 / 3 * (qx - x), y + 2 / 3 * (qy - y), x3 + 2 / 3 * (qx - x3), y3 + 2 / 3 * (qy - y3), x3, y3)
+                quadX, quadY = qx, qy
+                x, y = x3, y3
+            elif letter == "A":
+                rx, ry, rotation, large, sweep, x3, y3 = args
+                arc = arcCenter(x, y, rx, ry, rotation, large, sweep, x3, y3)
+                if arc is None:
+                    self.lineTo(a * x3 + c * y3 + e, b * x3 + d * y3 + f)
+                elif self.arcs and similar and abs(arc[2] - arc[3]) <= 1e-9 * max(arc[2], 1) and arc[2] * scale > self.tolerance:
+                    cx, cy = arc[0], arc[1]
+                    self.arcTo(a * x3 + c * y3 + e, b * x3 + d * y3 + f, a * cx + c * cy + e, b * cx + d * cy + f, (arc[6] > 0) == (orientation > 0))
+                else:
+                    for curve in arcCurves(*arc):
+                        self.cubic(matrix, x, y, *curve)
+                        x, y = curve[4], curve[5]
+                x, y = x3, y3
+
+    def cubic(self, matrix, x0, y0, x1, y1, x2, y2, x3, y3):
+        a, b, c, d, e, f = matrix
+        # Flattening happens in machine coordinates, such that the tolerance is in mm.
+        # Fitting arcs moves the path a bit further, so that gets half of the tolerance.
+        tolerance = self.tolerance / 2 if self.arcs else self.tolerance
+        points = flattenCubic(a * x0 + c * y0 + e, b * x0 + d * y0 + f, a * x1 + c * y1 + e, b * x1 + d * y1 + f,
+                              a * x2 + c * y2 + e, b * x2 + d * y2 + f, a * x3 + c * y3 + e, b * x3 + d * y3 + f, tolerance)
+        if self.arcs and len(points) > 3:
+            for segment in fitArcs(points, tolerance):
+                if len(segment) == 2:
+                    self.lineTo(*segment)
+                else:
+                    self.arcTo(*segment)
+        else:
+            for point in points[1:]:
+                self.lineTo(*point)
+
+
+# Replaces runs of points that lie on a circle with arcs. Returns (x, y) for lines and (x, y, cx, cy, counterclockwise) for arcs.
+# The arcs stay within _tolerance_ of the polyline.
+# The longest run is searched by doubling its length and then bisecting, instead of trying every length.
+def fitArcs(points, tolerance, maxPoints=64):
+    segments = []
+    start, count = 0, len(points)
+    fits = lambda end: circleThrough(points[start], points[(start + end) // 2], points[end])
+    while start < count - 1:
+        best = None
+        low, high = 3, 3
+        while start + high < count and high <= maxPoints:
+            circle = fits(start + high)
+            if circle is None or not onArc(points, start, start + high, circle, tolerance / 2):
+                break
+            best = start + high, circle
+            low, high = high, high * 2
+        high = min(high, count - 1 - start, maxPoints)
+        while best is not None and low < high:
+            middle = (low + high + 1) // 2
+            circle = fits(start + middle)
+            if circle is not None and onArc(points, start, start + middle, circle, tolerance / 2):
+                best = start + middle, circle
+                low = middle
+            else:
+                high = middle - 1
+        if best is None:
+            segments.append(points[start + 1])
+            start += 1
+        else:
+            end, (cx, cy, _, counterclockwise) = best
+            segments.append(points[end] + (cx, cy, counterclockwise))
+            start = end
+    return segments
+
+def circleThrough(p1, p2, p3):
+    ax, ay = p2[0] - p1[0], p2[1] - p1[1]
+    bx, by = p3[0] - p1[0], p3[1] - p1[1]
+    denominator = 2 * (ax * by - ay * bx)
+    if abs(denominator) < 1e-12:
+        return None
+    a2, b2 = ax * ax + ay * ay, bx * bx + by * by
+    ux = (by * a2 - ay * b2) / denominator
+    uy = (ax * b2 - bx * a2) / denominator
+    return p1[0] + ux, p1[1] + uy, sqrt(ux * ux + uy * uy), denominator > 0
+
+# All points between start and end have to be on the circle and turn in the same direction, with less than a full turn.
+# Between two points the arc must not bulge out further from the line than _tolerance_ either.
+def onArc(points, start, end, circle, tolerance):
+    cx, cy, radius, counterclockwise = circle
+    # Huge circles are better written as lines, the center is far outside of the machine
+    if radius > 1e4:
+        return False
+    # The largest angle between two points with a sagitta below the tolerance
+    maxStep = 2 * acos(max(-1.0, 1 - tolerance / radius))
+    swept = 0.0
+    previousAngle = atan2(points[start][1] - cy, points[start][0] - cx)
+    for index in range(start + 1, end + 1):
+        x, y = points[index]
+        if abs(sqrt((x - cx) ** 2 + (y - cy) ** 2) - radius) > tolerance:
+            return False
+        angle = atan2(y - cy, x - cx)
+        step = (angle - previousAngle) % (2 * pi)
+        if not counterclockwise:
+            step = 2 * pi - step if step else 0.0
+        if step > maxStep:
+            return False
+        swept += step
+        previousAngle = angle
+    return swept < 1.9 * pi
+
+if __name__ == '__main__':
+    LaserSVGGcode().run()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Fills the closed shapes with laser:action="engrave" with parallel lines, such that the laser engraves the area
+# instead of only the outline. The lines of each shape become one path in the hatch layer, which is replaced on every run.
+# From the command line it runs without inkex, e.g.:
+#
+#   python laserSVG_hatch.py --spacing=0.1 --angle=45 logo.svg > logo_hatched.svg
+
+import sys
+from math import cos, sin, radians
+
+from laserSVG_core import LaserSVGMixin, LASER, SVG, INKSCAPE, PathData, registerNamespace, collectActions, documentMatrix, shapePath, \
+    flattenPath, evenOddFill, scanlineSpans
+
+HATCH_LAYER = "hatchLayer"
+
+# The hatch lines of the closed subpaths of a shape as path data, in the coordinates of the polygons.
+# The angle is in radians, bidirectional lines alternate their direction, such that the laser doesn't travel back every time.
+def hatchPolygons(polygons, spacing, angle=0.0, evenOdd=False, bidirectional=True, precision=3):
+    cosA, sinA = cos(angle), sin(angle)
+    # Turned by -angle, the hatch lines are horizontal
+    rotated = [[(x * cosA + y * sinA, y * cosA - x * sinA) for x, y in points] for points in polygons]
+    path = PathData()
+    current = None
+    forward = True
+    for k, spans in scanlineSpans(rotated, spacing, evenOdd):
+        y = k * spacing
+        if not forward:
+            spans = [(x2, x1) for x1, x2 in reversed(spans)]
+        if bidirectional:
+            forward = not forward
+        for x1, x2 in spans:
+            # Rounded first, such that the relative steps don't accumulate rounding errors
+            start = (round(x1 * cosA - y * sinA, precision), round(x1 * sinA + y * cosA, precision))
+            end = (round(x2 * cosA - y * sinA, precision), round(x2 * sinA + y * cosA, precision))
+            if current is None:
+                path.append("M", start)
+            else:
+                path.append("m", (start[0] - current[0], start[1] - current[1]))
+            path.append("l", (end[0] - start[0], end[1] - start[1]))
+            current = end
+    return path.toString(precision, compact=True) if current is not None else ""
+
+# Adds the hatch layer for all engraved shapes of the document. Spacing and tolerance are in mm, the angle in degrees,
+# counterclockwise from the x axis. Returns the number of hatched shapes.
+def hatchDocument(root, spacing=0.1, angle=0.0, bidirectional=True, tolerance=0.05, precision=3):
+    for layer in root.findall(SVG + "g[@id='{}']".format(HATCH_LAYER)):
+        root.remove(layer)
+    groups = collectActions(root, root.get(LASER + "action", "cut"))
+    # Hatching happens in user units
+    scale = documentMatrix(root, bottomLeft=False)[0]
+    spacing, tolerance = spacing / scale, tolerance / scale
+    strokeWidth = min(spacing, 0.1 / scale)
+
+    paths = []
+    for element, transform, _ in groups.get("engrave", []):
+        try:
+            path = PathData.parse(shapePath(element))
+        except ValueError:
+            continue
+        # Only closed subpaths enclose an area
+        polygons = [points for points, closed in flattenPath(path, transform, tolerance) if closed or points[0] == points[-1]]
+        d = hatchPolygons(polygons, spacing, -radians(angle), evenOddFill(element), bidirectional, precision)
+        if d:
+            paths.append(d)
+
+    if paths:
+        layer = root.makeelement(SVG + "g", {"id": HATCH_LAYER, INKSCAPE + "groupmode": "layer", INKSCAPE + "label": "Hatch",
+                                             LASER + "action": "engrave"}, nsmap={"inkscape": INKSCAPE[1:-1]})
+        for d in paths:
+            layer.append(layer.makeelement(SVG + "path", {"d": d, "style": "fill:none;stroke:#000000;stroke-width:{:.6g}".format(strokeWidth)}))
+        root.append(layer)
+    return len(paths)
+
+
+def addArguments(pars):
+    pars.add_argument("--spacing", type=float, default=0.1, help="Distance between the hatch lines in mm")
+    pars.add_argument("--angle", type=float, default=0, help="Angle of the hatch lines in degrees")
+    pars.add_argument("--bidirectional", default="true", help="Alternate the direction of the lines")
+    pars.add_argument("--tolerance", type=float, default=0.05, help="Maximum deviation from curves in mm")
+    pars.add_argument("--precision", type=int, default=3, help="Number of decimals of the hatch lines")
+    pars.add_argument("--headless", default="true", help="Run without inkex")
+    pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
+
+def hatch(root, options):
+    if options.spacing <= 0:
+        raise ValueError("The spacing of the hatch lines has to be positive")
+    return hatchDocument(root, options.spacing, options.angle, options.bidirectional == "true", options.tolerance, options.precision)
+
+def runHeadless(args):
+    import argparse
+    from lxml import etree
+    pars = argparse.ArgumentParser(add_help=False)
+    addArguments(pars)
+    pars.add_argument("--output")
+    pars.add_argument("input_file", nargs="?")
+    options, _ = pars.parse_known_args(args)
+    if options.headless != "true":
+        return False
+
+    # The same parser settings as inkex, such that the output is the same
+    parser = etree.XMLParser(huge_tree=True, strip_cdata=False, recover=True)
+    document = etree.parse(options.input_file or sys.stdin.buffer, parser=parser)
+    registerNamespace()
+    try:
+        hatch(document.getroot(), options)
+    except ValueError as error:
+        sys.stderr.write("{}\n".format(error))
+        sys.exit(1)
+    if options.output:
+        with open(options.output, "wb") as stream:
+            stream.write(etree.tostring(document))
+    else:
+        sys.stdout.buffer.write(etree.tostring(document))
+    return True
+
+if __name__ == '__main__' and runHeadless(sys.argv[1:]):
+    sys.exit(0)
+
+import inkex
+
+class LaserSVGHatch(LaserSVGMixin, inkex.EffectExtension):
+
+    def add_arguments(self, pars):
+        addArguments(pars)
+
+    def effect(self):
+        self.registerNamespace()
+        try:
+            hatch(self.document.getroot(), self.options)
+        except ValueError as error:
+            raise inkex.AbortExtension(str(error))
+
+if __name__ == '__main__':
+    LaserSVGHatch().run()
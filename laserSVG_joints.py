@@ -1,4 +1,4 @@
- #!/usr/bin/env python
+#!/usr/bin/env python
 # coding=utf-8
 #
 # Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
@@ -18,81 +18,234 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 #
 
-# see https://launchpadlibrarian.net/235367843/debug_sel_nodes.py for more details
-import math
+# Replaces the edges of rectangles with parametric joints (finger, flap, t-slot), and fills rectangles with living hinges
+
+from functools import lru_cache
 
 import inkex
-import inkex.elements 
-from lxml import etree
 
-class LaserSVGPrimitives(inkex.EffectExtension):
+from laserSVG_core import LaserSVGMixin, ParameterModel, formatNumber, materialThickness, thicknessTerm
+
+class LaserSVGJoints(LaserSVGMixin, inkex.EffectExtension):
 
-    selected_nodes = {}
-    LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
-    LASER_PREFIX = "laser"
-    LASER = "{%s}" % LASER_NAMESPACE
+    # The sides of a rectangle in clockwise order, starting at the top left corner.
+    # Each side has the direction in which it is traversed and the normal pointing out of the rectangle
+    SIDES = (("top", (1, 0), (0, -1)),
+             ("right", (0, 1), (1, 0)),
+             ("bottom", (-1, 0), (0, 1)),
+             ("left", (0, -1), (-1, 0)))
 
-    """Replace the selection's nodes with numbered dots according to the options"""
     def add_arguments(self, pars):
-        pars.add_argument("--rect_adjustment", default="none", help="The dimension in which a rect should be adjusted when material thickness changes.")
-        pars.add_argument("--rect_kerf_adjust", default="none", help="The dimension in which a rect should be adjusted when material thickness changes.")
-        pars.add_argument("--rect_origin", default="", help="The dimension in which a rect should be adjusted when material thickness changes.")
-        pars.add_argument("--action", default="none", help="The default laser operation")
-        pars.add_argument("--material_thickness", default=3, help="The material thickness")
+        for side, _, _ in self.SIDES:
+            pars.add_argument("--joint_{}".format(side), default="", help="The joint type of the {} edge".format(side))
+            pars.add_argument("--joint_{}_direction".format(side), default="inside", help="Whether the {} joint points into or out of the part".format(side))
+        pars.add_argument("--path_joint", default="", help="The joint type for path segments")
+        pars.add_argument("--hinge_orientation", default="vertical", help="The direction of the slits of a living hinge")
+        pars.add_argument("--hinge_slit", type=float, default=8, help="The length of the slits in multiples of the thickness")
+        pars.add_argument("--hinge_bridge", type=float, default=1.5, help="The material between two slits in multiples of the thickness")
+        pars.add_argument("--hinge_spacing", type=float, default=1, help="The distance between two rows of slits in multiples of the thickness")
         pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
 
     def effect(self):
-        
         # Register the namespace prefix both with etree and inkscape
-        etree.register_namespace("laser", self.LASER_NAMESPACE)
-        inkex.elements._utils.NSS["laser"] = self.LASER_NAMESPACE
+        self.registerNamespace()
+
+        if not self.svg.selected:
+            raise inkex.AbortExtension("Please select an object.")
+
+        if self.options.tab == "paths":
+            raise inkex.AbortExtension("Joints can currently only be generated for rectangles.")
+
+        if not "{}material-thickness".format(self.LASER) in self.document.getroot().keys():
+            raise inkex.AbortExtension("Please set the material thickness in the LaserSVG parameter control panel first.")            
 
+        generated = set()
         for elementID in self.options.ids:
             element = self.svg.getElementById(elementID)
-            if element.tag == "{http://www.w3.org/2000/svg}rect":
-                self.rectangleSettings(element, self.options)
-                if self.options.rect_kerf_adjust != "none":
-                    element.set(inkex.elements._utils.addNS("kerf-adjust", self.LASER_PREFIX),self.options.rect_kerf_adjust)
-                else: 
-                    element.attrib.pop(inkex.elements._utils.addNS("kerf-adjust", self.LASER_PREFIX), None) # Remove it if nothing to do
-
-                if self.options.rect_origin == "":
-                    element.attrib.pop(inkex.elements._utils.addNS("origin", self.LASER_PREFIX), None) # Remove it if nothing to do
+            # Groups and layers can have a material of their own
+            thickness = materialThickness(element)
+            if self.options.tab == "hinges":
+                # Hinges that were already generated remember their rectangle, so we can regenerate them
+                if element.tag == "{http://www.w3.org/2000/svg}rect" or element.get(self.LASER + "hinge-rect") is not None:
+                    try:
+                        generated.add(self.generateHinge(element, thickness))
+                    except ValueError as error:
+                        raise inkex.AbortExtension(str(error))
+                continue
+            # Rectangles that were already turned into joints remember their original geometry, so we can regenerate them
+            if element.tag == "{http://www.w3.org/2000/svg}rect" or element.get(self.LASER + "joint-rect") is not None:
+                self.tagJoints(element)
+                generated.add(self.generateJoints(element, thickness))
+
+        # The new templates are evaluated like the parameter control does, with the kerf and the custom parameters
+        model = ParameterModel(self.document.getroot())
+        model.evaluate([index for index, target in enumerate(model.targets) if target[0] in generated])
+
+    # Store the joint settings of every edge on the element
+    def tagJoints(self, element):
+        for side, _, _ in self.SIDES:
+            joint = getattr(self.options, "joint_{}".format(side))
+            if joint == "":
+                element.attrib.pop(self.LASER + "joint-{}".format(side), None)
+                element.attrib.pop(self.LASER + "joint-{}-direction".format(side), None)
+            else:
+                element.set(self.LASER + "joint-{}".format(side), joint)
+                element.set(self.LASER + "joint-{}-direction".format(side), getattr(self.options, "joint_{}_direction".format(side)))
+
+    # Turns a rectangle with tagged edges into a path with a thickness template, returns the path
+    def generateJoints(self, element, thickness):
+        if element.tag == "{http://www.w3.org/2000/svg}rect":
+            x, y = float(element.get("x", 0)), float(element.get("y", 0))
+            width, height = float(element.get("width")), float(element.get("height"))
+        else:
+            x, y, width, height = map(float, element.get(self.LASER + "joint-rect").split())
+
+        template = jointTemplate(x, y, width, height, thickness, tuple(
+            (element.get(self.LASER + "joint-{}".format(side), ""),
+             element.get(self.LASER + "joint-{}-direction".format(side), "inside")) for side, _, _ in self.SIDES))
+
+        if element.tag == "{http://www.w3.org/2000/svg}rect":
+            path = inkex.PathElement()
+            for key, value in element.attrib.items():
+                if key not in ("x", "y", "width", "height", "rx", "ry"):
+                    path.set(key, value)
+            element.getparent().replace(element, path)
+            element = path
+
+        element.set(self.LASER + "joint-rect", "{} {} {} {}".format(x, y, width, height))
+        element.set(self.LASER + "template", template)
+        return element
+
+    # Adds a path with the slits of a living hinge inside a rectangle, or regenerates an existing hinge, returns the path
+    def generateHinge(self, element, thickness):
+        options = self.options
+        if element.tag == "{http://www.w3.org/2000/svg}rect":
+            x, y = float(element.get("x", 0)), float(element.get("y", 0))
+            width, height = float(element.get("width")), float(element.get("height"))
+        else:
+            x, y, width, height = map(float, element.get(self.LASER + "hinge-rect").split())
+        template = hingeTemplate(x, y, width, height, thickness, options.hinge_orientation, options.hinge_slit, options.hinge_bridge, options.hinge_spacing)
+
+        if element.tag == "{http://www.w3.org/2000/svg}rect":
+            path = inkex.PathElement()
+            # The slits are in the coordinates of the rectangle and look like its outline
+            for key in ("transform", "style"):
+                if element.get(key) is not None:
+                    path.set(key, element.get(key))
+            element.addnext(path)
+            path.set_random_id("hinge")
+        else:
+            path = element
+        path.set(self.LASER + "hinge-rect", "{} {} {} {}".format(x, y, width, height))
+        path.set(self.LASER + "template", template)
+        return path
+
+
+# Builds the template of a rectangle outline, joints is a (type, direction) pair for each side in SIDES
+def jointTemplate(x, y, width, height, thickness, joints):
+    template = ["M {} {}".format(x, y)]
+    for (side, (ux, uy), (nx, ny)), (jointType, direction) in zip(LaserSVGJoints.SIDES, joints):
+        length = width if ux != 0 else height
+        # The pattern is in edge coordinates: the distance along the edge as (offset, multiple of thickness), and the
+        # offset along the outward normal in multiples of thickness
+        for (offset, factor), across in jointPattern(jointType, length, thickness, direction):
+            sign = ux + uy
+            along = lengthTerm(offset * sign, factor * sign)
+            if along != "0" and across != 0:
+                # Chamfers change in both directions, as the edges are axis-aligned one coordinate is fixed and one depends on the thickness
+                if ux != 0:
+                    template.append("l {} {}".format(along, thicknessTerm(across * ny, roundThickness=False)))
                 else:
-                    element.set(inkex.elements._utils.addNS("origin", self.LASER_PREFIX),self.options.rect_origin)
+                    template.append("l {} {}".format(thicknessTerm(across * nx, roundThickness=False), along))
+            elif along != "0":
+                template.append("{} {}".format("h" if ux != 0 else "v", along))
+            elif across != 0:
+                template.append("{} {}".format("v" if ux != 0 else "h", thicknessTerm(across * (nx + ny), roundThickness=False)))
+    template.append("z")
+    return " ".join(template)
 
-            if self.options.action == "file": 
-                element.attrib.pop(inkex.elements._utils.addNS("action", self.LASER_PREFIX), None) # Remove it if nothing to do
+# Boxes consist of many identical edges, so each pattern is only computed once
+@lru_cache(maxsize=None)
+def jointPattern(jointType, length, thickness, direction):
+    sign = 1 if direction == "outside" else -1
+    if jointType in ("finger", "finger_compact"):
+        # An odd number of equally wide fingers, such that the edge starts and ends with a full segment
+        fingerWidth = 2 * thickness if jointType == "finger" else thickness
+        count = max(3, int(length / fingerWidth))
+        if count % 2 == 0:
+            count -= 1
+        width = (length / count, 0)
+        steps = []
+        for index in range(count):
+            if index % 2 == 1:
+                steps.extend([((0, 0), sign), (width, 0), ((0, 0), -sign)])
             else:
-                element.set(inkex.elements._utils.addNS("action", self.LASER_PREFIX),self.options.action)
-
-
-        
-        # # If nothing is selected, we can't do anything
-        # if not self.svg.selected:
-        #     raise inkex.AbortExtension("Please select an object.")
-
-        # self.selected_nodes = self.parse_selected_nodes(self.options.selected_nodes)
-        
-        # # inkex.utils.debug(self.selected_nodes)
-
-        # # report about selected nodes
-        # for pathID, selected in self.selected_nodes.items():
-        #     path = self.svg.getElementById(pathID)
-        #     # p2 = path.original_path.to_superpath()
-        #     # inkex.utils.debug('{0}'.format(p2))
-        #     for element in selected: 
-        #         inkex.utils.debug( '{0} - selected nodes of subpath {1}: {2}'.format(pathID, element, selected[element]))
-        #         # show the coordinates
-        #         for nodes in selected[element]:
-        #             coordinates = path.original_path.to_superpath()[element][nodes][1]
-        #             inkex.utils.debug('{0} - selected node {1}: {2}'.format(pathID, nodes, coordinates))
-        #         # Check if path segment length matches specified thickness
-        #         # check if a path template is already defined, if not, create one
-        #         # place the {thickness} label at the repective place in the path template
-
-    def rectangleSettings(self, element, options):
-        element.set(inkex.elements._utils.addNS("thickness-adjust", self.LASER_PREFIX),options.rect_adjustment)
+                steps.append((width, 0))
+        return tuple(steps)
+    elif jointType == "flap":
+        # A trapezoid in the center of the edge with chamfered sides
+        return (((length / 5, 0), 0), ((length / 10, 0), sign), ((2 * length / 5, 0), 0), ((length / 10, 0), -sign), ((length / 5, 0), 0))
+    elif jointType == "t-slot":
+        # A slot for a screw of material thickness width, with a crossbar for the nut. The widths follow the thickness,
+        # the slot stays in the center of the edge.
+        side = (length / 2, -0.5)
+        return ((side, 0), ((0, 0), 1.5 * sign), ((0, -0.5), 0), ((0, 0), sign), ((0, 2), 0), ((0, 0), -sign), ((0, -0.5), 0), ((0, 0), -1.5 * sign), (side, 0))
+    else:
+        return (((length, 0), 0),)
+
+# Builds the template of a living hinge in a rectangle: rows of slits along the orientation, every other row offset by
+# half a cell, such that the material between the slits can twist. Slits and bridges are in multiples of the thickness.
+# The number of cells can't change in a template, so their size is fixed such that they fit the rectangle at the current
+# thickness. Only the bridges follow the thickness, and the slits take the rest of each cell.
+# The shorter slits at the ends of the offset rows are used up first when the bridges grow, at (slit + bridge) / (3 * bridge)
+# times the thickness of the generation. They shrink to nothing then instead of turning around, and start at a fixed
+# position, such that the other slits stay where they are.
+# All cells share the same few expressions, which the parameter control evaluates only once per update.
+def hingeTemplate(x, y, width, height, thickness, orientation, slit, bridge, spacing):
+    if orientation == "horizontal":
+        x, y, width, height = y, x, height, width
+        move = lambda along, across: "m {} {}".format(along, across)
+        line, start = "h", lambda across, along: "M {} {}".format(along, across)
+    else:
+        move = lambda along, across: "m {} {}".format(across, along)
+        line, start = "v", lambda across, along: "M {} {}".format(across, along)
+    number = lambda value: formatNumber(value, 4)
+    # Along the slits each row has _count_ cells, across them the rows are _pitch_ apart
+    count = max(1, int(round(height / ((slit + bridge) * thickness))))
+    cell = height / count
+    rows = max(1, int(width / (spacing * thickness)))
+    pitch = width / rows
+    if cell <= bridge * thickness or (rows > 1 and cell <= 3 * bridge * thickness):
+        raise ValueError("The slits are too short for bridges of {} times the thickness, please use longer slits".format(formatNumber(bridge)))
+    gap = "{{{}*thickness}}".format(number(bridge))
+    halfGap = "{{{}*thickness}}".format(number(bridge / 2))
+    full = "{{{}-{}*thickness}}".format(number(cell), number(bridge))
+    shortened = "{}-{}*thickness".format(number(cell / 2), number(1.5 * bridge))
+    half = "{{({0})*({0}>0)}}".format(shortened)
+    template = []
+    for row in range(rows):
+        across = number(x + (row + 0.5) * pitch)
+        if row % 2 == 0:
+            # Full slits with half a bridge at each end
+            template.append(start(across, number(y)))
+            template.append("{} {} {}".format(move(halfGap, 0), line, full))
+            template.extend("{} {} {}".format(move(gap, 0), line, full) for _ in range(count - 1))
+        else:
+            # Offset by half a cell, the slits at the ends are shorter and leave a bridge to the edge
+            template.append("{} {} {}".format(start(across, "{{{}+{}*thickness}}".format(number(y), number(bridge))), line, half))
+            template.append(start(across, "{{{}+{}*thickness}}".format(number(y + cell / 2), number(bridge / 2))))
+            slits = [full] * (count - 1) + [half]
+            template.append("{} {}".format(line, slits[0]))
+            template.extend("{} {} {}".format(move(gap, 0), line, length) for length in slits[1:])
+    return " ".join(template)
+
+# The term for a length of _offset_ plus _factor_ times the thickness
+def lengthTerm(offset, factor):
+    if factor == 0:
+        return formatNumber(offset)
+    if offset == 0:
+        return thicknessTerm(factor, roundThickness=False)
+    return "{{{}{}{}*thickness}}".format(formatNumber(offset), "-" if factor < 0 else "+", formatNumber(abs(factor)))
 
 if __name__ == '__main__':
-    LaserSVGPrimitives().run()
+    LaserSVGJoints().run()
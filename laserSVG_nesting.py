@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Packs all top-level parts of the document onto sheets of a given size (see laserSVG_packing.py).
+# From the command line it runs without inkex, e.g.:
+#
+#   python laserSVG_nesting.py --sheet_width=600 --sheet_height=400 --mode=polygon design.svg > design_nested.svg
+
+import sys
+
+from laserSVG_core import LaserSVGMixin, LASER, registerNamespace
+from laserSVG_packing import SETTINGS, nestingSettings, nestDocument, collectParts, hasShapes
+
+def addArguments(pars):
+    pars.add_argument("--sheet_width", type=float, default=600, help="The width of a sheet in mm")
+    pars.add_argument("--sheet_height", type=float, default=400, help="The height of a sheet in mm")
+    pars.add_argument("--spacing", type=float, default=2, help="The minimum distance between two parts in mm")
+    pars.add_argument("--margin", type=float, default=5, help="The distance between the parts and the sheet border in mm")
+    pars.add_argument("--mode", default="skyline", help="Pack bounding boxes (skyline) or the outlines of the parts (polygon)")
+    pars.add_argument("--rotate", default="true", help="Whether parts may be rotated")
+    pars.add_argument("--headless", default="true", help="Run without inkex, unless a part has to be measured by it")
+    pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
+
+# The settings are stored on the root node, such that the control panel can re-nest after a thickness change
+def nest(root, options, measure=None):
+    for attribute, option, _ in SETTINGS:
+        root.set(LASER + attribute, str(getattr(options, option)).lower())
+    nestDocument(root, measure=measure, **nestingSettings(root))
+
+def runHeadless(args):
+    import argparse
+    from lxml import etree
+    pars = argparse.ArgumentParser(add_help=False)
+    addArguments(pars)
+    pars.add_argument("--output")
+    pars.add_argument("input_file", nargs="?")
+    options, _ = pars.parse_known_args(args)
+    if options.headless != "true":
+        return False
+
+    # The same parser settings as inkex, such that the output is the same
+    parser = etree.XMLParser(huge_tree=True, strip_cdata=False, recover=True)
+    document = etree.parse(options.input_file or sys.stdin.buffer, parser=parser)
+    root = document.getroot()
+    # Only inkex can measure text and clones
+    if not all(hasShapes(part) for part in collectParts(root)):
+        return False
+    registerNamespace()
+    nest(root, options)
+    if options.output:
+        with open(options.output, "wb") as stream:
+            stream.write(etree.tostring(document))
+    else:
+        sys.stdout.buffer.write(etree.tostring(document))
+    return True
+
+if __name__ == '__main__' and runHeadless(sys.argv[1:]):
+    sys.exit(0)
+
+import inkex
+
+# The corners of the bounding box of a part in document coordinates, for parts without shapes
+def boundingBox(part):
+    box = part.bounding_box(part.getparent().composed_transform())
+    if box is None:
+        return None
+    return [(box.left, box.top), (box.right, box.top), (box.right, box.bottom), (box.left, box.bottom)]
+
+class LaserSVGNesting(LaserSVGMixin, inkex.EffectExtension):
+
+    def add_arguments(self, pars):
+        addArguments(pars)
+
+    def effect(self):
+        # Register the namespace prefix both with etree and inkscape
+        self.registerNamespace()
+        nest(self.document.getroot(), self.options, boundingBox)
+
+
+if __name__ == '__main__':
+    LaserSVGNesting().run()
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Packs all top-level parts of a document onto sheets of a given size. Only needs lxml, such that the nesting extension
+# and the parameter control can also nest without inkex (see laserSVG_nesting.py).
+
+import sys
+from math import radians, sin, cos
+
+from laserSVG_core import LASER, SVG, INKSCAPE, SHAPES, CONTAINERS, HELPER_LAYERS, IDENTITY, PathData, documentMatrix, shapePath, \
+    flattenPath, parseTransform, multiplyTransform, invertTransform, formatTransform, formatNumber
+
+SODIPODI = "{http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd}"
+# Everything that can be a part, besides the shapes and groups
+PART_TAGS = SHAPES | CONTAINERS | {SVG + tag for tag in ("text", "use", "image")}
+
+# The nesting settings are stored on the root node, such that the control panel can re-nest after a thickness change
+SETTINGS = (("sheet-width", "sheet_width", float),
+            ("sheet-height", "sheet_height", float),
+            ("sheet-spacing", "spacing", float),
+            ("sheet-margin", "margin", float),
+            ("nesting", "mode", str),
+            ("nesting-rotate", "rotate", lambda value: value == "true"))
+
+# Rounding errors of the skyline, in user units
+EPSILON = 1e-9
+
+# Curves are flattened with this tolerance in mm. The outlines of the parts can be that much inside of the curves, which
+# is far below what a laser can cut.
+TOLERANCE = 0.001
+
+# Reads the nesting settings from the root node, returns None if the document was never nested
+def nestingSettings(root):
+    if root.get(LASER + "sheet-width") is None:
+        return None
+    return {option: convert(root.get(LASER + attribute)) for attribute, option, convert in SETTINGS if root.get(LASER + attribute) is not None}
+
+# Sizes are in mm. Parts without shapes, e.g. text, are measured with _measure_(part), which returns the corners of their
+# bounding box in document coordinates (see laserSVG_nesting.py), without it they stay where they are.
+def nestDocument(root, sheet_width=600, sheet_height=400, spacing=2, margin=5, mode="skyline", rotate=True, measure=None):
+    parts = collectParts(root)
+    if not parts:
+        return
+
+    # The parts are placed in user units
+    scale = documentMatrix(root, bottomLeft=False)[0]
+    sheet_width, sheet_height, spacing, margin = sheet_width / scale, sheet_height / scale, spacing / scale, margin / scale
+
+    # All packing happens on the convex hulls of the parts in document coordinates
+    hulls = [partHull(part, TOLERANCE / scale, measure) for part in parts]
+    angles = (0, 90, 180, 270) if rotate else (0,)
+    if mode == "polygon":
+        placements = polygonPack([hull or [(0, 0)] for hull in hulls], sheet_width, sheet_height, spacing, margin, angles)
+    else:
+        placements = skylinePack([hull or [(0, 0)] for hull in hulls], sheet_width, sheet_height, spacing, margin, angles[:2])
+
+    sheetCount = 0
+    for part, hull, placement in zip(parts, hulls, placements):
+        if hull is None:
+            sys.stderr.write("Warning: {} has no outline and was not moved.\n".format(part.get("id")))
+            continue
+        if placement is None:
+            sys.stderr.write("Warning: {} does not fit on a sheet and was not moved.\n".format(part.get("id")))
+            continue
+        sheet, angle, x, y = placement
+        sheetCount = max(sheetCount, sheet + 1)
+        left, top, _, _ = bounds(rotatePoints(hull, angle))
+        transform = multiplyTransform((1.0, 0.0, 0.0, 1.0, sheetOffset(sheet, sheet_width) + margin + x - left, margin + y - top),
+                                      parseTransform("rotate({})".format(angle)))
+        # The placement is in document coordinates, the part lives in the coordinate system of its parent
+        parentTransform = composedTransform(part.getparent())
+        matrix = multiplyTransform(multiplyTransform(invertTransform(parentTransform), transform),
+                                   multiplyTransform(parentTransform, parseTransform(part.get("transform"))))
+        if matrix == IDENTITY:
+            part.attrib.pop("transform", None)
+        else:
+            part.set("transform", formatTransform(matrix))
+
+    drawSheets(root, sheetCount, sheet_width, sheet_height)
+
+# Sheets are laid out next to each other, with a gap of a tenth of the sheet width
+def sheetOffset(sheet, sheetWidth):
+    return sheet * sheetWidth * 1.1
+
+# Parts are all direct children of layers, and all shapes directly in the root
+def collectParts(root):
+    parts = []
+    for child in root:
+        if child.tag not in PART_TAGS or child.get("id") in HELPER_LAYERS:
+            continue
+        if child.get(INKSCAPE + "groupmode") == "layer":
+            parts.extend(element for element in child if element.tag in PART_TAGS and element.get("id") not in HELPER_LAYERS)
+        else:
+            parts.append(child)
+    return parts
+
+# Whether the outline of _part_ can be found without inkex, i.e. it has shapes
+def hasShapes(part):
+    return next(part.iter(*SHAPES), None) is not None
+
+# The transform from the coordinates of _node_, including its own transform, to the document
+def composedTransform(node):
+    matrix = IDENTITY
+    while node is not None and node.getparent() is not None:
+        matrix = multiplyTransform(parseTransform(node.get("transform")), matrix)
+        node = node.getparent()
+    return matrix
+
+# The convex hull of the shapes of a part in document coordinates, or None if it has no outline
+def partHull(part, tolerance, measure=None):
+    points = []
+    for node in part.iter(*SHAPES):
+        try:
+            path = PathData.parse(shapePath(node))
+        except ValueError:
+            continue
+        for subpath, _ in flattenPath(path, composedTransform(node), tolerance):
+            points.extend(subpath)
+    if not points and measure is not None:
+        # Text, clones and anything else without a path, fall back to the bounding box
+        points = measure(part) or []
+    return convexHull(points) if points else None
+
+# Andrew's monotone chain, returns the hull in counter-clockwise order
+def convexHull(points):
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+    cross = lambda o, a, b: (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+    lower, upper = [], []
+    for point in points:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return lower[:-1] + upper[:-1]
+
+def rotatePoints(points, angle):
+    if angle == 0:
+        return points
+    c, s = cos(radians(angle)), sin(radians(angle))
+    return [(x * c - y * s, x * s + y * c) for x, y in points]
+
+def bounds(points):
+    xs = [x for x, _ in points]
+    ys = [y for _, y in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+# Bottom-left skyline packing of the bounding boxes. Each sheet keeps a skyline of (x, y, width) segments,
+# parts are placed where their bottom edge ends up highest, and a new sheet is started if no open sheet fits.
+def skylinePack(hulls, sheetWidth, sheetHeight, spacing, margin, angles):
+    # The spacing is added to every part, so the usable area grows by one spacing to not waste it at the border
+    width, height = sheetWidth - 2 * margin + spacing, sheetHeight - 2 * margin + spacing
+    sizes = []
+    for hull in hulls:
+        options = []
+        for angle in angles:
+            left, top, right, bottom = bounds(rotatePoints(hull, angle))
+            options.append((angle, right - left + spacing, bottom - top + spacing))
+        sizes.append(options)
+
+    placements = [None] * len(hulls)
+    skylines = []
+    # Tall parts first, they define the rows
+    for index in sorted(range(len(hulls)), key=lambda i: -max(min(w, h) for _, w, h in sizes[i])):
+        for sheet in range(len(skylines) + 1):
+            if sheet == len(skylines):
+                skylines.append([[0, 0, width]])
+            best = None
+            for angle, w, h in sizes[index]:
+                position = skylineFit(skylines[sheet], w, h, width, height)
+                if position is not None and (best is None or (position[1] + h, position[0]) < (best[2] + best[4], best[1])):
+                    best = (angle, position[0], position[1], w, h)
+            if best is not None:
+                angle, x, y, w, h = best
+                skylineAdd(skylines[sheet], x, y + h, w)
+                placements[index] = (sheet, angle, x, y)
+                break
+            if len(skylines[sheet]) == 1 and skylines[sheet][0][1] == 0:
+                # Doesn't even fit on an empty sheet
+                skylines.pop()
+                break
+    return placements
+
+def skylineFit(skyline, w, h, width, height):
+    best = None
+    for i, (x, _, _) in enumerate(skyline):
+        if x + w > width:
+            break
+        # The part rests on the highest segment it spans
+        y, remaining, j = 0, w, i
+        while remaining > EPSILON and j < len(skyline):
+            y = max(y, skyline[j][1])
+            remaining -= skyline[j][2]
+            j += 1
+        if y + h <= height and (best is None or (y, x) < (best[1], best[0])):
+            best = (x, y)
+    return best
+
+def skylineAdd(skyline, x, y, w):
+    i = next(i for i, segment in enumerate(skyline) if segment[0] == x)
+    skyline.insert(i, [x, y, w])
+    # Cut away everything the new segment covers
+    i += 1
+    while i < len(skyline) and skyline[i][0] < x + w:
+        overlap = x + w - skyline[i][0]
+        if overlap >= skyline[i][2]:
+            skyline.pop(i)
+        else:
+            skyline[i][0] += overlap
+            skyline[i][2] -= overlap
+            break
+    # Merge neighbours of the same height
+    i = 0
+    while i < len(skyline) - 1:
+        if skyline[i][1] == skyline[i + 1][1]:
+            skyline[i][2] += skyline.pop(i + 1)[2]
+        else:
+            i += 1
+
+# Places the convex outlines of the parts, such that rotated and non-rectangular parts can nest into each other.
+# Candidate positions are next to the parts that are already placed, and every accepted position is then slid up and left
+# as far as possible. Overlaps are only checked against the parts found in a grid index.
+def polygonPack(hulls, sheetWidth, sheetHeight, spacing, margin, angles):
+    width, height = sheetWidth - 2 * margin, sheetHeight - 2 * margin
+    shapes = []
+    for hull in hulls:
+        options = {}
+        for angle in angles:
+            rotated = rotatePoints(hull, angle)
+            left, top, right, bottom = bounds(rotated)
+            normalized = [(x - left, y - top) for x, y in rotated]
+            # Symmetric parts look the same in several rotations, these only need to be tried once
+            key = tuple(sorted((round(x, 6), round(y, 6)) for x, y in normalized))
+            if key not in options:
+                options[key] = (angle, Outline(normalized), right - left, bottom - top)
+        shapes.append(list(options.values()))
+
+    cellSize = max(1.0, sum(max(options[0][2], options[0][3]) for options in shapes) / len(shapes))
+    placements = [None] * len(hulls)
+    sheets = []
+    # The smallest area that did not fit on a sheet anymore, larger parts don't need to try that sheet again
+    failedArea = []
+    # Large parts first, the small ones fill the gaps
+    for index in sorted(range(len(hulls)), key=lambda i: -shapes[i][0][2] * shapes[i][0][3]):
+        area = shapes[index][0][2] * shapes[index][0][3]
+        for sheet in range(len(sheets) + 1):
+            if sheet == len(sheets):
+                sheets.append(GridIndex(cellSize))
+                failedArea.append(float("inf"))
+            elif area >= failedArea[sheet]:
+                continue
+            best = None
+            candidates = polygonCandidates(sheets[sheet], spacing)
+            for angle, outline, w, h in shapes[index]:
+                position = polygonFit(sheets[sheet], candidates, outline, w, h, width, height, spacing)
+                if position is not None and (best is None or (position[1] + h, position[0]) < (best[2] + best[4], best[1])):
+                    best = (angle, position[0], position[1], w, h, outline)
+            if best is not None:
+                angle, x, y, w, h, outline = best
+                sheets[sheet].insert((x, y, x + w, y + h), outline.translated(x, y))
+                placements[index] = (sheet, angle, x, y)
+                break
+            failedArea[sheet] = area
+            if not sheets[sheet].items:
+                sheets.pop()
+                failedArea.pop()
+                break
+    return placements
+
+# Positions right of and below all placed parts, sorted top to bottom and left to right.
+# Positions that are covered by a placed part are dropped, they would only fail the overlap test later on.
+def polygonCandidates(index, spacing):
+    candidates = {(0, 0)}
+    for left, top, right, bottom in index.boxes:
+        candidates.update(((right + spacing, top), (left, bottom + spacing), (right + spacing, 0), (0, bottom + spacing)))
+    return sorted((point for point in candidates if not any(other.contains(*point) for other in index.query(point * 2))), key=lambda p: (p[1], p[0]))
+
+def polygonFit(index, candidates, outline, w, h, width, height, spacing):
+    if w > width or h > height:
+        return None
+    for x, y in candidates:
+        if x + w > width or y + h > height:
+            continue
+        # Remember the smallest part that did not fit at a position, larger ones won't fit there either.
+        # This is not strictly true for non-rectangular parts, but it only costs a possible position, never an overlap.
+        failed = index.failed.get((x, y))
+        if failed is not None and w >= failed[0] and h >= failed[1]:
+            continue
+        if polygonFree(index, outline, x, y, w, h, spacing):
+            return slide(index, outline, x, y, w, h, spacing)
+        if failed is None or w * h < failed[0] * failed[1]:
+            index.failed[(x, y)] = (w, h)
+    return None
+
+# Moves a valid position up and left in decreasing steps while it stays valid
+def slide(index, outline, x, y, w, h, spacing):
+    for _ in range(2):
+        for dx, dy in ((0, -1), (-1, 0)):
+            step = max(w, h) / 2
+            while step > 0.05:
+                nx, ny = x + dx * step, y + dy * step
+                if nx >= 0 and ny >= 0 and polygonFree(index, outline, nx, ny, w, h, spacing):
+                    x, y = nx, ny
+                else:
+                    step /= 2
+    return x, y
+
+def polygonFree(index, outline, x, y, w, h, spacing):
+    for other in index.query((x - spacing, y - spacing, x + w + spacing, y + h + spacing)):
+        if not outline.separated(x, y, other, spacing):
+            return False
+    return True
+
+# A convex outline with its edge normals and its projections onto them, such that the separating axis test
+# only has to project the other polygon
+class Outline(object):
+    def __init__(self, points, axes=None, ranges=None):
+        self.points = points
+        if axes is None:
+            axes = {}
+            for i in range(len(points)):
+                x0, y0 = points[i - 1]
+                x1, y1 = points[i]
+                nx, ny = y0 - y1, x1 - x0
+                length = (nx * nx + ny * ny) ** 0.5
+                if length == 0:
+                    continue
+                nx, ny = nx / length, ny / length
+                # Opposite edges share an axis
+                if nx < 0 or (nx == 0 and ny < 0):
+                    nx, ny = -nx, -ny
+                axes[(round(nx, 9), round(ny, 9))] = (nx, ny)
+            axes = list(axes.values())
+            ranges = []
+            for nx, ny in axes:
+                projection = [px * nx + py * ny for px, py in points]
+                ranges.append((min(projection), max(projection)))
+        self.axes = axes
+        self.ranges = ranges
+
+    # A point is inside of a convex polygon if it is within its projections on all axes
+    def contains(self, x, y):
+        for (nx, ny), (low, high) in zip(self.axes, self.ranges):
+            if not low < x * nx + y * ny < high:
+                return False
+        return True
+
+    def translated(self, x, y):
+        return Outline([(px + x, py + y) for px, py in self.points], self.axes,
+                       [(low + x * nx + y * ny, high + x * nx + y * ny) for (nx, ny), (low, high) in zip(self.axes, self.ranges)])
+
+    # Separating axis test against another outline, with this one moved by (x, y). They are separate if their
+    # projections on one of the edge normals are at least spacing apart.
+    def separated(self, x, y, other, spacing):
+        for (nx, ny), (low, high) in zip(self.axes, self.ranges):
+            offset = x * nx + y * ny
+            projection = [px * nx + py * ny for px, py in other.points]
+            if high + offset + spacing <= min(projection) or max(projection) + spacing <= low + offset:
+                return True
+        for (nx, ny), (low, high) in zip(other.axes, other.ranges):
+            offset = x * nx + y * ny
+            projection = [px * nx + py * ny for px, py in self.points]
+            if max(projection) + offset + spacing <= low or high + spacing <= min(projection) + offset:
+                return True
+        return False
+
+# A uniform grid over the sheet, each cell knows the outlines whose bounding box touches it
+class GridIndex(object):
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = {}
+        self.items = []
+        self.boxes = []
+        self.failed = {}
+
+    def cellRange(self, box):
+        left, top, right, bottom = box
+        for cx in range(int(left // self.cellSize), int(right // self.cellSize) + 1):
+            for cy in range(int(top // self.cellSize), int(bottom // self.cellSize) + 1):
+                yield (cx, cy)
+
+    def insert(self, box, item):
+        self.items.append(item)
+        self.boxes.append(box)
+        for cell in self.cellRange(box):
+            self.cells.setdefault(cell, []).append(len(self.items) - 1)
+
+    def query(self, box):
+        found = set()
+        for cell in self.cellRange(box):
+            found.update(self.cells.get(cell, ()))
+        left, top, right, bottom = box
+        for i in found:
+            l, t, r, b = self.boxes[i]
+            if l <= right and r >= left and t <= bottom and b >= top:
+                yield self.items[i]
+
+# Draw the outline of every used sheet in a separate layer
+def drawSheets(root, count, sheetWidth, sheetHeight):
+    layer = root.find(".//*[@id='sheetLayer']")
+    if layer is None:
+        layer = root.makeelement(SVG + "g", {"id": "sheetLayer", INKSCAPE + "groupmode": "layer", INKSCAPE + "label": "Sheets",
+                                             SODIPODI + "insensitive": "true"}, nsmap={"inkscape": INKSCAPE[1:-1], "sodipodi": SODIPODI[1:-1]})
+        root.append(layer)
+    for child in list(layer):
+        layer.remove(child)
+    for sheet in range(count):
+        layer.append(layer.makeelement(SVG + "rect", {"x": formatNumber(sheetOffset(sheet, sheetWidth)), "y": "0", "width": formatNumber(sheetWidth),
+                                                      "height": formatNumber(sheetHeight), "style": "fill:none;stroke:lightgray;stroke-width:0.5",
+                                                      # The outlines are only a guide, they should never be sent to the laser
+                                                      LASER + "action": "none"}))
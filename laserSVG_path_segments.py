@@ -20,20 +20,34 @@
 
 # see https://launchpadlibrarian.net/235367843/debug_sel_nodes.py for more details
 
+import sys
+
+# A run with the same document and options as an earlier one reuses its result (see laserSVG_cache.py)
+if __name__ == '__main__':
+    from laserSVG_cache import CachedRun
+    cachedRun = CachedRun("laserSVG_path_segments", sys.argv[1:])
+    if cachedRun.replay():
+        sys.exit(0)
+
 import inkex
-import inkex.elements 
 import re
 from lxml import etree
-from math import sqrt, atan2, pi, sin, cos, trunc, degrees, copysign, isclose
+from math import atan2, pi, sin, cos, degrees, copysign
 
-class LaserSVG(inkex.EffectExtension):
+from laserSVG_core import LaserSVGMixin, PathData, END_POINT_ARGUMENTS, commandDelta, segmentLength, shapeFingerprint
+from laserSVG_api import LengthIndex, closestMultiple, parseMultiples, storeTemplate, tagArguments, truncate
 
-    selected_nodes = {}
-    LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
-    LASER_PREFIX = "laser"
-    LASER = "{%s}" % LASER_NAMESPACE
+# The terms of an already tagged coordinate, e.g. {12.5-0.5*thickness}
+TERM_PATTERN = re.compile(r"(?P<offset>-?\d+(\.\d+)?)(?P<calc>(?P<factor>[-+]?\d+(\.\d+))?(?P<operator>[-+/\*]?)thickness)*", re.MULTILINE)
 
-    threshold = 0.15
+class LaserSVG(LaserSVGMixin, inkex.EffectExtension):
+
+    def __init__(self):
+        super().__init__()
+        # Set per run, the instances of a batch run must not share them
+        self.selected_nodes = {}
+        self.threshold = 0.15
+        self.multiples = (1,)
 
     def add_arguments(self, pars):
         pars.add_argument("--material_thickness", default=3, help="The material thickness")
@@ -44,14 +58,20 @@ class LaserSVG(inkex.EffectExtension):
         pars.add_argument("--subtract", default=False, help="Subtract thickness from segment")
         pars.add_argument("--assume_parallel", default=False, help="Assume segment and slit base to be parallel.")
         pars.add_argument("--tolerance", default=0.15, help="Tolerance when handling measurements")
+        pars.add_argument("--multiples", default="1", help="The multiples of the thickness to tag, e.g., 0.5, 1, 2")
         pars.add_argument("--round_thickness", default=False, help="Round elements close to thickness to the exact value.")
+        pars.add_argument("--encoding", default="full", help="Store the full template, or only the tagged segments")
+        pars.add_argument("--cache", default="true", help="Replay the results of earlier runs with the same settings (see laserSVG_cache.py)")
         pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
 
     def effect(self):
-        etree.register_namespace("laser", self.LASER_NAMESPACE)
-        inkex.elements._utils.NSS["laser"] = self.LASER_NAMESPACE
+        self.registerNamespace()
 
         self.threshold = float(self.options.tolerance)
+        try:
+            self.multiples = parseMultiples(self.options.multiples)
+        except ValueError as error:
+            raise inkex.AbortExtension(str(error))
         # If nothing is selected, we can't do anything
         if not self.svg.selected:
             raise inkex.AbortExtension("Please select an object.")
@@ -61,11 +81,14 @@ class LaserSVG(inkex.EffectExtension):
 
         material_thickness = float(self.document.getroot().get("{}material-thickness".format(self.LASER)))
 
+        # The selection already holds the elements, looking each one up again searches the whole document
+        if self.options.tab == "tag_all":
+            self.tagSegments([self.svg.selected[pathID] for pathID in self.options.ids], float(material_thickness))
+            return
+
         for pathID in self.options.ids:
-            path = self.svg.getElementById(pathID)
-            if self.options.tab == "tag_all":
-                self.tagSegments(path, float(material_thickness))
-            elif self.options.tab == "tag_selected":    
+            path = self.svg.selected[pathID]
+            if self.options.tab == "tag_selected":    
                 self.selected_nodes = self.parse_selected_nodes(self.options.selected_nodes)
                 
                 # inkex.utils.debug(self.selected_nodes)
@@ -86,7 +109,7 @@ class LaserSVG(inkex.EffectExtension):
                         # place the {thickness} label at the repective place in the path template
             elif self.options.tab == "tag_selection":    
                 if self.options.selection_process_run == '1':
-                    self.addSelectionLayer(path, float(material_thickness), "highlightLayer", "Thickness segments", "limegreen")
+                    self.addSelectionLayer(path, float(material_thickness), "highlightLayer", "Thickness segments", "limegreen", self.multiples)
                 elif self.options.selection_process_run == '2':
                     highlightLayer = self.svg.getElementById("highlightLayer")
                     if highlightLayer is not None:
@@ -119,15 +142,48 @@ class LaserSVG(inkex.EffectExtension):
         pass
     class curveTemplate(template, inkex.paths.curve):
         pass
-
-    # This method goes through all segments of a path and replaces those that are of length _length_ with a {thickness} label
-    def tagSegments(self, path, length):
-
-        template = inkex.paths.Path()
-        for command in path.original_path.to_relative():
-            # if the length matches, we replace the args with the according tags
-           template.append(self.tagCommand(command, length))
-        path.set(inkex.elements._utils.addNS("template", self.LASER_PREFIX),template)
+    class smoothTemplate(template, inkex.paths.smooth):
+        pass
+    class quadraticTemplate(template, inkex.paths.quadratic):
+        pass
+    class tepidQuadraticTemplate(template, inkex.paths.tepidQuadratic):
+        pass
+    class arcTemplate(template, inkex.paths.arc):
+        # The flags of arcs have to be written as 0 or 1
+        def __init__(self, rx, ry, x_axis_rotation, large_arc, sweep, dx, dy):
+            super().__init__(rx, ry, x_axis_rotation, int(large_arc), int(sweep), dx, dy)
+
+    # The template class for each relative command
+    TEMPLATES = {"m": moveTemplate, "l": lineTemplate, "h": horzTemplate, "v": vertTemplate, "c": curveTemplate,
+                 "s": smoothTemplate, "q": quadraticTemplate, "t": tepidQuadraticTemplate, "a": arcTemplate}
+
+    # This method goes through all segments of the paths and replaces those that are as long as one of the multiples of
+    # _length_ with a {thickness} label. The lengths of all paths go into one index, such that one binary search per
+    # multiple finds their segments (see LengthIndex).
+    # Sheets often hold many copies of the same part, these are indexed and tagged once and share the result (see shapeFingerprint)
+    def tagSegments(self, paths, length):
+        shapes, index = [], LengthIndex()
+        for path in paths:
+            commands = list(path.original_path.to_relative())
+            key = shapeFingerprint((command.letter, command.args) for command in commands)
+            if key not in index:
+                index.add(key, ((command.letter, command.args) for command in commands))
+            shapes.append((path, commands, key))
+        matches = index.match(length, self.multiples, self.threshold)
+        taggedShapes = {}
+        for path, commands, key in shapes:
+            tagged = taggedShapes.get(key)
+            if tagged is None:
+                # if the length matches, we replace the args with the according tags
+                segments = matches.get(key, {})
+                tagged = taggedShapes[key] = [self.tagCommand(command, length, (segments[number],)) if number in segments else command
+                                              for number, command in enumerate(commands)]
+            # Each copy keeps its own position
+            template = inkex.paths.Path(commands[:1] + tagged[1:])
+            self.setTemplate(path, template)
+
+    def setTemplate(self, path, template):
+        storeTemplate(path, template, self.options.encoding)
 
     def parse_selected_nodes(self, nodes):
         result = {}
@@ -145,7 +201,7 @@ class LaserSVG(inkex.EffectExtension):
                     result[pathID][sub_path].extend([sel_node])
         return result
 
-    def addSelectionLayer(self, path, length, layername, readable_layername, layercolor):
+    def addSelectionLayer(self, path, length, layername, readable_layername, layercolor, multiples=(1,)):
         # Create an additional layer for the highlights or just 
         if self.document.getroot().find(f".//svg:g[@id='{layername}']", namespaces=inkex.utils.NSS) is not None:
             layer = self.svg.getElementById(layername)
@@ -154,21 +210,16 @@ class LaserSVG(inkex.EffectExtension):
             layer.set("id", layername)
            
         # Store away the absolute endpoints of the commands to be able to draw the highlights
-        csp_abs = path.original_path.to_absolute().to_superpath()
-        endpoints = [path.original_path.to_absolute()[0].args]
-        for x in csp_abs.to_segments():
-            if x.letter == 'L':
-                endpoints.append((x.args[0], x.args[1]))
-            elif x.letter == 'C':
-                endpoints.append((x.args[4],x.args[5]))
-
-        # Check for every path segment that is of size length
-        for index,command in enumerate(path.original_path.to_relative()): #Easier in relative mode
-            commandLength = self.getCommandLength(command)
+        pathData = PathData.parse(path.get("d"))
+        endpoints = pathData.endpoints()
+
+        # Check for every path segment that is of size length, or one of its multiples
+        for index,command in enumerate(pathData.relative()): #Easier in relative mode
+            commandLength = segmentLength(*command)
             if commandLength is not None:
-                if abs(commandLength-length) < self.threshold:
+                if closestMultiple(commandLength, length, multiples, self.threshold) is not None:
                     if index < 2:
-                        inkex.utils.debug(f"Warning: {command} it the {index} segment of the path {path}, which could be problematic.")
+                        inkex.utils.debug(f"Warning: {command[0]} {command[1]} it the {index} segment of the path {path}, which could be problematic.")
                 # Now get the coordinates to draw a line from the absolute mode path
                     line = etree.SubElement(layer, "line")
                     if index > 1:
@@ -180,8 +231,8 @@ class LaserSVG(inkex.EffectExtension):
                         #This is the first segment after the move command. 
                         line.set("x1", endpoints[index-1][0])
                         line.set("y1", endpoints[index-1][1])
-                        line.set("x2", endpoints[index-1][0] + self.getCommandDelta(command)[0])
-                        line.set("y2", endpoints[index-1][1] + self.getCommandDelta(command)[1])
+                        line.set("x2", endpoints[index-1][0] + commandDelta(*command)[0])
+                        line.set("y2", endpoints[index-1][1] + commandDelta(*command)[1])
                     line.set("stroke", layercolor)
                     # Use a similar notation to map the segments as for selected nodes
                     # id:entity:segment_number
@@ -270,7 +321,7 @@ class LaserSVG(inkex.EffectExtension):
                 # The segment to the left and right of the base need to be adjusted. 
                 # For that, we take the centerpoint of the slit base, and calculate how much change in x and y
                 # this generates if we draw a vector of half the thickness from there with the same angle as the current base
-                base_dx, base_dy = self.getCommandDelta(command)
+                base_dx, base_dy = commandDelta(command.letter, command.args)
                 base_origin_x, base_origin_y = csp_abs[0][index-1][0][0], csp_abs[0][index-1][0][1]
                 base_center= (base_origin_x+(base_dx/2), base_origin_y+(base_dy/2))
 
@@ -312,7 +363,7 @@ class LaserSVG(inkex.EffectExtension):
                 
 
                 # The new endpoint for the ll segment is thus gap_center.x-{thickness*cos(gap.angle),gap_center.y-{thickness*sin(gap.angle)}}
-                path.set(inkex.elements._utils.addNS("template", self.LASER_PREFIX),template)
+                self.setTemplate(path, template)
 
                 # template[index-1] = self.tagCommandWithCalculation(command, )
                 # inkex.utils.debug(template[index].end_point)
@@ -368,50 +419,31 @@ class LaserSVG(inkex.EffectExtension):
         template = path.copy().original_path.to_relative()
         for index,command in enumerate(path.original_path.to_relative()):
             if index in segments:
-                template[index] = self.tagCommand(command, float(self.document.getroot().get("{}material-thickness".format(self.LASER))))
+                template[index] = self.tagCommand(command, float(self.document.getroot().get("{}material-thickness".format(self.LASER))), self.multiples)
 
-        path.set(inkex.elements._utils.addNS("template", self.LASER_PREFIX),template)
+        self.setTemplate(path, template)
 
     # returns a command with tagged parameters including a calculation
+    # _calculation_ holds the terms for the x and y coordinate of the end point
     def tagCommandWithCalculation(self, command, calculation):
-        if command.letter == 'l':
-            return self.lineTemplate(calculation[0],calculation[1])
-        elif command.letter == 'm':
-            return self.moveTemplate(calculation[0],calculation[1])
-        elif command.letter in ['v', 'h']:
-            if command.letter == 'h':
-                newCommand = self.horzTemplate(calculation[0]) if calculation[1] == "0" else self.lineTemplate(calculation[0],calculation[1])
-            elif command.letter == 'v':
-                newCommand = self.vertTemplate(calculation[1]) if calculation[0] == "0" else self.lineTemplate(calculation[0],calculation[1])
-            return newCommand
-        elif command.letter == 'c':
-            return self.curveTemplate(command.args[0], command.args[1], command.args[2], command.args[3], calculation[0], calculation[1])
-        else: # if the command is not handled
+        # A horizontal or vertical segment whose end point moves off its axis becomes a line
+        if (command.letter == 'h' and calculation[1] != "0") or (command.letter == 'v' and calculation[0] != "0"):
+            return self.lineTemplate(calculation[0], calculation[1])
+        indices = END_POINT_ARGUMENTS.get(command.letter)
+        if indices is None: # if the command is not handled
             return command
+        args = list(command.args)
+        for index, term in zip(indices, calculation):
+            if index is not None:
+                args[index] = term
+        return self.TEMPLATES[command.letter](*args)
 
     def tagSlitSegment(self, command, gap, centerpiece, thickness):
         # The close-command doesn't have any parameters that we would need to adjust
         if command.letter == "z":
             return("","")
-        elif command.letter == "l" or command.letter == "t" or command.letter == "m":
-            args = command.args
-        elif command.letter == "h":
-            args = (command.args[0], 0)
-        elif command.letter == "v":
-            args = (0, command.args[0])
-        elif command.letter == "s" or command.letter == "q":
-            args = (command.args[2], command.args[3])
-        elif command.letter == "c":
-            args = (command.args[4], command.args[5])
-        elif command.letter == "a":
-            args = (command.args[5], command.args[6])
-        # For lines we have to adjust args 0 and 1
-        # for v and h we have to adjust arg 0
-        # for c we have to adjust 4 and 5
-        # for s it's 2 and 3
-        # for q it's 2 and 3
-        # for t it's 0 and 1
-        # for a it's 5 and 6
+        # The end point of the segment, e.g. args 0 and 1 for lines, 4 and 5 for curves
+        args = commandDelta(command.letter, command.args)
 
         # inkex.utils.debug(f"About to tag slit segment {command}")
         # if the slit base and ll and rr are parallel, we don't need to do all the calculations
@@ -460,11 +492,10 @@ class LaserSVG(inkex.EffectExtension):
             thickness_term_x = args[0]
 
             # Get the terms of the calculation
-            regex = r"(?P<offset>-?\d+(\.\d+)?)(?P<calc>(?P<factor>[-+]?\d+(\.\d+))?(?P<operator>[-+/\*]?)thickness)*"
 
             if "thickness" in args[0]:
 
-                result_x = re.search(regex, args[0], re.MULTILINE)
+                result_x = TERM_PATTERN.search(args[0])
                 # inkex.utils.debug(result_x.groupdict())
 
                 #The regex also matches when there is 
@@ -497,7 +528,7 @@ class LaserSVG(inkex.EffectExtension):
             if len(args) > 1:
                 thickness_term_y = args[1]
                 if "thickness" in args[1]:
-                    result_y = re.search(regex, args[1], re.MULTILINE)
+                    result_y = TERM_PATTERN.search(args[1])
 
                     if result_y.group('factor'):
                         angle_y = float(result_y.group('factor'))
@@ -544,108 +575,10 @@ class LaserSVG(inkex.EffectExtension):
             # inkex.utils.debug(f"Segment is fresh {calculation}")
         return calculation
 
-    # returns a command with tagged parameters
-    def tagCommand(self, command, thickness):
-        threshold = self.threshold #Use the global threshold
-        round_tolerance = 0.05
-        zero_tolerance = 0.01
-        if command.letter == 'l':
-            x = command.args[0]
-            y = command.args[1]
-
-            # In non-orthogonal cases, there can be a minimal difference due to floating points
-
-            if abs(sqrt(x*x + y*y) - thickness) < threshold:
-                factor_x = truncate(x/thickness, 5)
-                factor_y = truncate(y/thickness, 5)
-                if bool(self.options.round_thickness) == True:
-                    if isclose(factor_x,0, abs_tol=zero_tolerance): #remember this is a tolerance of 0.01 mm!  
-                        factor_x = 0
-                    if isclose(factor_y,0, abs_tol=zero_tolerance): 
-                        factor_y = 0
-                    if abs(factor_x) > (1-round_tolerance) and abs(factor_x) < (1+round_tolerance):
-                        factor_x = copysign(1, factor_x)
-                    if abs(factor_y) > (1-round_tolerance) and abs(factor_y) < (1+round_tolerance):
-                        factor_y = copysign(1, factor_y)
-
-                return self.lineTemplate("0" if factor_x == 0 else "{thickness}" if factor_x == 1 else "{-thickness}" if factor_x == -1 else "{{{}*thickness}}".format(factor_x),
-                    "0" if factor_y == 0 else "{thickness}" if factor_y == 1 else "{-thickness}" if factor_y == -1 else "{{{}*thickness}}".format(factor_y))
-            else:
-                return command
-        elif command.letter in ['v', 'h']:
-            x = command.args[0]
-
-            if  abs(abs(x) - thickness) < threshold:
-                ratio = truncate(x / thickness, 5)
-                if bool(self.options.round_thickness) == True:
-                    if isclose(ratio,0, abs_tol=zero_tolerance): 
-                        ratio = 0
-                    if abs(ratio) > (1-round_tolerance) and abs(ratio) < (1+round_tolerance):
-                        ratio = copysign(1, ratio)
-
-                pattern = ""
-                if ratio == 1:
-                    pattern = "{thickness}"
-                elif ratio == -1:
-                    pattern = "{-thickness}"
-                else:
-                    pattern = f"{{{ratio}*thickness}}"
-                if command.letter == 'h':
-                    newCommand = self.horzTemplate(pattern)
-                elif command.letter == 'v':
-                    newCommand = self.vertTemplate(pattern)
-
-                return newCommand
-            else: #if the length does not match
-                return command
-        elif command.letter == 'c':
-            length = self.getCommandLength(command) 
-            if  length is not None and abs(length-thickness) < threshold:
-                ratio_x = command.args[4] / thickness
-                if bool(self.options.round_thickness) == True:
-                    if isclose(ratio_x,0, abs_tol=zero_tolerance): 
-                        ratio_x = 0
-                    if abs(ratio_x) > (1-round_tolerance) and abs(ratio_x) < (1+round_tolerance):
-                        ratio_x = copysign(1, ratio_x)
-                term_x = "0" if ratio_x == 0 else "{thickness}" if ratio_x == 1 else "{-thickness}" if ratio_x == -1 else f"{{{ratio_x}*thickness}}"
-                ratio_y = command.args[5] / thickness
-                if bool(self.options.round_thickness) == True:
-                    if isclose(ratio_y,0, abs_tol=zero_tolerance): 
-                        ratio_y = 0
-                    if abs(ratio_y) > (1-round_tolerance) and abs(ratio_y) < (1+round_tolerance):
-                        ratio_y = copysign(1, ratio_y)
-                term_y = "0" if ratio_y == 0 else "{thickness}" if ratio_y == 1 else "{-thickness}" if ratio_y == -1 else f"{{{ratio_y}*thickness}}"
-                newCommand = self.curveTemplate(command.args[0], command.args[1], command.args[2], command.args[3], term_x, term_y)
-            else:
-                return command
-
-        else: # if the command is not handled
-            return command
-
-    # Get the length of a relative command segment
-    # such that we don't have to handle all the different parameter locations
-    def getCommandLength(self, command) -> float:
-        dx,dy = self.getCommandDelta(command)
-        if dx is not None and dy is not None:
-            return sqrt(dx**2 + dy**2)
-        else:    
-            return None
-        
-    def getCommandDelta(self, command):
-        if command.letter == 'l':
-            return (command.args[0], command.args[1])
-        elif command.letter == 'h':
-            return (command.args[0], 0)
-        elif command.letter == 'v':
-            return (0, command.args[0])
-        elif command.letter == 'c':
-            return (command.args[4], command.args[5])
-        elif command.letter in ['s', 'q']:
-            return (command.args[2], command.args[3])
-        elif command.letter == 'a':
-            return (command.args[5], command.args[6])
-        else:
-            return (None, None)
+    # returns a command with tagged parameters (see tagArguments)
+    def tagCommand(self, command, thickness, multiples=(1,)):
+        args = tagArguments(command.letter, command.args, thickness, self.threshold, self.options.round_thickness == "true", multiples)
+        return command if args is None else self.TEMPLATES[command.letter](*args)
 
     # based on MBBezierView.m    original BY MICHAL stackoverflow #4058979
     def bezierInterpolation(self, t, a, b, c, d):
@@ -715,11 +648,6 @@ class LaserSVG(inkex.EffectExtension):
         line.set("y2", y2)
         line.set("stroke", color)
 
-def truncate(number, digits) -> float:
-    stepper = 10.0 ** digits
-    return trunc(stepper * number) / stepper
-
-
-
 if __name__ == '__main__':
-    LaserSVG().run()
+    LaserSVG().run(cachedRun.args, output=cachedRun.output)
+    cachedRun.finish()
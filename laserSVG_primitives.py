@@ -19,24 +19,31 @@
 #
 
 # see https://launchpadlibrarian.net/235367843/debug_sel_nodes.py for more details
-import math
-
 import inkex
-import inkex.elements 
-from lxml import etree
 
-class LaserSVGPrimitives(inkex.EffectExtension):
+from laserSVG_core import LaserSVGMixin, SVG
+
+class LaserSVGPrimitives(LaserSVGMixin, inkex.EffectExtension):
 
-    selected_nodes = {}
-    LASER_NAMESPACE = "http://www.heller-web.net/lasersvg/"
-    LASER_PREFIX = "laser"
-    LASER = "{%s}" % LASER_NAMESPACE
+    SVG = SVG
+
+    # The settings that are applied to each type of primitive
+    PRIMITIVES = {"{http://www.w3.org/2000/svg}rect": "rectangleSettings",
+                  "{http://www.w3.org/2000/svg}circle": "circleSettings",
+                  "{http://www.w3.org/2000/svg}ellipse": "ellipseSettings",
+                  "{http://www.w3.org/2000/svg}polygon": "polygonSettings",
+                  "{http://www.w3.org/2000/svg}polyline": "polygonSettings"}
 
     """Replace the selection's nodes with numbered dots according to the options"""
     def add_arguments(self, pars):
         pars.add_argument("--rect_adjustment", default="none", help="The dimension in which a rect should be adjusted when material thickness changes.")
         pars.add_argument("--rect_kerf_adjust", default="none", help="The dimension in which a rect should be adjusted when material thickness changes.")
         pars.add_argument("--rect_origin", default="", help="The dimension in which a rect should be adjusted when material thickness changes.")
+        pars.add_argument("--circle_adjustment", default="none", help="Whether the diameter of a circle should be adjusted when material thickness changes.")
+        pars.add_argument("--circle_kerf_adjust", default="none", help="Whether a circle should grow or shrink with the kerf.")
+        pars.add_argument("--ellipse_adjustment", default="none", help="The dimension in which an ellipse should be adjusted when material thickness changes.")
+        pars.add_argument("--ellipse_kerf_adjust", default="none", help="Whether an ellipse should grow or shrink with the kerf.")
+        pars.add_argument("--polygon_kerf_adjust", default="none", help="Whether a polygon or polyline should grow or shrink with the kerf.")
         pars.add_argument("--action", default="none", help="The default laser operation")
         pars.add_argument("--material_thickness", default=3, help="The material thickness")
         pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
@@ -44,55 +51,54 @@ class LaserSVGPrimitives(inkex.EffectExtension):
     def effect(self):
         
         # Register the namespace prefix both with etree and inkscape
-        etree.register_namespace("laser", self.LASER_NAMESPACE)
-        inkex.elements._utils.NSS["laser"] = self.LASER_NAMESPACE
-
-        for elementID in self.options.ids:
-            element = self.svg.getElementById(elementID)
-            if element.tag == "{http://www.w3.org/2000/svg}rect":
-                self.rectangleSettings(element, self.options)
-                if self.options.rect_kerf_adjust != "none":
-                    element.set(inkex.elements._utils.addNS("kerf-adjust", self.LASER_PREFIX),self.options.rect_kerf_adjust)
-                else: 
-                    element.attrib.pop(inkex.elements._utils.addNS("kerf-adjust", self.LASER_PREFIX), None) # Remove it if nothing to do
+        self.registerNamespace()
 
-                if self.options.rect_origin == "":
-                    element.attrib.pop(inkex.elements._utils.addNS("origin", self.LASER_PREFIX), None) # Remove it if nothing to do
-                else:
-                    element.set(inkex.elements._utils.addNS("origin", self.LASER_PREFIX),self.options.rect_origin)
+        # Walk through the selection and everything inside of selected groups once.
+        # Elements that are selected together with their group should only be handled once.
+        visited = set()
+        for selected in self.svg.selected.values():
+            for element in selected.iter():
+                if element in visited:
+                    continue
+                visited.add(element)
+                handler = self.PRIMITIVES.get(element.tag)
+                if handler is not None:
+                    getattr(self, handler)(element, self.options)
+                # Selected elements always get the action, inside of groups only the shapes do
+                if handler is not None or element is selected or element.tag == self.SVG + "path":
+                    self.actionSettings(element, self.options)
 
-            if self.options.action == "file": 
-                element.attrib.pop(inkex.elements._utils.addNS("action", self.LASER_PREFIX), None) # Remove it if nothing to do
-            else:
-                element.set(inkex.elements._utils.addNS("action", self.LASER_PREFIX),self.options.action)
+    def rectangleSettings(self, element, options):
+        self.setOrRemove(element, "thickness-adjust", options.rect_adjustment)
+        self.setOrRemove(element, "kerf-adjust", options.rect_kerf_adjust)
+        self.setOrRemove(element, "origin", options.rect_origin)
 
+    # The diameter of a circle can only change in both directions
+    def circleSettings(self, element, options):
+        self.setOrRemove(element, "thickness-adjust", "both" if options.circle_adjustment not in ("", "none") else "")
+        self.setOrRemove(element, "kerf-adjust", options.circle_kerf_adjust)
 
-        
-        # # If nothing is selected, we can't do anything
-        # if not self.svg.selected:
-        #     raise inkex.AbortExtension("Please select an object.")
+    # Ellipses scale around their center, so there is no origin to set
+    def ellipseSettings(self, element, options):
+        self.setOrRemove(element, "thickness-adjust", options.ellipse_adjustment)
+        self.setOrRemove(element, "kerf-adjust", options.ellipse_kerf_adjust)
 
-        # self.selected_nodes = self.parse_selected_nodes(self.options.selected_nodes)
-        
-        # # inkex.utils.debug(self.selected_nodes)
+    # Polygons don't have a dimension that could follow the thickness, but they can be offset by the kerf
+    def polygonSettings(self, element, options):
+        self.setOrRemove(element, "kerf-adjust", options.polygon_kerf_adjust)
 
-        # # report about selected nodes
-        # for pathID, selected in self.selected_nodes.items():
-        #     path = self.svg.getElementById(pathID)
-        #     # p2 = path.original_path.to_superpath()
-        #     # inkex.utils.debug('{0}'.format(p2))
-        #     for element in selected: 
-        #         inkex.utils.debug( '{0} - selected nodes of subpath {1}: {2}'.format(pathID, element, selected[element]))
-        #         # show the coordinates
-        #         for nodes in selected[element]:
-        #             coordinates = path.original_path.to_superpath()[element][nodes][1]
-        #             inkex.utils.debug('{0} - selected node {1}: {2}'.format(pathID, nodes, coordinates))
-        #         # Check if path segment length matches specified thickness
-        #         # check if a path template is already defined, if not, create one
-        #         # place the {thickness} label at the repective place in the path template
+    def actionSettings(self, element, options):
+        if options.action == "file": 
+            element.attrib.pop(self.LASER + "action", None) # Remove it if nothing to do
+        else:
+            element.set(self.LASER + "action", options.action)
 
-    def rectangleSettings(self, element, options):
-        element.set(inkex.elements._utils.addNS("thickness-adjust", self.LASER_PREFIX),options.rect_adjustment)
+    # Sets a laser attribute, or removes it if there is nothing to do
+    def setOrRemove(self, element, attribute, value):
+        if value in ("", "none", None):
+            element.attrib.pop(self.LASER + attribute, None)
+        else:
+            element.set(self.LASER + attribute, value)
 
 if __name__ == '__main__':
     LaserSVGPrimitives().run()
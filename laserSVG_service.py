@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# A local render service, e.g., for the backend of a web configurator. Running the extensions for every request
+# pays for starting Python and parsing the design every time. The service keeps the designs parsed and their templates
+# compiled in a pool of worker processes instead (see Preview in laserSVG_editor.py).
+#
+#   python laserSVG_service.py [--host 127.0.0.1] [--port 8040] [--socket path] [--workers 4]
+#
+#   PUT    /designs/<name>                      stores the SVG in the body as a design
+#   GET    /designs/<name>?thickness=4&kerf=0.1 the design rendered with these parameters
+#   DELETE /designs/<name>
+#   GET    /designs                             the names of the stored designs
+#   POST   /render?thickness=4                  renders the SVG in the body without storing it
+#
+# Any parameter of the document can be given, including its custom ones, the others keep the value of the document.
+# Every design is always rendered by the same worker, such that it is parsed once. Requests for the same design and
+# parameters that arrive while it is rendered share the result. The service keeps up to 32 designs, storing another
+# one drops the design that was used longest ago, and the last 4 renders of each.
+# Designs whose expressions use anything but their parameters and arithmetic are refused with 422.
+# The service only listens on the local machine and needs nothing but lxml.
+
+import argparse
+import asyncio
+import hashlib
+import importlib
+import json
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import urlsplit, parse_qsl, unquote
+
+MAX_DOCUMENT = 64 * 1024 * 1024
+MAX_DESIGNS = 32
+# Renders kept per design. Customers choose the parameters freely, so most renders are never asked for again.
+RENDER_CACHE = 4
+CHUNK_SIZE = 64 * 1024
+
+STATUS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+          413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class ServiceError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+# Raised by a worker that doesn't hold the design (anymore), the service sends it the document then
+class NotLoaded(Exception):
+    pass
+
+# The errors of lxml can't be sent back from a worker, only their message is
+class RenderError(Exception):
+    pass
+
+
+# The designs a worker holds, by their digest, the ones used longest ago are dropped first
+PREVIEWS = OrderedDict()
+
+# Loads lxml and the core before the first request
+def warmUp():
+    importlib.import_module("laserSVG_editor")
+
+def renderDesign(digest, parameters, document=None):
+    preview = PREVIEWS.get(digest)
+    try:
+        if preview is None:
+            if document is None:
+                raise NotLoaded(digest)
+            preview = loadPreview(digest, document)
+        PREVIEWS.move_to_end(digest)
+        return preview.render(parameters)
+    except NotLoaded:
+        raise
+    except Exception as error:
+        raise RenderError(str(error))
+
+# Parses a design and checks its expressions, before it is stored or rendered
+def loadDesign(digest, document):
+    try:
+        if digest not in PREVIEWS:
+            loadPreview(digest, document)
+    except Exception as error:
+        raise RenderError(str(error))
+
+def loadPreview(digest, document):
+    from laserSVG_editor import Preview
+    preview = PREVIEWS[digest] = Preview(document, cacheSize=RENDER_CACHE, strict=True)
+    if len(PREVIEWS) > MAX_DESIGNS:
+        PREVIEWS.popitem(last=False)
+    return preview
+
+# The parameters of a request, as {name: number}
+def parseParameters(query):
+    parameters = {}
+    for name, value in parse_qsl(query):
+        try:
+            parameters[name] = float(value)
+        except ValueError:
+            raise ServiceError(400, "The parameter {} is not a number: {}".format(name, value))
+    return parameters
+
+
+class RenderService(object):
+
+    def __init__(self, workers=None):
+        count = workers or min(4, os.cpu_count() or 1)
+        # One process per worker, such that the designs can be assigned to them
+        self.workers = [self.startWorker() for _ in range(count)]
+        # The stored designs, the ones used longest ago are dropped first, like in the workers
+        self.designs = OrderedDict()
+        self.pending = {}
+
+    def startWorker(self):
+        worker = ProcessPoolExecutor(max_workers=1)
+        worker.submit(warmUp)
+        return worker
+
+    def close(self):
+        for worker in self.workers:
+            worker.shutdown(wait=False)
+
+    async def render(self, document, parameters):
+        digest = hashlib.sha256(document).hexdigest()
+        key = (digest, tuple(sorted(parameters.items())))
+        task = self.pending.get(key)
+        if task is None:
+            task = self.pending[key] = asyncio.ensure_future(self.renderOnWorker(digest, document, parameters))
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        # A client that goes away doesn't cancel the render for the others
+        return await asyncio.shield(task)
+
+    async def renderOnWorker(self, digest, document, parameters):
+        try:
+            return await self.runOnWorker(digest, renderDesign, parameters)
+        except NotLoaded:
+            return await self.runOnWorker(digest, renderDesign, parameters, document)
+
+    # Runs _function_ for a design on the worker that holds it
+    async def runOnWorker(self, digest, function, *args):
+        index = int(digest[:8], 16) % len(self.workers)
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self.workers[index], function, digest, *args)
+        except BrokenProcessPool:
+            self.workers[index] = self.startWorker()
+            raise ServiceError(503, "The worker stopped, please try again")
+        except RenderError as error:
+            raise ServiceError(422, "The design can't be rendered: {}".format(error))
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        path = [unquote(part) for part in url.path.strip("/").split("/")]
+        if path == ["render"]:
+            if method != "POST":
+                raise ServiceError(405, "Use POST to render a document")
+            return 200, "image/svg+xml", await self.render(body, parseParameters(url.query))
+        if path == ["designs"] and method == "GET":
+            return 200, "application/json", json.dumps(sorted(self.designs)).encode("utf-8")
+        if len(path) != 2 or path[0] != "designs" or not path[1]:
+            raise ServiceError(404, "Unknown resource {}".format(url.path))
+        name = path[1]
+        if method == "PUT":
+            digest = hashlib.sha256(body).hexdigest()
+            await self.runOnWorker(digest, loadDesign, body)
+            self.designs[name] = body
+            self.designs.move_to_end(name)
+            if len(self.designs) > MAX_DESIGNS:
+                self.designs.popitem(last=False)
+            return 201, "application/json", json.dumps({"design": name, "digest": digest}).encode("utf-8")
+        if name not in self.designs:
+            raise ServiceError(404, "Unknown design {}".format(name))
+        if method == "GET":
+            self.designs.move_to_end(name)
+            return 200, "image/svg+xml", await self.render(self.designs[name], parseParameters(url.query))
+        if method == "DELETE":
+            del self.designs[name]
+            return 200, "application/json", json.dumps({"design": name}).encode("utf-8")
+        raise ServiceError(405, "Method {} is not supported".format(method))
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await readRequest(reader)
+                    if request is None:
+                        break
+                    method, target, headers, body = request
+                    status, contentType, payload = await self.dispatch(method, target, body)
+                except ServiceError as error:
+                    headers = {"connection": "close"}
+                    status, contentType = error.status, "application/json"
+                    payload = json.dumps({"error": str(error)}).encode("utf-8")
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as error:
+                    # Anything else is a bug, the client still gets an answer
+                    headers = {"connection": "close"}
+                    status, contentType = 500, "application/json"
+                    payload = json.dumps({"error": "{}: {}".format(type(error).__name__, error)}).encode("utf-8")
+                keepAlive = headers.get("connection", "").lower() != "close"
+                await respond(writer, status, contentType, payload, keepAlive)
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# Reads one HTTP request, returns (method, target, headers, body), or None if the client closed the connection
+async def readRequest(reader):
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, _ = line.decode("latin-1").split()
+    except ValueError:
+        raise ServiceError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", 0))
+    except ValueError:
+        raise ServiceError(400, "Malformed Content-Length")
+    if length > MAX_DOCUMENT:
+        raise ServiceError(413, "The document is larger than {} MB".format(MAX_DOCUMENT // (1024 * 1024)))
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+# Writes the response in chunks, such that large documents go out while the rest waits in memory
+async def respond(writer, status, contentType, payload, keepAlive):
+    head = ["HTTP/1.1 {} {}".format(status, STATUS.get(status, "")),
+            "Content-Type: {}".format(contentType),
+            "Content-Length: {}".format(len(payload)),
+            "Connection: {}".format("keep-alive" if keepAlive else "close"), "", ""]
+    writer.write("\r\n".join(head).encode("latin-1"))
+    for start in range(0, len(payload), CHUNK_SIZE):
+        writer.write(payload[start:start + CHUNK_SIZE])
+        await writer.drain()
+    await writer.drain()
+
+
+# A minimal client for scripts and tests, returns (status, body)
+def request(method, path, body=None, host="127.0.0.1", port=8040, socket=None):
+    import http.client
+    if socket:
+        class UnixConnection(http.client.HTTPConnection):
+            def connect(self):
+                import socket as sockets
+                self.sock = sockets.socket(sockets.AF_UNIX, sockets.SOCK_STREAM)
+                self.sock.connect(socket)
+        connection = UnixConnection("localhost")
+    else:
+        connection = http.client.HTTPConnection(host, port)
+    try:
+        connection.request(method, path, body=body)
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+async def serve(options):
+    service = RenderService(options.workers)
+    try:
+        if options.socket:
+            if os.path.exists(options.socket):
+                # Left over from a service that was stopped
+                os.unlink(options.socket)
+            server = await asyncio.start_unix_server(service.handle, path=options.socket)
+        else:
+            server = await asyncio.start_server(service.handle, options.host, options.port)
+        print("LaserSVG render service on {}".format(options.socket or "http://{}:{}".format(options.host, options.port)), file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+def main():
+    pars = argparse.ArgumentParser(description="Render LaserSVG designs with different parameters on request")
+    pars.add_argument("--host", default="127.0.0.1", help="The address to listen on")
+    pars.add_argument("--port", type=int, default=8040, help="The port to listen on")
+    pars.add_argument("--socket", help="Listen on this Unix socket instead of a port")
+    pars.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    options = pars.parse_args()
+    try:
+        asyncio.run(serve(options))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
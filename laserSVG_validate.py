@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Evaluates the laser:template of every path over a range of material thicknesses and reports the segments that break:
+# subpaths that no longer close, segments that turn or invert (e.g., a slit deeper than the part), and segments that
+# start to cross each other. The drawing itself is not changed.
+# From the command line it runs without inkex over any number of files and directories, and exits with 1 if it found
+# a problem, e.g., in CI:
+#
+#   python laserSVG_validate.py --min_thickness=1 --max_thickness=10 --steps=19 designs/
+
+import json
+import os
+import sys
+from itertools import repeat
+from math import atan2, degrees, hypot
+from operator import add, sub, mul, truediv, floordiv, mod, neg, pos
+
+from laserSVG_core import LaserSVGMixin, LASER_NAMESPACE, LASER, EXPRESSION_GLOBALS, ParameterModel, parseTemplate, expandTemplate
+
+# Below this number of files, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 16
+
+
+# The value of an expression at every thickness of the sweep. Arithmetic applies to all of them at once, so an
+# expression is evaluated once per template instead of once per thickness.
+class Sweep(tuple):
+    __slots__ = ()
+
+    def apply(self, other, operation):
+        if isinstance(other, Sweep):
+            return Sweep(map(operation, self, other))
+        if isinstance(other, (int, float)):
+            return Sweep(map(operation, self, repeat(other)))
+        return NotImplemented
+
+    # Comparisons of tuples are lexicographic, which makes no sense here. Expressions that need them are evaluated per thickness.
+    def __lt__(self, other):
+        return NotImplemented
+    __le__ = __gt__ = __ge__ = __lt__
+
+    def __neg__(self):
+        return Sweep(map(neg, self))
+
+    def __pos__(self):
+        return Sweep(map(pos, self))
+
+    def __abs__(self):
+        return Sweep(map(abs, self))
+
+for name, operation in (("add", add), ("sub", sub), ("mul", mul), ("truediv", truediv), ("floordiv", floordiv), ("mod", mod), ("pow", pow)):
+    setattr(Sweep, "__{}__".format(name), lambda self, other, operation=operation: self.apply(other, operation))
+    setattr(Sweep, "__r{}__".format(name), lambda self, other, operation=operation: self.apply(other, lambda a, b: operation(b, a)))
+
+# A Sweep or a number that is the same at every thickness, as a sequence with one value per thickness
+def expand(value, count):
+    return value if isinstance(value, Sweep) else (value,) * count
+
+# _scope_ holds the parameters of the document, the thickness and everything derived from it as Sweeps
+def evaluateExpression(code, scope):
+    # Expressions that only use parameters and arithmetic can be evaluated for the whole sweep at once,
+    # anything else (function calls, attributes, comparisons) is evaluated per thickness
+    if set(code.co_names) <= set(scope):
+        try:
+            value = eval(code, EXPRESSION_GLOBALS, scope)
+            return value if isinstance(value, Sweep) else float(value)
+        except (TypeError, ArithmeticError):
+            pass
+    return Sweep(float(eval(code, EXPRESSION_GLOBALS, {name: value[step] if isinstance(value, Sweep) else value for name, value in scope.items()}))
+                 for step in range(len(scope["thickness"])))
+
+# The commands of a template, where every argument is a number or a Sweep
+def evaluateTemplate(template, scope):
+    return [(letter, [evaluateExpression(compile(arg, "<template>", "eval"), scope) if isinstance(arg, str) else arg for arg in args])
+            for letter, args in parseTemplate(template)]
+
+# Follows the commands once for all thicknesses. Curves and arcs are represented by their chord.
+# Returns the segments as (command index, letter, start, end) and the subpaths as (first segment, end, closed).
+def traceTemplate(commands):
+    x = y = startX = startY = 0.0
+    segments, subpaths = [], []
+    first = 0
+    for index, (letter, args) in enumerate(commands):
+        lower = letter.lower()
+        relative = letter == lower
+        if lower == "z":
+            segments.append((index, letter, (x, y), (startX, startY)))
+            subpaths.append((first, len(segments), True))
+            first = len(segments)
+            x, y = startX, startY
+            continue
+        if lower == "h":
+            nextX, nextY = x + args[0] if relative else args[0], y
+        elif lower == "v":
+            nextX, nextY = x, y + args[0] if relative else args[0]
+        elif relative:
+            nextX, nextY = x + args[-2], y + args[-1]
+        else:
+            nextX, nextY = args[-2], args[-1]
+        if lower == "m":
+            if len(segments) > first:
+                subpaths.append((first, len(segments), False))
+            first = len(segments)
+            startX, startY = nextX, nextY
+        else:
+            segments.append((index, letter, (x, y), (nextX, nextY)))
+        x, y = nextX, nextY
+    if len(segments) > first:
+        subpaths.append((first, len(segments), False))
+    return segments, subpaths
+
+# The pairs of segments that cross, found through a uniform grid over their bounding boxes.
+# Neighbours share an end point and are skipped, as are segments that only touch within _tolerance_.
+def crossings(lines, neighbours, tolerance):
+    if len(lines) < 3:
+        return set()
+    boxes = [(min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)) for x0, y0, x1, y1 in lines]
+    left = min(box[0] for box in boxes)
+    top = min(box[1] for box in boxes)
+    # Cells about the size of an average segment, such that each one only holds a few
+    size = max(sum(max(right - x, bottom - y) for x, y, right, bottom in boxes) / len(boxes), tolerance, 1e-9)
+    grid = {}
+    for index, (x, y, right, bottom) in enumerate(boxes):
+        rows = range(int((y - top) // size), int((bottom - top) // size) + 1)
+        for column in range(int((x - left) // size), int((right - left) // size) + 1):
+            for row in rows:
+                grid.setdefault((column, row), []).append(index)
+
+    found, tested = set(), set()
+    for cell in grid.values():
+        for position, a in enumerate(cell):
+            ax0, ay0, ax1, ay1 = lines[a]
+            aLeft, aTop, aRight, aBottom = boxes[a]
+            lengthA = None
+            for b in cell[position + 1:]:
+                bLeft, bTop, bRight, bBottom = boxes[b]
+                if aRight < bLeft or bRight < aLeft or aBottom < bTop or bBottom < aTop or (a, b) in neighbours or (a, b) in tested:
+                    continue
+                tested.add((a, b))
+                # The ends of each segment have to lie on different sides of the other one, further than the tolerance
+                bx0, by0, bx1, by1 = lines[b]
+                if lengthA is None:
+                    lengthA = hypot(ax1 - ax0, ay1 - ay0) * tolerance
+                d1 = (ax1 - ax0) * (by0 - ay0) - (ay1 - ay0) * (bx0 - ax0)
+                d2 = (ax1 - ax0) * (by1 - ay0) - (ay1 - ay0) * (bx1 - ax0)
+                if not ((d1 > lengthA and d2 < -lengthA) or (d1 < -lengthA and d2 > lengthA)):
+                    continue
+                lengthB = hypot(bx1 - bx0, by1 - by0) * tolerance
+                d3 = (bx1 - bx0) * (ay0 - by0) - (by1 - by0) * (ax0 - bx0)
+                d4 = (bx1 - bx0) * (ay1 - by0) - (by1 - by0) * (ax1 - bx0)
+                if (d3 > lengthB and d4 < -lengthB) or (d3 < -lengthB and d4 > lengthB):
+                    found.add((a, b))
+    return found
+
+# Checks one template, the first thickness of the sweep is the reference the other ones are compared to.
+# Returns a list of problems as (check, command index, letter, other command index or None, index into the sweep, value).
+def checkTemplate(template, scope, tolerance=0.01, maxRotation=0):
+    count = len(scope["thickness"])
+    segments, subpaths = traceTemplate(evaluateTemplate(template, scope))
+    # One sequence per coordinate, with one value per thickness
+    starts = [(expand(start[0], count), expand(start[1], count)) for _, _, start, _ in segments]
+    ends = [(expand(end[0], count), expand(end[1], count)) for _, _, _, end in segments]
+    problems = []
+
+    # Subpaths that end where they started at the reference thickness have to keep doing so.
+    # The closing segment drawn by z is left out, it closes any gap by itself.
+    for first, end, closed in subpaths:
+        last = end - 2 if closed else end - 1
+        if last < first:
+            continue
+        gaps = list(map(hypot, map(sub, ends[last][0], starts[first][0]), map(sub, ends[last][1], starts[first][1])))
+        if gaps[0] <= tolerance:
+            problems.extend(("closure", segments[last][0], segments[last][1], None, step, gaps[step]) for step in range(1, count) if gaps[step] > tolerance)
+
+    # Segments don't reverse their direction. Turning is only reported if _maxRotation_ is given,
+    # some templates do that on purpose, e.g., the slanted sides of flaps.
+    for (index, letter, _, _), (x0, y0), (x1, y1) in zip(segments, starts, ends):
+        dx, dy = list(map(sub, x1, x0)), list(map(sub, y1, y0))
+        if hypot(dx[0], dy[0]) <= tolerance:
+            continue
+        for step in range(1, count):
+            dot = dx[0] * dx[step] + dy[0] * dy[step]
+            angle = degrees(atan2(abs(dx[0] * dy[step] - dy[0] * dx[step]), dot))
+            if dot <= 0:
+                problems.append(("inverted", index, letter, None, step, angle))
+            elif maxRotation and angle > maxRotation:
+                problems.append(("rotated", index, letter, None, step, angle))
+
+    # Segments that only start to cross at some thickness. Those that already cross at the reference are left alone.
+    neighbours = set()
+    for first, end, closed in subpaths:
+        neighbours.update((segment, segment + 1) for segment in range(first, end - 1))
+        if closed and end - first > 2:
+            neighbours.add((first, end - 1))
+    reference = None
+    for step in range(count):
+        lines = [(x0[step], y0[step], x1[step], y1[step]) for (x0, y0), (x1, y1) in zip(starts, ends)]
+        found = crossings(lines, neighbours, tolerance)
+        if reference is None:
+            reference = found
+            continue
+        problems.extend(("intersection", segments[a][0], segments[a][1], segments[b][0], step, 0.0) for a, b in sorted(found - reference))
+    return problems
+
+def sweepThicknesses(reference, options):
+    steps = max(int(options.steps), 2)
+    return Sweep([reference] + [options.min_thickness + (options.max_thickness - options.min_thickness) * step / (steps - 1) for step in range(steps)])
+
+# Validates all templates of a document. Returns a list of problems as dictionaries, one per check and segment,
+# with the thicknesses at which they occur. The results of checkTemplate are kept in _cache_ if one is given, such that
+# a template that was already checked with the same parameters isn't checked again, e.g., in watch mode.
+def validateDocument(root, options, cache=None):
+    value = root.get(LASER + "material-thickness")
+    reference = options.reference or (float(value) if value else 3.0)
+    sweep = sweepThicknesses(reference, options)
+    problems = []
+    tree = root.getroottree()
+    # The custom parameters of the document, the ones derived from the thickness become Sweeps as well
+    try:
+        model = ParameterModel(root, targets=False)
+        scope = dict(model.values, thickness=sweep)
+        for name in model.order:
+            scope[name] = evaluateExpression(model.codes[name], scope)
+    except Exception as error:
+        return reference, [{"element": tree.getpath(root), "check": "parameters", "message": "{}: {}".format(type(error).__name__, error)}]
+    parameters = repr(sorted(scope.items()))
+    nodes = root.xpath("//*[@laser:template or @laser:template-segments]", namespaces={"laser": LASER_NAMESPACE})
+    for node in nodes:
+        element = node.get("id") or tree.getpath(node)
+        try:
+            template = node.get(LASER + "template") or expandTemplate(node.get("d", ""), node.get(LASER + "template-segments"))
+            if cache is None:
+                found = checkTemplate(template, scope, options.tolerance, options.max_rotation)
+            else:
+                try:
+                    found = cache[template, parameters]
+                except KeyError:
+                    found = cache[template, parameters] = checkTemplate(template, scope, options.tolerance, options.max_rotation)
+        except Exception as error:
+            problems.append({"element": element, "check": "template", "message": "{}: {}".format(type(error).__name__, error)})
+            continue
+        merged = {}
+        for check, segment, letter, other, step, amount in found:
+            entry = merged.setdefault((check, segment, other), {"element": element, "check": check, "segment": segment, "command": letter,
+                                                                "thicknesses": [], "value": 0.0})
+            if other is not None:
+                entry["other"] = other
+            entry["thicknesses"].append(round(sweep[step], 6))
+            entry["value"] = round(max(entry["value"], amount), 6)
+        problems.extend(merged.values())
+    return reference, problems
+
+def validateFile(path, options):
+    from lxml import etree
+    try:
+        parser = etree.XMLParser(huge_tree=True, recover=True)
+        reference, problems = validateDocument(etree.parse(path, parser=parser).getroot(), options)
+    except (OSError, etree.LxmlError) as error:
+        return {"file": path, "error": str(error), "problems": []}
+    return {"file": path, "reference": reference, "problems": problems}
+
+# All .svg files in the given files and directories
+def collectFiles(inputs):
+    for path in inputs:
+        if os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    if name.lower().endswith(".svg"):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+def formatProblem(problem):
+    if problem["check"] in ("template", "parameters"):
+        return "{}: {}".format(problem["element"], problem["message"])
+    thicknesses = problem["thicknesses"]
+    where = "at {}".format(thicknesses[0]) if len(thicknesses) == 1 else "between {} and {}".format(thicknesses[0], thicknesses[-1])
+    segment = "{} segment {} ({})".format(problem["element"], problem["segment"], problem["command"])
+    if problem["check"] == "closure":
+        return "{}: the subpath is open by up to {:.3f} {}".format(segment, problem["value"], where)
+    if problem["check"] == "intersection":
+        return "{}: crosses segment {} {}".format(segment, problem["other"], where)
+    return "{}: {} by up to {:.1f}° {}".format(segment, problem["check"], problem["value"], where)
+
+def formatReport(results):
+    lines = []
+    for result in results:
+        if "error" in result:
+            lines.append("{}: {}".format(result["file"], result["error"]))
+        lines.extend("{}: {}".format(result["file"], formatProblem(problem)) for problem in result["problems"])
+    count = sum(len(result["problems"]) for result in results)
+    lines.append("{} problem{} in {} file{}".format(count, "" if count == 1 else "s", len(results), "" if len(results) == 1 else "s"))
+    return "\n".join(lines)
+
+def addArguments(pars):
+    pars.add_argument("--min_thickness", type=float, default=1, help="The smallest material thickness to check")
+    pars.add_argument("--max_thickness", type=float, default=10, help="The largest material thickness to check")
+    pars.add_argument("--steps", type=int, default=10, help="Number of thicknesses to check between the smallest and the largest")
+    pars.add_argument("--reference", type=float, default=0, help="The thickness at which the templates are known to be correct, 0 uses the thickness of the document")
+    pars.add_argument("--tolerance", type=float, default=0.01, help="Distances below this are treated as zero, in user units")
+    pars.add_argument("--max_rotation", type=float, default=0, help="How far a segment may turn over the sweep in degrees, 0 doesn't check it")
+    pars.add_argument("--json", default="", help="Write the report as JSON to this file")
+    pars.add_argument("--format", default="json", help="Print the report as json to stdout, or as text to stderr")
+    pars.add_argument("--processes", type=int, default=0, help="Number of worker processes for many files, 0 uses all cores")
+    pars.add_argument("--headless", default="true", help="Run without inkex")
+    pars.add_argument("--tab", help="The selected UI-tab when OK was pressed")
+
+def writeReport(results, options):
+    if options.json:
+        with open(options.json, "w") as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+
+# Without inkex the report is written as JSON, to stdout or to the file given with --json, and the exit status is 1 if
+# there are problems. Inkscape asks for the text format, which goes to stderr and is shown in a message window.
+def runHeadless(args):
+    import argparse
+    from functools import partial
+    pars = argparse.ArgumentParser(add_help=False)
+    addArguments(pars)
+    pars.add_argument("--output")
+    pars.add_argument("inputs", nargs="*")
+    options, _ = pars.parse_known_args(args)
+    if options.headless != "true":
+        return False
+
+    files = list(collectFiles(options.inputs)) or [sys.stdin.buffer]
+    if len(files) < PARALLEL_THRESHOLD:
+        results = [validateFile(path, options) for path in files]
+    else:
+        from multiprocessing import Pool
+        with Pool(options.processes or None) as pool:
+            results = pool.map(partial(validateFile, options=options), files, chunksize=8)
+    for result in results:
+        if not isinstance(result["file"], str):
+            result["file"] = "<stdin>"
+
+    writeReport(results, options)
+    if options.format == "text":
+        sys.stderr.write(formatReport(results) + "\n")
+        return True
+    if not options.json:
+        json.dump(results, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+    if any(result["problems"] or "error" in result for result in results):
+        sys.exit(1)
+    return True
+
+if __name__ == '__main__' and runHeadless(sys.argv[1:]):
+    sys.exit(0)
+
+import inkex
+
+class LaserSVGValidate(LaserSVGMixin, inkex.EffectExtension):
+
+    def add_arguments(self, pars):
+        addArguments(pars)
+
+    def effect(self):
+        # Only the templates are read, the drawing stays as it is
+        reference, problems = validateDocument(self.document.getroot(), self.options)
+        results = [{"file": self.options.input_file, "reference": reference, "problems": problems}]
+        writeReport(results, self.options)
+        inkex.utils.debug(formatReport(results))
+        return False
+
+if __name__ == '__main__':
+    LaserSVGValidate().run()
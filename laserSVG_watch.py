@@ -0,0 +1,305 @@
+#!/usr/bin/env python
+# coding=utf-8
+#
+# Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+# Watches a directory and writes the cut files for several materials whenever a design is saved, e.g., while it is
+# edited in Inkscape:
+#
+#   python laserSVG_watch.py designs/ --output cut/ --material 3 --material plywood=4:0.15
+#
+# A material is a thickness with an optional kerf and name, box.svg becomes cut/box-3.svg and cut/box-plywood.svg.
+# Every design is also validated between the thinnest and the thickest material (see laserSVG_validate.py).
+# A file is processed once it didn't change for a moment, such that a save that is still being written is left alone.
+# The state of every file stays in memory: the values of its templates and primitives for each material, and the
+# results of the validation. After a save, only the elements that changed are evaluated and validated again, the
+# others get their values from the last run. Output files are only written if their content changed.
+
+import argparse
+import hashlib
+import os
+import sys
+import time
+
+from lxml import etree
+
+from laserSVG_core import LASER, ParameterModel, registerNamespace, adjustElementThickness
+
+# The attributes of a primitive that depend on the thickness
+ADJUSTED = {"x", "y", "width", "height", "r", "rx", "ry", LASER + "x", LASER + "y", LASER + "centerX", LASER + "centerY"}
+
+
+class Material(object):
+
+    # name=thickness:kerf, the name and the kerf are optional
+    def __init__(self, text):
+        name, _, value = text.rpartition("=")
+        thickness, _, kerf = value.partition(":")
+        try:
+            self.thickness = float(thickness)
+            self.kerf = float(kerf) if kerf else None
+        except ValueError:
+            raise argparse.ArgumentTypeError("Not a material: {}, expected name=thickness:kerf".format(text))
+        # The settings are written as given, like the parameter control does
+        self.settings = {"material-thickness": thickness}
+        if kerf:
+            self.settings["kerf"] = kerf
+        self.name = name or "-".join(part for part in (thickness, kerf) if part)
+
+    def changes(self):
+        changes = {"thickness": self.thickness}
+        if self.kerf is not None:
+            changes["kerf"] = self.kerf
+        return changes
+
+
+# A dictionary for the results of a run that falls back to the ones of the run before. Results that are not used again
+# are dropped with the previous run, so the state of a file doesn't grow while it is edited.
+class Generation(dict):
+
+    def __init__(self, previous=None):
+        dict.__init__(self)
+        self.previous = previous if previous is not None else {}
+        # The previous run has everything it used by now
+        if isinstance(previous, Generation):
+            previous.previous = {}
+
+    def __missing__(self, key):
+        value = self[key] = self.previous[key]
+        return value
+
+
+# What we know about a file from its last run
+class WatchedFile(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.seen = 0
+        self.pending = False
+        self.digest = None
+        self.elements = set()
+        # The values of the targets and the primitives, by the attributes of their element and the parameters of its scope
+        self.results = Generation()
+        self.checked = Generation()
+        # The digests of the files written for this design
+        self.outputs = {}
+
+    def process(self, data, materials, options, validation=None):
+        started = time.perf_counter()
+        parser = etree.XMLParser(huge_tree=True, strip_cdata=False, recover=True)
+        document = etree.ElementTree(etree.fromstring(data, parser=parser))
+        root = document.getroot()
+        model = ParameterModel(root)
+        baseThickness = model.values["thickness"]
+        primitives = model.primitivesOf(0)
+
+        # An element is identified by its attributes, it only has to be evaluated again if one of them changed
+        signatures = {}
+        for node in [target[0] for target in model.targets] + primitives:
+            if node not in signatures:
+                signatures[node] = (node.tag, tuple(sorted(node.attrib.items())))
+        elements = set(signatures.values())
+        changed = len(elements - self.elements)
+        self.elements = elements
+        results = self.results = Generation(self.results)
+        evaluated = 0
+
+        # Before the materials are applied, the reference of the validation is the thickness of the document
+        problems = None
+        if validation is not None:
+            from laserSVG_validate import validateDocument
+            self.checked = Generation(self.checked)
+            _, problems = validateDocument(root, validation, self.checked)
+
+        # Materials without a kerf keep the one of the document
+        kerf = (root.get(LASER + "kerf"), model.values["kerf"])
+
+        written = []
+        for material in materials:
+            changes = material.changes()
+            for attribute, value in material.settings.items():
+                root.set(LASER + attribute, value)
+            if material.kerf is None:
+                if kerf[0] is None:
+                    root.attrib.pop(LASER + "kerf", None)
+                else:
+                    root.set(LASER + "kerf", kerf[0])
+                changes["kerf"] = kerf[1]
+            model.update(changes, evaluate=False)
+            scopes = [repr(sorted(values.items())) for values in model.scopeValues]
+
+            missing = []
+            for node in primitives:
+                key = (signatures[node], baseThickness, material.settings["material-thickness"])
+                try:
+                    for attribute, value in results[key]:
+                        node.set(attribute, value)
+                except KeyError:
+                    missing.append((node, key))
+            adjustElementThickness(root, material.settings["material-thickness"], baseThickness, [node for node, _ in missing])
+            for node, key in missing:
+                # In the order of the document, attributes that are added come out in the same place
+                results[key] = [(attribute, value) for attribute, value in node.attrib.items() if attribute in ADJUSTED]
+
+            missing = []
+            for index, (node, attribute, _, _, scope) in enumerate(model.targets):
+                key = (signatures[node], attribute, scopes[scope])
+                try:
+                    node.set(attribute, results[key])
+                except KeyError:
+                    missing.append((index, key))
+            model.evaluate([index for index, _ in missing])
+            for index, key in missing:
+                node, attribute = model.targets[index][:2]
+                results[key] = node.get(attribute)
+            evaluated += len(missing)
+
+            name = os.path.splitext(os.path.basename(self.path))[0]
+            if self.write(os.path.join(options.output, "{}-{}.svg".format(name, material.name)), etree.tostring(document)):
+                written.append(material.name)
+
+        return {"file": self.path, "changed": changed, "elements": len(elements), "evaluated": evaluated, "written": written,
+                "problems": problems, "time": time.perf_counter() - started}
+
+    # Returns whether the file was written, the ones with the same content are left alone
+    def write(self, path, data):
+        digest = hashlib.sha256(data).digest()
+        if self.outputs.get(path) == digest and os.path.exists(path):
+            return False
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+        self.outputs[path] = digest
+        return True
+
+
+class Watcher(object):
+
+    def __init__(self, options):
+        self.options = options
+        self.files = {}
+        self.output = os.path.realpath(options.output)
+        self.validation = None
+        if options.validate == "true":
+            from laserSVG_validate import addArguments
+            pars = argparse.ArgumentParser(add_help=False)
+            addArguments(pars)
+            self.validation = pars.parse_args([])
+            thicknesses = [material.thickness for material in options.materials]
+            if thicknesses:
+                self.validation.min_thickness, self.validation.max_thickness = min(thicknesses), max(thicknesses)
+                self.validation.steps = max(len(thicknesses), 2)
+
+    # The designs in the watched directory and their modification time and size
+    def scan(self):
+        found = {}
+        for directory, names, files in os.walk(self.options.directory):
+            # The cut files are not designs, even if they are written into the watched directory
+            names[:] = [name for name in names if os.path.realpath(os.path.join(directory, name)) != self.output]
+            if os.path.realpath(directory) == self.output:
+                continue
+            for name in files:
+                if name.lower().endswith(".svg"):
+                    path = os.path.join(directory, name)
+                    try:
+                        status = os.stat(path)
+                    except OSError:
+                        continue
+                    found[path] = (status.st_mtime_ns, status.st_size)
+        return found
+
+    # Processes the files that changed and then didn't change for the debounce time, returns their reports
+    def poll(self, now=None, debounce=None):
+        now = time.monotonic() if now is None else now
+        debounce = self.options.debounce if debounce is None else debounce
+        found = self.scan()
+        for path in set(self.files) - set(found):
+            del self.files[path]
+        reports = []
+        for path, stamp in sorted(found.items()):
+            state = self.files.get(path)
+            if state is None:
+                state = self.files[path] = WatchedFile(path)
+            if stamp != state.stamp:
+                state.stamp, state.seen, state.pending = stamp, now, True
+            if not state.pending or now - state.seen < debounce:
+                continue
+            state.pending = False
+            try:
+                with open(path, "rb") as document:
+                    data = document.read()
+            except OSError:
+                continue
+            digest = hashlib.sha256(data).digest()
+            if digest == state.digest:
+                # Saved without changes
+                continue
+            try:
+                report = state.process(data, self.options.materials, self.options, self.validation)
+            except Exception as error:
+                report = {"file": path, "error": "{}: {}".format(type(error).__name__, error)}
+            state.digest = digest
+            reports.append(report)
+        return reports
+
+    def run(self):
+        while True:
+            # A single run doesn't wait for saves in progress
+            for report in self.poll(debounce=0 if self.options.once else None):
+                printReport(report)
+            if self.options.once:
+                return
+            time.sleep(self.options.interval)
+
+
+def printReport(report):
+    if "error" in report:
+        print("{}: {}".format(report["file"], report["error"]), file=sys.stderr)
+        return
+    print("{}: {} of {} parametric elements changed, {} values evaluated, {} written in {:.0f} ms".format(
+        report["file"], report["changed"], report["elements"], report["evaluated"],
+        ", ".join(report["written"]) or "nothing", report["time"] * 1000), file=sys.stderr)
+    if report["problems"]:
+        from laserSVG_validate import formatProblem
+        for problem in report["problems"]:
+            print("{}: {}".format(report["file"], formatProblem(problem)), file=sys.stderr)
+
+def main():
+    pars = argparse.ArgumentParser(description="Write the cut files of LaserSVG designs for several materials whenever they are saved")
+    pars.add_argument("directory", help="The directory with the designs")
+    pars.add_argument("--output", required=True, help="The directory for the cut files")
+    pars.add_argument("--material", action="append", type=Material, dest="materials", default=[],
+                      help="A material as name=thickness:kerf, the name and the kerf are optional. Can be given more than once.")
+    pars.add_argument("--validate", default="true", help="Validate the templates between the thinnest and the thickest material")
+    pars.add_argument("--debounce", type=float, default=0.3, help="Seconds a file has to stay unchanged before it is processed")
+    pars.add_argument("--interval", type=float, default=0.1, help="Seconds between two looks at the directory")
+    pars.add_argument("--once", action="store_true", help="Process all files once and exit")
+    options = pars.parse_args()
+    if not options.materials:
+        pars.error("Please give at least one --material")
+    os.makedirs(options.output, exist_ok=True)
+    registerNamespace()
+    try:
+        Watcher(options).run()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
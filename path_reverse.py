@@ -22,6 +22,8 @@
 
 import inkex
 
+from laserSVG_api import reversePath
+
 class PathReverse(inkex.EffectExtension):
 
     def add_arguments(self, pars):
@@ -33,10 +35,10 @@ class PathReverse(inkex.EffectExtension):
 
         # Take a first path segment
         for pathID in self.options.ids:
-            path = self.svg.getElementById(pathID).original_path
+            path = self.svg.getElementById(pathID).get("d")
             inkex.utils.debug(path)
 
-            reversedPath = path.reverse()
+            reversedPath = reversePath(path)
             inkex.utils.debug(reversedPath)
 
             self.svg.getElementById(pathID).set("d",reversedPath)
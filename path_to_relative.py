@@ -1,4 +1,4 @@
- #!/usr/bin/env python
+#!/usr/bin/env python
 # coding=utf-8
 #
 # Copyright (C) 2020 Florian Heller, florian.heller@uhasselt.be
@@ -20,20 +20,37 @@
 
 import inkex
 
+from laserSVG_core import normalizeAll
+
 class PathToRelative(inkex.EffectExtension):
 
     def add_arguments(self, pars):
-        pass
+        pars.add_argument("--scope", default="selection", help="Normalize the selected paths or all paths in the document")
+        pars.add_argument("--mode", default="relative", help="Write relative, absolute, or whichever is shorter per path")
+        pars.add_argument("--precision", type=int, default=-1, help="Number of decimal places to keep, -1 keeps the coordinates as they are")
+        pars.add_argument("--processes", type=int, default=0, help="Number of worker processes, 0 uses all cores")
+        pars.add_argument("--chunk_size", type=int, default=64, help="Number of paths handed to a worker at once")
 
     def effect(self):
-        if not self.svg.selected:
-            raise inkex.AbortExtension("Please select an object.")
-       
-        for pathID in self.options.ids:
-            path = self.svg.getElementById(pathID)
+        if self.options.scope == "document":
+            paths = self.document.getroot().iterfind(".//{http://www.w3.org/2000/svg}path[@d]")
+        else:
+            if not self.svg.selected:
+                raise inkex.AbortExtension("Please select an object.")
+            paths = [self.svg.getElementById(pathID) for pathID in self.options.ids]
+
+        # Collect the raw path data first, so that only strings cross the process boundary
+        nodes = {}
+        jobs = []
+        for path in paths:
+            if path is None or path.get("d") is None:
+                continue
+            nodes[len(jobs)] = path
+            jobs.append((len(jobs), path.get("d")))
 
+        for index, d in normalizeAll(jobs, self.options.precision, self.options.mode, self.options.processes, self.options.chunk_size):
             #assume default namespace for d-attribute
-            path.set("d",path.original_path.to_relative())
+            nodes[index].set("d", d)
 
 if __name__ == '__main__':
     PathToRelative().run()